@@ -24,7 +24,7 @@ def create_app():
     
     # Session configuration
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
-    app.config['SESSION_COOKIE_SECURE'] = True
+    app.config['SESSION_COOKIE_SECURE'] = os.environ.get('SESSION_COOKIE_SECURE', 'true').lower() == 'true'
     app.config['SESSION_COOKIE_HTTPONLY'] = True
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     
@@ -44,6 +44,71 @@ def create_app():
     app.config['MPESA_PASSKEY'] = os.environ.get('MPESA_PASSKEY')
     app.config['MPESA_ENVIRONMENT'] = os.environ.get('MPESA_ENVIRONMENT', 'sandbox')
     
+    # MPESA OAuth tokens are shared by this host's workers through MPESA_TOKEN_CACHE
+    # (instance/mpesa_token.json by default) and refreshed MPESA_TOKEN_MARGIN
+    # seconds before they expire
+    app.config['MPESA_TOKEN_CACHE'] = os.environ.get('MPESA_TOKEN_CACHE') or os.path.join(app.instance_path, 'mpesa_token.json')
+    app.config['MPESA_TOKEN_MARGIN'] = int(os.environ.get('MPESA_TOKEN_MARGIN', 60))
+    
+    # Principal loading: 'eager' fetches the user with department and profile
+    # in one statement; 'lazy' loads them on access. Roles and permissions come
+    # from the set cached in the login session either way
+    app.config['PRINCIPAL_LOADER'] = os.environ.get('PRINCIPAL_LOADER', 'eager')
+    
+    # Months shown in the admin dashboard attendance trend; each worker caches
+    # closed months for ATTENDANCE_TREND_TTL seconds (0 disables the cache)
+    app.config['ATTENDANCE_TREND_MONTHS'] = int(os.environ.get('ATTENDANCE_TREND_MONTHS', 12))
+    app.config['ATTENDANCE_TREND_TTL'] = int(os.environ.get('ATTENDANCE_TREND_TTL', 300))
+    
+    # List pagination: 'keyset' (cursor tokens) or 'offset' (numbered pages);
+    # totals (PAGINATION_COUNT) are cached for PAGINATION_COUNT_TTL seconds
+    app.config['PAGINATION_MODE'] = os.environ.get('PAGINATION_MODE', 'keyset')
+    app.config['PAGINATION_COUNT_TTL'] = int(os.environ.get('PAGINATION_COUNT_TTL', 60))
+    app.config['PAGINATION_COUNT'] = os.environ.get('PAGINATION_COUNT', 'true').lower() == 'true'
+    
+    # Per-request query statistics (off by default): Server-Timing header, N+1
+    # warnings for statements repeated QUERY_REPEAT_THRESHOLD times, optional log line
+    app.config['QUERY_STATS'] = os.environ.get('QUERY_STATS', 'false').lower() == 'true'
+    app.config['QUERY_REPEAT_THRESHOLD'] = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+    app.config['QUERY_STATS_LOG'] = os.environ.get('QUERY_STATS_LOG', 'false').lower() == 'true'
+    
+    # Sampling profiler (opt-in): profiles PROFILER_SAMPLE_RATE of requests, or
+    # an admin's request carrying PROFILER_HEADER, into collapsed-stack files
+    # under PROFILER_OUTPUT (instance/profiles by default)
+    app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+    app.config['PROFILER_SAMPLE_RATE'] = float(os.environ.get('PROFILER_SAMPLE_RATE', 0.0))
+    app.config['PROFILER_HEADER'] = os.environ.get('PROFILER_HEADER', 'X-Profile')
+    app.config['PROFILER_INTERVAL'] = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+    app.config['PROFILER_OUTPUT'] = os.environ.get('PROFILER_OUTPUT')
+    
+    # Prometheus metrics at /metrics; METRICS_TOKEN requires 'Authorization: Bearer <token>'.
+    # Without a token /metrics is only served when the app runs in debug mode.
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    
+    # Payroll runs: one unit per department on a pool of PAYROLL_WORKERS
+    # processes (0 = one per core), in a background thread of the request that
+    # starts them; a run without a heartbeat for PAYROLL_RUN_STALE_SECONDS is
+    # treated as crashed and can be resumed
+    app.config['PAYROLL_WORKERS'] = int(os.environ.get('PAYROLL_WORKERS', 0))
+    app.config['PAYROLL_RUN_BACKGROUND'] = os.environ.get('PAYROLL_RUN_BACKGROUND', 'true').lower() == 'true'
+    app.config['PAYROLL_RUN_STALE_SECONDS'] = int(os.environ.get('PAYROLL_RUN_STALE_SECONDS', 600))
+    
+    # Payslips: rendered as PAYSLIP_FORMAT (html, or pdf with WeasyPrint) on a pool
+    # of PAYSLIP_WORKERS processes (0 = one per core) into PAYSLIP_DIR
+    # (instance/payslips by default), emailed PAYSLIP_EMAIL_BATCH per SMTP connection
+    app.config['PAYSLIP_FORMAT'] = os.environ.get('PAYSLIP_FORMAT', 'html')
+    app.config['PAYSLIP_WORKERS'] = int(os.environ.get('PAYSLIP_WORKERS', 0))
+    app.config['PAYSLIP_DIR'] = os.environ.get('PAYSLIP_DIR') or os.path.join(app.instance_path, 'payslips')
+    app.config['PAYSLIP_EMAIL_BATCH'] = int(os.environ.get('PAYSLIP_EMAIL_BATCH', 100))
+    
+    # Clock-ins, imports, payroll and counters write with INSERT ... ON CONFLICT
+    from sqlalchemy.engine import make_url
+    from utils.attendance import UPSERT_INSERTS
+    backend = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if backend not in UPSERT_INSERTS:
+        raise RuntimeError(f"DATABASE_URL uses {backend}, which is not supported: use PostgreSQL or SQLite")
+    
     # Initialize extensions with app
     db.init_app(app)
     login_manager.init_app(app)
@@ -51,6 +116,15 @@ def create_app():
     migrate.init_app(app, db)
     csrf.init_app(app)
     
+    from utils.query_stats import init_query_stats
+    init_query_stats(app)
+    
+    from utils.profiler import init_profiler
+    init_profiler(app)
+    
+    from utils.metrics import init_metrics
+    init_metrics(app)
+    
     # Login manager configuration
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
@@ -58,11 +132,12 @@ def create_app():
     
     # Import models
     from models import User, Department, Role, Permission
+    from utils.principal import load_principal
     
     # User loader for Flask-Login
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return load_principal(int(user_id))
     
     # Register blueprints
     from routes.auth import auth_bp
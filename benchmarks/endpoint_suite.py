@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark suite for the Mutech Civil HRM System
+
+Runs the hot paths through the Flask test client against a database seeded
+by manage.py generate-dataset (or --generate) and reports, per scenario,
+latency percentiles, statements per request and peak Python memory. Results
+are written as JSON; with --baseline the run is compared against an earlier
+result file and the exit status is 1 when a scenario regressed.
+
+The suite refuses databases holding users the generator did not create, and
+deletes its admin account, payment and generated payroll month when done.
+
+Usage:
+    python benchmarks/endpoint_suite.py --generate 2000 --output baseline.json
+    python benchmarks/endpoint_suite.py --baseline baseline.json --output current.json
+    python benchmarks/endpoint_suite.py --scenario admin.users --iterations 200
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///bench_endpoints.db')
+
+from app import create_app, db
+from benchmarks.safety import refuse_unless_generated
+
+BENCH_ADMIN_EMAIL = 'bench.admin@mutechcivil.com'
+BENCH_CHECKOUT_ID = 'ws_CO_BENCH_0001'
+PASSWORD = 'password123'
+
+class Scenario:
+    """One request to time, with the user it runs as and per-iteration setup"""
+
+    def __init__(self, name, url, user=None, method='GET', data=None, json=None, setup=None):
+        self.name = name
+        self.url = url
+        self.user = user
+        self.method = method
+        self.data = data
+        self.json = json
+        self.setup = setup
+
+def recent_weekday(day):
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+def prepare_fixtures():
+    """Benchmark admin, a sample employee and a pending MPESA payment"""
+    from models import User, Role, Department, Payment, Payroll, PayrollRun, Attendance
+
+    employee = User.query.filter(User.is_active.is_(True), User.salary.isnot(None)).order_by(User.id).first()
+    if employee is None:
+        raise SystemExit('No employees found; seed the database with --generate or manage.py generate-dataset')
+
+    latest = db.session.query(db.func.max(Attendance.date)).scalar() or date.today()
+    attendance_date = recent_weekday(latest)
+    # The payroll scenario regenerates this month, so it must hold no payroll of its own
+    period = {'month': attendance_date.month, 'year': attendance_date.year}
+    if Payroll.query.filter_by(**period).first() or PayrollRun.query.filter_by(**period).first():
+        raise SystemExit(f"Payroll for {period['month']}/{period['year']} already exists; "
+                         "the suite only generates a month it can delete again")
+
+    admin = User(employee_id='BENCHADMIN', email=BENCH_ADMIN_EMAIL, first_name='Bench', last_name='Admin',
+                 department_id=Department.query.filter_by(code='ACHR').first().id)
+    admin.set_password(PASSWORD)
+    admin.roles.append(Role.query.filter_by(name='admin').first())
+    payment = Payment(user_id=employee.id, payment_type='salary', amount=1000, payment_method='mpesa',
+                      phone_number='254700000000', status='pending', checkout_request_id=BENCH_CHECKOUT_ID)
+    db.session.add_all([admin, payment])
+    db.session.commit()
+
+    return {'admin': admin.id, 'employee': employee.id, 'employee_email': employee.email,
+            'payment': payment.id, 'attendance_date': attendance_date}
+
+def clear_payroll(month, year):
+    """Delete a month's payroll, payslips and run, all generated by the suite"""
+    from models import Payroll, PayrollRun, PayrollRunUnit, Payslip
+
+    payroll_ids = db.select(Payroll.id).where(Payroll.month == month, Payroll.year == year)
+    db.session.execute(db.delete(Payslip).where(Payslip.payroll_id.in_(payroll_ids)))
+    db.session.execute(db.delete(Payroll).where(Payroll.month == month, Payroll.year == year))
+    run_ids = db.select(PayrollRun.id).where(PayrollRun.month == month, PayrollRun.year == year)
+    db.session.execute(db.delete(PayrollRunUnit).where(PayrollRunUnit.run_id.in_(run_ids)))
+    db.session.execute(db.delete(PayrollRun).where(PayrollRun.id.in_(run_ids)))
+    db.session.commit()
+
+def remove_fixtures(fixtures):
+    """Delete everything prepare_fixtures and the scenarios added"""
+    from models import Payment, User
+
+    db.session.rollback()
+    clear_payroll(fixtures['attendance_date'].month, fixtures['attendance_date'].year)
+    for row in (db.session.get(Payment, fixtures['payment']), db.session.get(User, fixtures['admin'])):
+        if row is not None:
+            db.session.delete(row)
+    db.session.commit()
+
+def scenarios(fixtures):
+    """The hot paths, in report order"""
+    from models import Payment
+
+    # A month with attendance but no payroll: the generator pays whole months only
+    payroll_month = fixtures['attendance_date']
+
+    def reset_payroll():
+        clear_payroll(payroll_month.month, payroll_month.year)
+
+    def reset_payment():
+        payment = db.session.get(Payment, fixtures['payment'])
+        payment.status = 'pending'
+        db.session.commit()
+
+    callback = {'Body': {'stkCallback': {
+        'MerchantRequestID': 'bench', 'CheckoutRequestID': BENCH_CHECKOUT_ID, 'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1000},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'BENCH00001'},
+            {'Name': 'TransactionDate', 'Value': 20240101120000},
+            {'Name': 'PhoneNumber', 'Value': 254700000000}
+        ]}
+    }}}
+
+    return [
+        Scenario('auth.login', '/auth/login', method='POST',
+                 data={'email': fixtures['employee_email'], 'password': PASSWORD}),
+        Scenario('dashboard.index', '/dashboard/', user='employee'),
+        Scenario('dashboard.attendance', '/dashboard/attendance', user='employee'),
+        Scenario('admin.dashboard', '/admin/dashboard', user='admin'),
+        Scenario('admin.users', '/admin/users?search=Kamau', user='admin'),
+        Scenario('admin.attendance', f"/admin/attendance?date={fixtures['attendance_date']:%Y-%m-%d}", user='admin'),
+        Scenario('payments.index', '/payments/', user='admin'),
+        Scenario('payments.generate_payroll', f'/payments/payroll/generate/{payroll_month.month}/{payroll_month.year}',
+                 user='admin', setup=reset_payroll),
+        Scenario('payments.mpesa_callback', '/payments/mpesa/callback', method='POST', json=callback,
+                 setup=reset_payment)
+    ]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+def prepare(client, scenario, fixtures):
+    """Run the scenario's setup and sign its user in, outside the timed request"""
+    from flask import g
+
+    if scenario.setup:
+        scenario.setup()
+
+    with client.session_transaction() as session:
+        session.clear()
+        if scenario.user:
+            session['_user_id'] = str(fixtures[scenario.user])
+            session['_fresh'] = True
+    db.session.remove()
+    # Requests share the suite's app context, where Flask-Login caches the user
+    g.pop('_login_user', None)
+
+def issue(client, scenario):
+    return client.open(scenario.url, method=scenario.method, data=scenario.data, json=scenario.json)
+
+def run_scenario(client, scenario, fixtures, iterations, warmup):
+    """Latency percentiles, statements per request and peak memory of a scenario"""
+    from utils.query_stats import capture_queries
+
+    latencies, queries, statuses = [], [], {}
+    with redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            prepare(client, scenario, fixtures)
+            issue(client, scenario)
+
+        for _ in range(iterations):
+            prepare(client, scenario, fixtures)
+            with capture_queries() as stats:
+                started = time.perf_counter()
+                response = issue(client, scenario)
+                latencies.append(time.perf_counter() - started)
+            queries.append(stats.count)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # Memory is traced on a separate request so tracing does not skew the timings
+        prepare(client, scenario, fixtures)
+        tracemalloc.start()
+        issue(client, scenario)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def to_ms(seconds):
+        return round(seconds * 1000, 3)
+
+    return {
+        'iterations': iterations,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p90_ms': to_ms(percentile(latencies, 0.90)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'mean_ms': to_ms(statistics.fmean(latencies)),
+        'max_ms': to_ms(max(latencies)),
+        'queries': statistics.median(queries),
+        'max_queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+    }
+
+def dataset_info():
+    from models import User, Attendance, LeaveRequest, Payment, Payroll
+    return {
+        'database': db.engine.dialect.name,
+        'users': User.query.count(),
+        'attendance': Attendance.query.count(),
+        'leave_requests': LeaveRequest.query.count(),
+        'payments': Payment.query.count(),
+        'payroll': Payroll.query.count()
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Regressions against a baseline run: slower p95, more queries or more memory"""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+        if current['max_queries'] > previous['max_queries']:
+            regressions.append(f"{name}: queries {previous['max_queries']} -> {current['max_queries']}")
+        if current['peak_memory_kb'] > previous['peak_memory_kb'] * (1 + threshold):
+            regressions.append(f"{name}: peak memory {previous['peak_memory_kb']:.0f} -> "
+                               f"{current['peak_memory_kb']:.0f} KB")
+        if set(current['statuses']) != set(previous['statuses']):
+            regressions.append(f"{name}: statuses {previous['statuses']} -> {current['statuses']}")
+    return regressions
+
+def run_suite(app, fixtures, args):
+    """Time every chosen scenario; returns the results document"""
+    client = app.test_client()
+    results = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'dataset': dataset_info(),
+        'scenarios': {}
+    }
+
+    print(f"{'scenario':28} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'peak KB':>9}  statuses")
+    for scenario in scenarios(fixtures):
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+
+        result = run_scenario(client, scenario, fixtures, args.iterations, args.warmup)
+        results['scenarios'][scenario.name] = result
+        print(f"{scenario.name:28} {result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f} "
+              f"{result['queries']:8g} {result['peak_memory_kb']:9.0f}  {result['statuses']}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HRM hot endpoints')
+    parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per scenario first')
+    parser.add_argument('--scenario', action='append', help='Run only these scenarios (repeatable)')
+    parser.add_argument('--generate', type=int, metavar='EMPLOYEES',
+                        help='Seed an empty database with this many employees first')
+    parser.add_argument('--years', type=float, default=1, help='Years of activity for --generate')
+    parser.add_argument('--seed', type=int, default=42, help='Dataset seed for --generate')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against an earlier results file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed p95 and memory growth over the baseline (default: 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SESSION_COOKIE_SECURE'] = False
+    app.config['PAGINATION_COUNT_TTL'] = 0
+    # Time the whole payroll run inside the request, on a single worker
+    app.config['PAYROLL_RUN_BACKGROUND'] = False
+    app.config['PAYROLL_WORKERS'] = 1
+    # Failing requests show up in the statuses column rather than as tracebacks
+    app.logger.disabled = True
+
+    with app.app_context():
+        db.create_all()
+        if args.generate:
+            from utils.dataset import generate_dataset
+            with redirect_stdout(io.StringIO()):
+                generate_dataset(employees=args.generate, years=args.years, seed=args.seed)
+        refuse_unless_generated()
+
+        fixtures = prepare_fixtures()
+        try:
+            results = run_suite(app, fixtures, args)
+        finally:
+            remove_fixtures(fixtures)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == '__main__':
+    main()
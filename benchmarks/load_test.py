@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the Mutech Civil HRM System
+
+Serves the app with real gunicorn workers (or targets --url) and replays
+bursts of simulated users over HTTP:
+
+    clock-in   the 8 AM wave: employees sign in and hit dashboard.clock_in
+               within a --ramp second window
+    payday     the month-end wave of payments.mpesa_callback posts
+    managers   managers signing in and paging through the admin lists
+
+Each request is recorded with its step label; the report gives throughput,
+error rate and latency percentiles per step, to size workers and the DB
+pool from measurements. Fixtures are prepared directly in the database the
+server uses (DATABASE_URL, or the app's default), which must have been
+filled by manage.py generate-dataset; the manager accounts and payday
+payments are deleted again when the run ends.
+
+Usage:
+    python benchmarks/load_test.py clock-in --users 500 --ramp 30 --workers 4
+    python benchmarks/load_test.py payday --callbacks 2000 --concurrency 50
+    python benchmarks/load_test.py managers --managers 20 --pages 5
+    python benchmarks/load_test.py all --url http://127.0.0.1:8000 --output load.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Add the project root to Python path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'password123'
+MANAGER_EMAIL = 'load.manager{}@mutechcivil.com'
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+NEXT_CURSOR = re.compile(r'href="[^"]*[?&;]cursor=([^"&]+)[^"]*"[^>]*>\s*(?:<i class="[^"]*chevron-right|Next)')
+MANAGER_LISTS = {'admin.users': '/admin/users', 'admin.attendance': '/admin/attendance',
+                 'admin.leave_requests': '/admin/leave_requests', 'payments.index': '/payments/'}
+
+class Recorder:
+    """Thread-safe log of (step, status, seconds, error) per request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, step, status, seconds, error=None):
+        with self.lock:
+            self.samples.append((step, status, seconds, error))
+
+    def request(self, session, step, method, url, ok=None, **kwargs):
+        """Send a request without following redirects and record it"""
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, allow_redirects=False, timeout=60, **kwargs)
+        except requests.RequestException as e:
+            self.record(step, None, time.perf_counter() - started, type(e).__name__)
+            return None
+
+        elapsed = time.perf_counter() - started
+        failed = response.status_code >= 400 or (ok is not None and not ok(response))
+        self.record(step, response.status_code, elapsed, f'HTTP {response.status_code}' if failed else None)
+        return None if failed else response
+
+    def report(self):
+        """Per-step and overall throughput, error rate and latency percentiles"""
+        duration = (self.finished or time.perf_counter()) - self.started
+        steps = {}
+        for step in dict.fromkeys(sample[0] for sample in self.samples):
+            steps[step] = summarize([sample for sample in self.samples if sample[0] == step], duration)
+        return {'duration_s': round(duration, 2), 'steps': steps, 'total': summarize(self.samples, duration)}
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))] if ordered else 0
+
+def summarize(samples, duration):
+    latencies = [sample[2] for sample in samples]
+    errors = [sample[3] for sample in samples if sample[3]]
+    return {
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_rate': round(len(errors) / len(samples), 4) if samples else 0,
+        'error_kinds': {kind: errors.count(kind) for kind in sorted(set(errors))},
+        'throughput_rps': round(len(samples) / duration, 2) if duration else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(max(latencies, default=0) * 1000, 1)
+    }
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+@contextmanager
+def serve(workers, threads):
+    """Run the app under gunicorn on a free local port"""
+    port = free_port()
+    env = dict(os.environ, SESSION_COOKIE_SECURE='false')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:create_app()'],
+        cwd=ROOT, env=env
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(f'{base_url}/auth/login', timeout=2)
+                break
+            except requests.ConnectionError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise SystemExit('gunicorn did not start')
+                time.sleep(0.25)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def login(recorder, session, base_url, email):
+    """Sign in through the login form, CSRF token included"""
+    page = recorder.request(session, 'auth.login (form)', 'GET', f'{base_url}/auth/login')
+    if page is None:
+        return False
+
+    token = CSRF_TOKEN.search(page.text)
+    response = recorder.request(
+        session, 'auth.login', 'POST', f'{base_url}/auth/login',
+        data={'email': email, 'password': PASSWORD, 'csrf_token': token.group(1) if token else ''},
+        ok=lambda response: response.status_code == 302 and '/auth/login' not in response.headers.get('Location', '')
+    )
+    return response is not None
+
+# Fixtures, prepared in the database the server uses
+
+def with_app(function):
+    """Run a fixture function inside an app context"""
+    def wrapper(*args, **kwargs):
+        from app import create_app
+        app = create_app()
+        with app.app_context():
+            return function(*args, **kwargs)
+    return wrapper
+
+@with_app
+def clock_in_fixture(users):
+    """Active generated employees, with today's attendance cleared so they clock in afresh"""
+    from models import User, Attendance, db
+    from utils.attendance import rebuild_attendance_summary
+
+    employees = db.session.execute(
+        db.select(User.id, User.email).where(User.is_active.is_(True), User.employee_id.like('SYN%'))
+        .order_by(User.id).limit(users)
+    ).all()
+    if not employees:
+        raise SystemExit('No generated employees; run manage.py generate-dataset first')
+
+    today = date.today()
+    db.session.execute(db.delete(Attendance).where(
+        Attendance.date == today, Attendance.user_id.in_([employee.id for employee in employees])
+    ))
+    rebuild_attendance_summary(today, today)
+    db.session.commit()
+    return [employee.email for employee in employees]
+
+@with_app
+def check_database():
+    from benchmarks.safety import refuse_unless_generated
+    refuse_unless_generated()
+
+@with_app
+def payday_fixture(callbacks):
+    """Pending MPESA salary payments awaiting their callbacks"""
+    from models import User, Payment, db
+    from utils.payment_counters import rebuild_payment_counters
+
+    user_ids = db.session.execute(
+        db.select(User.id).where(User.is_active.is_(True)).order_by(User.id).limit(callbacks)
+    ).scalars().all()
+    if not user_ids:
+        raise SystemExit('No active users; run manage.py generate-dataset first')
+
+    run = uuid.uuid4().hex[:8]
+    now = datetime.utcnow()
+    checkout_ids = [f'ws_CO_LOAD_{run}_{number}' for number in range(callbacks)]
+    db.session.execute(db.insert(Payment.__table__), [
+        {'user_id': user_ids[number % len(user_ids)], 'payment_type': 'salary', 'amount': 1000,
+         'payment_method': 'mpesa', 'phone_number': '254700000000', 'status': 'pending',
+         'checkout_request_id': checkout_id, 'created_at': now, 'updated_at': now}
+        for number, checkout_id in enumerate(checkout_ids)
+    ])
+    # The bulk insert bypasses the ORM hook that maintains the counters
+    rebuild_payment_counters()
+    db.session.commit()
+    return checkout_ids
+
+@with_app
+def remove_payday_fixture(checkout_ids):
+    from models import Payment, db
+    from utils.payment_counters import rebuild_payment_counters
+
+    db.session.execute(db.delete(Payment).where(Payment.checkout_request_id.in_(checkout_ids)))
+    rebuild_payment_counters()
+    db.session.commit()
+
+@with_app
+def managers_fixture(managers):
+    """Administrator accounts for the paging managers"""
+    from models import User, Role, Department, db
+    from werkzeug.security import generate_password_hash
+
+    admin_role = Role.query.filter_by(name='admin').first()
+    department = Department.query.filter_by(code='ACHR').first()
+    if admin_role is None or department is None:
+        raise SystemExit('Roles and departments missing; run init_db.py or manage.py generate-dataset first')
+
+    password_hash = generate_password_hash(PASSWORD)
+    emails = [MANAGER_EMAIL.format(number) for number in range(managers)]
+    for number, email in enumerate(emails):
+        manager = User(employee_id=f'LOADMGR{number:03d}', email=email, password_hash=password_hash,
+                       first_name='Load', last_name=f'Manager {number}', department_id=department.id)
+        manager.roles.append(admin_role)
+        db.session.add(manager)
+    db.session.commit()
+    return emails
+
+@with_app
+def remove_managers_fixture(emails):
+    from models import User, db
+
+    for manager in User.query.filter(User.email.in_(emails)):
+        db.session.delete(manager)
+    db.session.commit()
+
+# Scenarios
+
+def clock_in_wave(recorder, base_url, emails, ramp, concurrency, seed):
+    """Employees arrive over the ramp window, sign in and clock in"""
+    rng = random.Random(seed)
+    arrivals = sorted(rng.uniform(0, ramp) for _ in emails)
+    started = time.perf_counter()
+
+    def employee(email, arrival):
+        time.sleep(max(0, arrival - (time.perf_counter() - started)))
+        with requests.Session() as session:
+            if login(recorder, session, base_url, email):
+                recorder.request(session, 'dashboard.clock_in', 'GET',
+                                 f'{base_url}/dashboard/clock_in', params={'key': uuid.uuid4().hex})
+                recorder.request(session, 'dashboard.index', 'GET', f'{base_url}/dashboard/')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(employee, emails, arrivals))
+
+def payday_wave(recorder, base_url, checkout_ids, concurrency, seed):
+    """MPESA posts a callback per payment, a few of them cancelled by the payer"""
+    rng = random.Random(seed)
+    outcomes = [0 if rng.random() < 0.95 else 1032 for _ in checkout_ids]
+    local = threading.local()
+
+    def callback(checkout_id, result_code):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        item = [{'Name': 'Amount', 'Value': 1000},
+                {'Name': 'MpesaReceiptNumber', 'Value': checkout_id[-10:].upper()},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': 254700000000}]
+        body = {'Body': {'stkCallback': {
+            'MerchantRequestID': 'load', 'CheckoutRequestID': checkout_id, 'ResultCode': result_code,
+            'ResultDesc': 'Processed' if result_code == 0 else 'Request cancelled by user',
+            **({'CallbackMetadata': {'Item': item}} if result_code == 0 else {})
+        }}}
+        recorder.request(local.session, 'payments.mpesa_callback', 'POST', f'{base_url}/payments/mpesa/callback',
+                         json=body, ok=lambda response: response.json().get('ResultCode') == 0)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(callback, checkout_ids, outcomes))
+
+def manager_paging(recorder, base_url, emails, pages, concurrency):
+    """Managers sign in and page through each admin list"""
+    def manager(email):
+        with requests.Session() as session:
+            if not login(recorder, session, base_url, email):
+                return
+            for step, path in MANAGER_LISTS.items():
+                url, params = f'{base_url}{path}', {}
+                for _ in range(pages):
+                    response = recorder.request(session, step, 'GET', url, params=params)
+                    cursor = NEXT_CURSOR.search(response.text) if response is not None else None
+                    if cursor is None:
+                        break
+                    params = {'cursor': requests.utils.unquote(cursor.group(1))}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(manager, emails))
+
+def print_report(name, report):
+    print(f"\n{name}: {report['duration_s']}s")
+    print(f"{'step':28} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for step, stats in list(report['steps'].items()) + [('total', report['total'])]:
+        print(f"{step:28} {stats['requests']:8} {stats['errors']:7} {stats['throughput_rps']:8.1f} "
+              f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f} {stats['max_ms']:8.1f}")
+        if stats['error_kinds'] and step != 'total':
+            print(f"{'':28} {stats['error_kinds']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay concurrent HRM traffic bursts against gunicorn')
+    parser.add_argument('scenario', choices=['clock-in', 'payday', 'managers', 'all'])
+    parser.add_argument('--url', help='Target a running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (default: 2)')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker (default: 1)')
+    parser.add_argument('--concurrency', type=int, default=50, help='Simultaneous simulated clients')
+    parser.add_argument('--users', type=int, default=200, help='Employees in the clock-in wave')
+    parser.add_argument('--ramp', type=float, default=10, help='Seconds over which employees arrive')
+    parser.add_argument('--callbacks', type=int, default=500, help='MPESA callbacks in the payday wave')
+    parser.add_argument('--managers', type=int, default=10, help='Managers paging admin lists')
+    parser.add_argument('--pages', type=int, default=5, help='Pages each manager reads per list')
+    parser.add_argument('--seed', type=int, default=42, help='Seed for arrival times and outcomes')
+    parser.add_argument('--output', help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    check_database()
+
+    chosen = ['clock-in', 'payday', 'managers'] if args.scenario == 'all' else [args.scenario]
+    fixtures = {
+        'clock-in': lambda: clock_in_fixture(args.users),
+        'payday': lambda: payday_fixture(args.callbacks),
+        'managers': lambda: managers_fixture(args.managers)
+    }
+    cleanups = {'payday': remove_payday_fixture, 'managers': remove_managers_fixture}
+    prepared = {}
+    try:
+        for name in chosen:
+            prepared[name] = fixtures[name]()
+        reports = run_scenarios(args, chosen, prepared)
+    finally:
+        for name, fixture in prepared.items():
+            if name in cleanups:
+                cleanups[name](fixture)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                       'workers': None if args.url else args.workers, 'threads': args.threads,
+                       'concurrency': args.concurrency, 'scenarios': reports}, output, indent=2)
+        print(f"\nReport written to {args.output}")
+
+def run_scenarios(args, chosen, prepared):
+    """Run each chosen scenario against the target server; returns their reports"""
+    runs = {
+        'clock-in': lambda recorder, base_url: clock_in_wave(recorder, base_url, prepared['clock-in'], args.ramp,
+                                                             args.concurrency, args.seed),
+        'payday': lambda recorder, base_url: payday_wave(recorder, base_url, prepared['payday'], args.concurrency,
+                                                         args.seed),
+        'managers': lambda recorder, base_url: manager_paging(recorder, base_url, prepared['managers'], args.pages,
+                                                              args.concurrency)
+    }
+
+    @contextmanager
+    def target():
+        if args.url:
+            yield args.url.rstrip('/')
+        else:
+            with serve(args.workers, args.threads) as base_url:
+                yield base_url
+
+    reports = {}
+    with target() as base_url:
+        for name in chosen:
+            recorder = Recorder()
+            runs[name](recorder, base_url)
+            recorder.finished = time.perf_counter()
+            reports[name] = recorder.report()
+            print_report(name, reports[name])
+    return reports
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Payroll attendance engine benchmark for the Mutech Civil HRM System
+
+Builds a synthetic month of punches for the whole company and times the
+vectorized reduction to per-employee overtime, late minutes and absences.
+With --db the same month is also written to the database and timed end to
+end through load_period(), followed by set-based payroll generation; this
+drops every table, so a DATABASE_URL that is not SQLite also needs
+--i-know-this-drops-everything.
+
+Usage:
+    python benchmarks/payroll_engine.py --employees 10000 --days 31
+    python benchmarks/payroll_engine.py --employees 2000 --db
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import date, time as clock_time
+
+import numpy as np
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///bench_payroll.db')
+
+from benchmarks.safety import add_drop_flag, refuse_unless_disposable
+from utils.payroll_engine import compute_period, generate_period_payroll, load_period, working_days, USER, DAY, CHECK_IN, WORKED, ATTENDED
+
+def synthetic_punches(employees, days, seed=42):
+    """One row per employee per day: check-in around 08:00, 7-10 hours worked, 5% absent"""
+    rng = np.random.default_rng(seed)
+    rows = employees * days
+
+    punches = np.empty((rows, 5), dtype=np.int64)
+    punches[:, USER] = np.repeat(np.arange(1, employees + 1), days)
+    punches[:, DAY] = np.tile(np.arange(days), employees)
+    punches[:, CHECK_IN] = 8 * 3600 + rng.integers(-1800, 2700, rows)
+    punches[:, WORKED] = rng.integers(7 * 60, 10 * 60, rows)
+    punches[:, ATTENDED] = rng.random(rows) > 0.05
+    return punches
+
+def time_compute(user_ids, punches, working, repeat):
+    """Best wall time of compute_period over several runs"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        totals = compute_period(user_ids, punches, working)
+        timings.append(time.perf_counter() - started)
+    return min(timings), totals
+
+def time_database(punches, month, year):
+    """Write the punches as attendance rows and time load_period, compute_period and payroll generation"""
+    from app import create_app, db
+    from models import User, Department, Attendance
+    from utils.permissions import create_departments
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        create_departments()
+        department = Department.query.filter_by(code='ENGM').first()
+
+        employees = int(punches[:, USER].max())
+        db.session.execute(db.insert(User), [
+            {
+                'employee_id': f'BENCH{index:06d}',
+                'email': f'bench{index}@mutechcivil.com',
+                'password_hash': 'x',
+                'first_name': 'Bench',
+                'last_name': f'User{index}',
+                'department_id': department.id,
+                'salary': 30000 + index % 90 * 1000
+            }
+            for index in range(1, employees + 1)
+        ])
+        db.session.execute(db.insert(Attendance.__table__), [
+            {
+                'user_id': int(row[USER]),
+                'date': date(year, month, int(row[DAY]) + 1),
+                'check_in': clock_time(int(row[CHECK_IN]) // 3600, int(row[CHECK_IN]) % 3600 // 60),
+                'worked_minutes': int(row[WORKED]),
+                'status': 'present' if row[ATTENDED] else 'absent'
+            }
+            for row in punches
+        ])
+        db.session.commit()
+
+        started = time.perf_counter()
+        loaded = load_period(month, year)
+        loaded_at = time.perf_counter()
+        compute_period(np.arange(1, employees + 1), loaded, working_days(month, year))
+        finished = time.perf_counter()
+
+        generate_period_payroll(month, year)
+        db.session.commit()
+        generated = time.perf_counter()
+
+        db.drop_all()
+        return loaded_at - started, finished - loaded_at, generated - finished
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized payroll attendance engine')
+    parser.add_argument('--employees', type=int, default=10000, help='Number of employees')
+    parser.add_argument('--days', type=int, default=31, choices=range(28, 32), metavar='28-31',
+                        help='Days in the period')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs (best is reported)')
+    parser.add_argument('--db', action='store_true', help='Also time loading the period from the database')
+    add_drop_flag(parser)
+    args = parser.parse_args()
+    if args.db:
+        refuse_unless_disposable(args)
+
+    # A month with the requested number of days
+    year, month = {28: (2023, 2), 29: (2024, 2), 30: (2024, 4), 31: (2024, 1)}[args.days]
+
+    punches = synthetic_punches(args.employees, args.days)
+    user_ids = np.arange(1, args.employees + 1)
+    working = working_days(month, year)
+
+    elapsed, totals = time_compute(user_ids, punches, working, args.repeat)
+
+    print(f"Employees:          {args.employees}")
+    print(f"Punch rows:         {len(punches)}")
+    print(f"compute_period:     {elapsed * 1000:.1f} ms (best of {args.repeat})")
+    print(f"Rows per second:    {len(punches) / elapsed:,.0f}")
+    print(f"Total overtime:     {int(totals.overtime_minutes.sum()) / 60:,.0f} hours")
+    print(f"Total late minutes: {int(totals.late_minutes.sum()):,}")
+    print(f"Total absences:     {int(totals.absences.sum()):,}")
+
+    if args.db:
+        load_seconds, compute_seconds, payroll_seconds = time_database(punches, month, year)
+        print(f"load_period:        {load_seconds * 1000:.1f} ms")
+        print(f"compute (loaded):   {compute_seconds * 1000:.1f} ms")
+        print(f"generate payroll:   {payroll_seconds * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
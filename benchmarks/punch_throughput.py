@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Clock-in throughput benchmark for the Mutech Civil HRM System
+
+Simulates the shift-start burst: many concurrent workers clock users in,
+every punch retried once with the same idempotency key as a flaky client
+would. Compares the single-statement upsert path with the old
+read-then-write path.
+
+Usage:
+    python benchmarks/punch_throughput.py --users 2000 --workers 8
+    DATABASE_URL=postgresql://... python benchmarks/punch_throughput.py --i-know-this-drops-everything
+
+Every table is dropped before and after the run.
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, date, timedelta
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///bench_punches.db')
+
+from app import create_app, db
+from benchmarks.safety import add_drop_flag, refuse_unless_disposable
+from models import User, Department, Attendance
+from utils.attendance import record_clock_in, SHIFT_START
+from utils.permissions import create_departments
+
+def legacy_clock_in(user_id, key=None, now=None):
+    """The previous read-then-write clock-in, for comparison"""
+    now = now or datetime.now()
+    existing_attendance = Attendance.query.filter_by(user_id=user_id, date=now.date()).first()
+
+    if existing_attendance and existing_attendance.check_in:
+        return 'already_clocked_in'
+
+    if not existing_attendance:
+        existing_attendance = Attendance(user_id=user_id, date=now.date())
+        db.session.add(existing_attendance)
+
+    existing_attendance.check_in = now.time()
+    existing_attendance.status = 'late' if now.time() > SHIFT_START else 'present'
+    return 'clocked_in'
+
+def create_users(count):
+    """Create benchmark users with one bulk insert"""
+    department = Department.query.filter_by(code='ENGM').first()
+    db.session.execute(db.insert(User), [
+        {
+            'employee_id': f'BENCH{index:06d}',
+            'email': f'bench{index}@mutechcivil.com',
+            'password_hash': 'x',
+            'first_name': 'Bench',
+            'last_name': f'User{index}',
+            'department_id': department.id
+        }
+        for index in range(count)
+    ])
+    db.session.commit()
+    return [user_id for (user_id,) in db.session.query(User.id).filter(User.employee_id.like('BENCH%'))]
+
+def run_burst(app, punch, user_ids, workers, punch_date):
+    """Clock every user in from worker threads; return (seconds, statements, errors)"""
+    errors = []
+    statements = []
+    shift_start = datetime.combine(punch_date, SHIFT_START) - timedelta(minutes=5)
+    keys = {user_id: uuid.uuid4().hex for user_id in user_ids}
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(1)
+
+    def worker(chunk):
+        with app.app_context():
+            for index, user_id in enumerate(chunk):
+                now = shift_start + timedelta(seconds=index % 600)
+                try:
+                    punch(user_id, key=keys[user_id], now=now)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(type(e).__name__)
+            db.session.remove()
+
+    # Each chunk is punched by two threads in lockstep: the original request
+    # and a client retry racing it
+    chunks = [user_ids[index::workers] for index in range(workers)]
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks + chunks]
+
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        db.event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    return elapsed, len(statements), errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clock-in throughput under concurrency')
+    parser.add_argument('--users', type=int, default=2000, help='Number of employees punching in')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent worker thread pairs')
+    add_drop_flag(parser)
+    args = parser.parse_args()
+    refuse_unless_disposable(args)
+
+    app = create_app()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        create_departments()
+        user_ids = create_users(args.users)
+
+    print(f"{'mode':<8} {'punches':>8} {'seconds':>8} {'punch/s':>8} {'stmt/punch':>10} {'rows':>6} {'errors':>7}")
+
+    for offset, (mode, punch) in enumerate([('legacy', legacy_clock_in), ('upsert', record_clock_in)]):
+        punch_date = date.today() - timedelta(days=offset + 1)
+        elapsed, statements, errors = run_burst(app, punch, user_ids, args.workers, punch_date)
+
+        with app.app_context():
+            rows = Attendance.query.filter_by(date=punch_date).count()
+
+        punches = len(user_ids) * 2
+        print(f"{mode:<8} {punches:>8} {elapsed:>8.2f} {punches / elapsed:>8.0f} "
+              f"{statements / punches:>10.2f} {rows:>6} {len(errors):>7}")
+
+    with app.app_context():
+        db.drop_all()
+
+if __name__ == '__main__':
+    main()
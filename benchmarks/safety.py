@@ -0,0 +1,37 @@
+"""
+Database guards shared by the Mutech Civil HRM benchmarks
+
+Benchmarks that drop every table only run against a SQLite DATABASE_URL
+unless --i-know-this-drops-everything is passed. Benchmarks that write
+fixtures into an existing database only run against one that
+manage.py generate-dataset filled, and remove their fixtures afterwards.
+"""
+
+import os
+import sys
+from sqlalchemy.engine import make_url
+
+DROP_FLAG = '--i-know-this-drops-everything'
+
+def database_url():
+    """DATABASE_URL with any password hidden, for messages"""
+    return make_url(os.environ['DATABASE_URL']).render_as_string(hide_password=True)
+
+def add_drop_flag(parser):
+    parser.add_argument(DROP_FLAG, dest='drop_everything', action='store_true',
+                        help='Allow dropping every table of a database that is not SQLite')
+
+def refuse_unless_disposable(args):
+    """Exit unless DATABASE_URL is SQLite or the drop flag was passed"""
+    if make_url(os.environ['DATABASE_URL']).get_backend_name() != 'sqlite' and not args.drop_everything:
+        sys.exit(f"Refusing to drop every table of {database_url()}: "
+                 f"point DATABASE_URL at SQLite or pass {DROP_FLAG}")
+
+def refuse_unless_generated():
+    """Exit unless every user in the app's database was generated; call inside an app context"""
+    from models import db
+    from utils.dataset import is_generated_database
+
+    if not is_generated_database():
+        sys.exit(f"Refusing to write benchmark fixtures into {db.engine.url.render_as_string(hide_password=True)}: "
+                 "it holds users that manage.py generate-dataset did not create")
@@ -28,6 +28,62 @@ class Config:
     MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY')
     MPESA_ENVIRONMENT = os.environ.get('MPESA_ENVIRONMENT', 'sandbox')
     
+    # MPESA OAuth tokens are shared by this host's workers through MPESA_TOKEN_CACHE
+    # (instance/mpesa_token.json by default) and refreshed MPESA_TOKEN_MARGIN
+    # seconds before they expire
+    MPESA_TOKEN_CACHE = os.environ.get('MPESA_TOKEN_CACHE')
+    MPESA_TOKEN_MARGIN = int(os.environ.get('MPESA_TOKEN_MARGIN', 60))
+    
+    # Principal loading ('eager' or 'lazy')
+    PRINCIPAL_LOADER = os.environ.get('PRINCIPAL_LOADER', 'eager')
+    
+    # Months shown in the admin dashboard attendance trend; each worker caches
+    # closed months for ATTENDANCE_TREND_TTL seconds (0 disables the cache)
+    ATTENDANCE_TREND_MONTHS = int(os.environ.get('ATTENDANCE_TREND_MONTHS', 12))
+    ATTENDANCE_TREND_TTL = int(os.environ.get('ATTENDANCE_TREND_TTL', 300))
+    
+    # List pagination: 'keyset' (cursor tokens) or 'offset' (numbered pages);
+    # totals (PAGINATION_COUNT) are cached for PAGINATION_COUNT_TTL seconds
+    PAGINATION_MODE = os.environ.get('PAGINATION_MODE', 'keyset')
+    PAGINATION_COUNT_TTL = int(os.environ.get('PAGINATION_COUNT_TTL', 60))
+    PAGINATION_COUNT = os.environ.get('PAGINATION_COUNT', 'true').lower() == 'true'
+    
+    # Per-request query statistics (off by default): Server-Timing header, N+1
+    # warnings for statements repeated QUERY_REPEAT_THRESHOLD times, optional log line
+    QUERY_STATS = os.environ.get('QUERY_STATS', 'false').lower() == 'true'
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+    QUERY_STATS_LOG = os.environ.get('QUERY_STATS_LOG', 'false').lower() == 'true'
+    
+    # Sampling profiler (opt-in): profiles PROFILER_SAMPLE_RATE of requests, or
+    # an admin's request carrying PROFILER_HEADER, into collapsed-stack files
+    # under PROFILER_OUTPUT (instance/profiles by default)
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0.0))
+    PROFILER_HEADER = os.environ.get('PROFILER_HEADER', 'X-Profile')
+    PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.005))
+    PROFILER_OUTPUT = os.environ.get('PROFILER_OUTPUT')
+    
+    # Prometheus metrics at /metrics; METRICS_TOKEN requires 'Authorization: Bearer <token>'.
+    # Without a token /metrics is only served when the app runs in debug mode.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Payroll runs: one unit per department on a pool of PAYROLL_WORKERS
+    # processes (0 = one per core), in a background thread of the request that
+    # starts them; a run without a heartbeat for PAYROLL_RUN_STALE_SECONDS is
+    # treated as crashed and can be resumed
+    PAYROLL_WORKERS = int(os.environ.get('PAYROLL_WORKERS', 0))
+    PAYROLL_RUN_BACKGROUND = os.environ.get('PAYROLL_RUN_BACKGROUND', 'true').lower() == 'true'
+    PAYROLL_RUN_STALE_SECONDS = int(os.environ.get('PAYROLL_RUN_STALE_SECONDS', 600))
+    
+    # Payslips: rendered as PAYSLIP_FORMAT (html, or pdf with WeasyPrint) on a pool
+    # of PAYSLIP_WORKERS processes (0 = one per core) into PAYSLIP_DIR
+    # (instance/payslips by default), emailed PAYSLIP_EMAIL_BATCH per SMTP connection
+    PAYSLIP_FORMAT = os.environ.get('PAYSLIP_FORMAT', 'html')
+    PAYSLIP_WORKERS = int(os.environ.get('PAYSLIP_WORKERS', 0))
+    PAYSLIP_DIR = os.environ.get('PAYSLIP_DIR')
+    PAYSLIP_EMAIL_BATCH = int(os.environ.get('PAYSLIP_EMAIL_BATCH', 100))
+    
     # File upload configuration
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = 'static/uploads'
@@ -0,0 +1,15 @@
+"""
+Shared pytest helpers for the Mutech Civil HRM tests
+"""
+
+import pytest
+
+@pytest.fixture
+def query_budget():
+    """Context manager failing a test when a block exceeds its query budget
+
+    with query_budget(6, 'admin.users'):
+        client.get('/admin/users')
+    """
+    from utils.query_stats import assert_max_queries
+    return assert_max_queries
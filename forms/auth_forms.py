@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
@@ -129,3 +130,16 @@ class ChangePasswordForm(FlaskForm):
         EqualTo('new_password', message='Passwords must match')
     ])
     submit = SubmitField('Change Password')
+
+class AttendanceImportForm(FlaskForm):
+    """Punch log upload form"""
+    file = FileField('Punch Log', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'txt'], 'Upload a CSV or text punch log')
+    ])
+    delimiter = SelectField('Delimiter', choices=[
+        (',', 'Comma'),
+        (';', 'Semicolon'),
+        ('\t', 'Tab')
+    ], default=',')
+    submit = SubmitField('Import Attendance')
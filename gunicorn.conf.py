@@ -0,0 +1,23 @@
+"""
+Gunicorn settings
+
+Workers share PROMETHEUS_MULTIPROC_DIR so /metrics reports every worker's
+samples; the directory is emptied at startup and dead workers' live gauges
+are dropped.
+"""
+
+import os
+import shutil
+import tempfile
+
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'mutech-hrm-metrics')
+)
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
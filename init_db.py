@@ -12,8 +12,12 @@ from decimal import Decimal
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app import create_app, db
-from models import User, Department, Role, Permission, Employee
+from models import (User, Department, Role, Permission, Employee, Attendance, DailyAttendanceSummary, Payment,
+                    PaymentCounter)
 from utils.permissions import initialize_system
+from utils.schema import upgrade_schema
+from utils.attendance import backfill_worked_minutes, rebuild_attendance_summary
+from utils.payment_counters import rebuild_payment_counters
 from werkzeug.security import generate_password_hash
 
 def init_database():
@@ -22,7 +26,25 @@ def init_database():
     
     with app.app_context():
         print("Creating database tables...")
-        db.create_all()
+        added = upgrade_schema()
+        
+        # Stored minutes added to existing attendance start at 0; compute them once
+        if {'attendance.worked_minutes', 'attendance.break_minutes'} & set(added):
+            print("Backfilling attendance worked minutes...")
+            backfill_worked_minutes()
+            db.session.commit()
+        
+        # Existing attendance predates the summary table; populate it once
+        if not db.session.query(DailyAttendanceSummary.date).first() and db.session.query(Attendance.id).first():
+            print("Building attendance summary...")
+            rebuild_attendance_summary()
+            db.session.commit()
+        
+        # Likewise for existing payments and their counters
+        if not db.session.query(PaymentCounter.status).first() and db.session.query(Payment.id).first():
+            print("Building payment counters...")
+            rebuild_payment_counters()
+            db.session.commit()
         
         print("Initializing system data...")
         initialize_system()
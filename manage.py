@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Management commands for Mutech Civil HRM System
+
+Usage:
+    python manage.py rebuild-attendance-summary [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python manage.py backfill-worked-minutes [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python manage.py import-punches FILE [--delimiter ,] [--batch-size 5000]
+    python manage.py generate-dataset [--employees 1000] [--departments 8] [--years 1] [--seed 42] [--end YYYY-MM-DD]
+    python manage.py payroll-run MONTH YEAR [--workers N]
+    python manage.py payroll-recompute MONTH YEAR [--dry-run]
+    python manage.py reconcile-payment-counters [--rebuild]
+    python manage.py payslips MONTH YEAR [--format html|pdf] [--email] [--workers N] [--force]
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD command line argument"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid date: {value} (expected YYYY-MM-DD)')
+
+def rebuild_attendance_summary(args):
+    """Recompute the daily attendance summary from raw attendance"""
+    from utils.attendance import rebuild_attendance_summary
+
+    rows = rebuild_attendance_summary(args.start, args.end)
+    db.session.commit()
+    print(f"Rebuilt {rows} attendance summary rows")
+
+def backfill_worked_minutes(args):
+    """Store worked and break minutes for existing attendance rows"""
+    from utils.attendance import backfill_worked_minutes
+
+    rows = backfill_worked_minutes(args.start, args.end)
+    db.session.commit()
+    print(f"Updated worked minutes on {rows} attendance rows")
+
+def import_punches(args):
+    """Import attendance from a terminal punch log"""
+    from utils.attendance_import import claim_import, run_import
+
+    with open(args.file, encoding='utf-8-sig', errors='replace', newline='') as punch_log:
+        job_id = claim_import()
+        if job_id is None:
+            print("Error: another attendance import is running")
+            sys.exit(1)
+        report = run_import(job_id, punch_log, delimiter=args.delimiter, batch_size=args.batch_size)
+
+    print(f"Imported {report.summary()}")
+    for reason, count in report.rejected.most_common():
+        print(f"  {reason}: {count}")
+    for line_number, reason, line in report.rejected_samples:
+        print(f"  line {line_number}: {reason}: {line}")
+    for badge, day, punches in report.dropped_samples:
+        print(f"  {badge} {day}: dropped {', '.join(punch.strftime('%H:%M:%S') for punch in punches)}")
+
+def generate_dataset(args):
+    """Fill an empty database with a synthetic company"""
+    import time
+    from utils.dataset import generate_dataset
+
+    started = time.perf_counter()
+    try:
+        written = generate_dataset(employees=args.employees, departments=args.departments, years=args.years,
+                                   leave_per_year=args.leave_per_year, seed=args.seed, end=args.end,
+                                   batch_size=args.batch_size)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Generated dataset (seed {args.seed}) in {time.perf_counter() - started:.1f}s")
+    for table, rows in written.items():
+        print(f"  {table}: {rows}")
+    print("Generated users sign in with password123")
+
+def payroll_run(args):
+    """Generate, or resume, a period's payroll in parallel by department"""
+    import time
+    from utils.payroll_runs import PayrollRunLocked, run_progress, start_payroll_run
+
+    started = time.perf_counter()
+    try:
+        run = start_payroll_run(args.month, args.year, workers=args.workers)
+    except PayrollRunLocked as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if run is None:
+        print(f"Payroll for {args.month}/{args.year} already exists")
+        return
+
+    progress = run_progress(run)
+    print(f"Payroll run {args.month}/{args.year} {run.status} in {time.perf_counter() - started:.1f}s: "
+          f"{progress['units_completed']}/{progress['units']} departments, {run.employees} employees "
+          f"on {run.workers} workers")
+    if run.status != 'completed':
+        print(f"Error: {run.error}; run the command again to resume")
+        sys.exit(1)
+
+def payroll_recompute(args):
+    """Recompute a period's payroll for employees whose inputs changed"""
+    from utils.payroll_recompute import recompute_period_payroll
+    from utils.payroll_runs import PayrollRunLocked, period_lock
+
+    try:
+        with period_lock(args.month, args.year):
+            diff = recompute_period_payroll(args.month, args.year, dry_run=args.dry_run)
+            db.session.commit()
+    except PayrollRunLocked as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Payroll {diff.summary()}{' (dry run, nothing written)' if args.dry_run else ''}")
+    for change in diff.changes:
+        print(f"  user {change.user_id}: {change.action}")
+        for field, (old, new) in change.changes.items():
+            print(f"    {field}: {old} -> {new}")
+
+def reconcile_payment_counters(args):
+    """Check the payment dashboard counters against the payment table"""
+    from utils.payment_counters import rebuild_payment_counters, reconcile_payment_counters
+
+    if args.rebuild:
+        print(f"Rebuilt {rebuild_payment_counters()} payment counters")
+    else:
+        drifted = reconcile_payment_counters()
+        print(f"Payment counters {'rebuilt, ' + str(drifted) + ' cells had drifted' if drifted else 'in step'}")
+    db.session.commit()
+
+def payslips(args):
+    """Render, and optionally email, a period's new and changed payslips"""
+    from utils.payslips import PayslipJobLocked, generate_payslips
+
+    try:
+        progress = generate_payslips(args.month, args.year, fmt=args.format, email=args.email,
+                                     workers=args.workers, force=args.force)
+    except (PayslipJobLocked, RuntimeError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Payslips {args.month}/{args.year}: {progress.rendered} rendered, {progress.skipped} unchanged"
+          f"{f', {progress.emailed} emailed, {progress.email_failed} failed' if args.email else ''} "
+          f"in {progress.elapsed:.1f}s")
+    if progress.email_failed:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mutech Civil HRM management commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = commands.add_parser('rebuild-attendance-summary',
+                                  help='Recompute the daily attendance summary table')
+    rebuild.add_argument('--start', type=parse_date, help='First date to rebuild (default: all)')
+    rebuild.add_argument('--end', type=parse_date, help='Last date to rebuild (default: all)')
+    rebuild.set_defaults(handler=rebuild_attendance_summary)
+
+    backfill = commands.add_parser('backfill-worked-minutes',
+                                   help='Store worked and break minutes for existing attendance')
+    backfill.add_argument('--start', type=parse_date, help='First date to backfill (default: all)')
+    backfill.add_argument('--end', type=parse_date, help='Last date to backfill (default: all)')
+    backfill.set_defaults(handler=backfill_worked_minutes)
+
+    punches = commands.add_parser('import-punches', help='Import attendance from a terminal punch log')
+    punches.add_argument('file', help='Punch log: badge number, timestamp per line')
+    punches.add_argument('--delimiter', default=',', help='Field delimiter (default: ,)')
+    punches.add_argument('--batch-size', type=int, default=5000, help='Attendance days written per batch')
+    punches.set_defaults(handler=import_punches)
+
+    dataset = commands.add_parser('generate-dataset', help='Fill an empty database with a synthetic company')
+    dataset.add_argument('--employees', type=int, default=1000, help='Users to create (default: 1000)')
+    dataset.add_argument('--departments', type=int, default=8, help='Departments, including the defaults (default: 8)')
+    dataset.add_argument('--years', type=float, default=1, help='Years of attendance up to --end (default: 1)')
+    dataset.add_argument('--leave-per-year', type=int, default=3, help='Leave requests per employee per year')
+    dataset.add_argument('--seed', type=int, default=42, help='Random seed; same seed and end give the same data')
+    dataset.add_argument('--end', type=parse_date, help='Last day of generated activity (default: 2024-06-14)')
+    dataset.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+    dataset.set_defaults(handler=generate_dataset)
+
+    payroll = commands.add_parser('payroll-run', help="Generate or resume a period's payroll")
+    payroll.add_argument('month', type=int, choices=range(1, 13), metavar='MONTH', help='Month, 1-12')
+    payroll.add_argument('year', type=int, help='Year')
+    payroll.add_argument('--workers', type=int, help='Worker processes (default: PAYROLL_WORKERS or one per core)')
+    payroll.set_defaults(handler=payroll_run)
+
+    recompute = commands.add_parser('payroll-recompute',
+                                    help="Recompute a period's payroll for employees whose inputs changed")
+    recompute.add_argument('month', type=int, choices=range(1, 13), metavar='MONTH', help='Month, 1-12')
+    recompute.add_argument('year', type=int, help='Year')
+    recompute.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+    recompute.set_defaults(handler=payroll_recompute)
+
+    counters = commands.add_parser('reconcile-payment-counters',
+                                   help='Check payment counters against payments and fix any drift; run it on a schedule')
+    counters.add_argument('--rebuild', action='store_true', help='Rebuild the counters without comparing')
+    counters.set_defaults(handler=reconcile_payment_counters)
+
+    slips = commands.add_parser('payslips', help="Render and email a period's payslips")
+    slips.add_argument('month', type=int, choices=range(1, 13), metavar='MONTH', help='Month, 1-12')
+    slips.add_argument('year', type=int, help='Year')
+    slips.add_argument('--format', choices=['html', 'pdf'], help='Payslip format (default: PAYSLIP_FORMAT)')
+    slips.add_argument('--email', action='store_true', help='Email payslips not yet sent in their current version')
+    slips.add_argument('--workers', type=int, help='Worker processes (default: PAYSLIP_WORKERS or one per core)')
+    slips.add_argument('--force', action='store_true', help='Render every payslip, changed or not')
+    slips.set_defaults(handler=payslips)
+
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        args.handler(args)
+
+if __name__ == '__main__':
+    main()
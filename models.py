@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
+from sqlalchemy import event
 from app import db
 
 # Association tables for many-to-many relationships
@@ -36,14 +37,19 @@ class User(UserMixin, db.Model):
     hire_date = db.Column(db.Date, default=date.today)
     salary = db.Column(db.Decimal(10, 2))
     is_active = db.Column(db.Boolean, default=True)
+    termination_date = db.Column(db.Date)  # Last day employed, set on deactivation
     
     # System Information
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
+    # Version stamp for the compiled permission set, bumped whenever the
+    # user's roles or the permissions of one of those roles change
+    permissions_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
-    department = db.relationship('Department', backref='employees')
+    department = db.relationship('Department', foreign_keys=[department_id], backref='employees')
     roles = db.relationship('Role', secondary=user_roles, backref='users')
     
     def set_password(self, password):
@@ -54,17 +60,22 @@ class User(UserMixin, db.Model):
         """Check password against hash"""
         return check_password_hash(self.password_hash, password)
     
+    def get_compiled_permissions(self):
+        """Get the compiled role/permission set, rebuilding it when stale"""
+        compiled = getattr(self, '_compiled_permissions', None)
+        if compiled is None or not compiled.is_current(self):
+            from utils.permissions import load_compiled_permissions
+            compiled = load_compiled_permissions(self)
+            self._compiled_permissions = compiled
+        return compiled
+    
     def has_permission(self, permission_name):
         """Check if user has specific permission"""
-        for role in self.roles:
-            for permission in role.permissions:
-                if permission.name == permission_name:
-                    return True
-        return False
+        return self.get_compiled_permissions().allows(permission_name)
     
     def has_role(self, role_name):
         """Check if user has specific role"""
-        return any(role.name == role_name for role in self.roles)
+        return role_name in self.get_compiled_permissions().roles
     
     @property
     def full_name(self):
@@ -152,8 +163,28 @@ class Employee(db.Model):
     def __repr__(self):
         return f'<Employee {self.user.full_name}>'
 
+def _seconds_of_day(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+def attendance_minutes(check_in, check_out, break_start=None, break_end=None):
+    """Worked and break minutes for a day's punch times"""
+    break_seconds = 0
+    if break_start and break_end:
+        break_seconds = max(0, _seconds_of_day(break_end) - _seconds_of_day(break_start))
+    
+    worked_seconds = 0
+    if check_in and check_out:
+        worked_seconds = max(0, _seconds_of_day(check_out) - _seconds_of_day(check_in) - break_seconds)
+    
+    return worked_seconds // 60, break_seconds // 60
+
 class Attendance(db.Model):
     """Employee attendance tracking"""
+    __table_args__ = (
+        db.Index('uq_attendance_user_date', 'user_id', 'date', unique=True),  # One row per user per day
+        db.Index('ix_attendance_date_status', 'date', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
@@ -165,33 +196,56 @@ class Attendance(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Idempotency keys of the punches that set check_in/check_out, so a
+    # retried request is recognised as the same punch
+    check_in_key = db.Column(db.String(64))
+    check_out_key = db.Column(db.String(64))
+    
+    # Stored at clock-out or correction time so totals are plain SQL SUMs
+    worked_minutes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    break_minutes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     user = db.relationship('User', backref='attendance_records')
     
     @property
     def hours_worked(self):
-        """Calculate hours worked"""
-        if self.check_in and self.check_out:
-            # Convert to datetime for calculation
-            check_in_dt = datetime.combine(self.date, self.check_in)
-            check_out_dt = datetime.combine(self.date, self.check_out)
-            
-            # Calculate break time
-            break_time = 0
-            if self.break_start and self.break_end:
-                break_start_dt = datetime.combine(self.date, self.break_start)
-                break_end_dt = datetime.combine(self.date, self.break_end)
-                break_time = (break_end_dt - break_start_dt).total_seconds() / 3600
-            
-            total_hours = (check_out_dt - check_in_dt).total_seconds() / 3600
-            return max(0, total_hours - break_time)
-        return 0
+        """Hours worked, from the stored worked minutes"""
+        return (self.worked_minutes or 0) / 60
+    
+    def compute_minutes(self):
+        """Recalculate worked and break minutes from the punch times"""
+        self.worked_minutes, self.break_minutes = attendance_minutes(
+            self.check_in, self.check_out, self.break_start, self.break_end
+        )
     
     def __repr__(self):
         return f'<Attendance {self.user.full_name} - {self.date}>'
 
+class DailyAttendanceSummary(db.Model):
+    """Attendance counts per day and department, maintained as attendance changes"""
+    date = db.Column(db.Date, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    late = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    half_day = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Relationships
+    department = db.relationship('Department')
+    
+    def __repr__(self):
+        return f'<DailyAttendanceSummary {self.date} - {self.department_id}>'
+
 class LeaveRequest(db.Model):
     """Employee leave requests"""
+    __table_args__ = (
+        db.Index('ix_leave_request_user_status_created', 'user_id', 'status', 'created_at'),
+        db.Index('ix_leave_request_status_created', 'status', 'created_at'),
+        db.Index('ix_leave_request_created_at', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     leave_type = db.Column(db.String(50), nullable=False)  # annual, sick, maternity, etc.
@@ -214,6 +268,13 @@ class LeaveRequest(db.Model):
 
 class Payment(db.Model):
     """Payment records for MPESA and other transactions"""
+    __table_args__ = (
+        db.Index('ix_payment_status', 'status'),
+        db.Index('ix_payment_checkout_request_id', 'checkout_request_id'),
+        db.Index('ix_payment_created_at', 'created_at'),
+        db.Index('ix_payment_user_created', 'user_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     payment_type = db.Column(db.String(50), nullable=False)  # salary, bonus, reimbursement, etc.
@@ -250,8 +311,23 @@ class Payment(db.Model):
     def __repr__(self):
         return f'<Payment {self.user.full_name} - {self.amount} {self.currency}>'
 
+class PaymentCounter(db.Model):
+    """Payment counts and totals per status, type and method, maintained as payments change"""
+    status = db.Column(db.String(20), primary_key=True)
+    payment_type = db.Column(db.String(50), primary_key=True)
+    payment_method = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Decimal(14, 2), nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<PaymentCounter {self.status} {self.payment_type} {self.payment_method}: {self.count}>'
+
 class Payroll(db.Model):
     """Monthly payroll records"""
+    __table_args__ = (
+        db.Index('uq_payroll_period_user', 'month', 'year', 'user_id', unique=True),  # One row per user per period
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     month = db.Column(db.Integer, nullable=False)  # 1-12
@@ -275,6 +351,9 @@ class Payroll(db.Model):
     total_deductions = db.Column(db.Decimal(10, 2), nullable=False)
     net_pay = db.Column(db.Decimal(10, 2), nullable=False)
 
+    # Fingerprint of the statutory tables the deductions were priced with
+    statutory_version = db.Column(db.String(12))
+
     # Payment information
     payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'))
     payment_status = db.Column(db.String(20), default='pending')
@@ -298,3 +377,193 @@ class Payroll(db.Model):
 
     def __repr__(self):
         return f'<Payroll {self.user.full_name} - {self.month}/{self.year}>'
+
+class PayrollRun(db.Model):
+    """A payroll generation run for one period, executed as per-department units"""
+    __table_args__ = (
+        db.Index('uq_payroll_run_period', 'month', 'year', unique=True),  # One run per period; also its lock
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, nullable=False)  # 1-12
+    year = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    workers = db.Column(db.Integer)
+    employees = db.Column(db.Integer, nullable=False, default=0)  # Payroll rows written so far
+    error = db.Column(db.Text)
+    started_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    # Timestamps
+    heartbeat_at = db.Column(db.DateTime)  # Refreshed by the coordinator as units finish
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    starter = db.relationship('User')
+    units = db.relationship('PayrollRunUnit', backref='run', order_by='PayrollRunUnit.department_id',
+                            cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<PayrollRun {self.month}/{self.year} {self.status}>'
+
+class PayrollRunUnit(db.Model):
+    """One department's share of a payroll run, checkpointed with its payroll rows"""
+    __table_args__ = (
+        db.Index('uq_payroll_run_unit', 'run_id', 'department_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('payroll_run.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, completed, failed
+    employees = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    completed_at = db.Column(db.DateTime)
+
+    # Relationships
+    department = db.relationship('Department')
+
+    def __repr__(self):
+        return f'<PayrollRunUnit {self.run_id} department {self.department_id} {self.status}>'
+
+class Payslip(db.Model):
+    """Rendered payslip of a payroll row, cached by a content hash of what it shows"""
+    __table_args__ = (
+        db.Index('uq_payslip_payroll', 'payroll_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    payroll_id = db.Column(db.Integer, db.ForeignKey('payroll.id'), nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # html, pdf
+    content_hash = db.Column(db.String(64), nullable=False)
+    path = db.Column(db.String(255), nullable=False)  # Relative to PAYSLIP_DIR
+    size = db.Column(db.Integer)
+    rendered_at = db.Column(db.DateTime)
+
+    # Hash of the version last emailed, so unchanged payslips are not sent twice
+    emailed_hash = db.Column(db.String(64))
+    emailed_at = db.Column(db.DateTime)
+
+    # Relationships
+    payroll = db.relationship('Payroll', backref=db.backref('payslip', uselist=False))
+
+    def __repr__(self):
+        return f'<Payslip {self.payroll_id} {self.format}>'
+
+class PayslipJob(db.Model):
+    """The latest payslip job of a period, with its progress; the row is also the period's lock"""
+    __table_args__ = (
+        db.Index('uq_payslip_job_period', 'month', 'year', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, nullable=False)  # 1-12
+    year = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, completed, failed
+    format = db.Column(db.String(10))
+    email = db.Column(db.Boolean, nullable=False, default=False)
+    stage = db.Column(db.String(20))  # rendering, emailing
+    total = db.Column(db.Integer, nullable=False, default=0)
+    rendered = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)  # Unchanged since the last run
+    emailed = db.Column(db.Integer, nullable=False, default=0)
+    email_failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    started_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    # Timestamps
+    heartbeat_at = db.Column(db.DateTime)  # Refreshed while the job runs
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PayslipJob {self.month}/{self.year} {self.status}>'
+
+class AttendanceImport(db.Model):
+    """A punch log import with its report; at most one runs at a time"""
+    __table_args__ = (
+        db.Index('uq_attendance_import_running', 'running', unique=True),  # The import lock
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, completed, failed
+    running = db.Column(db.Boolean)  # True while running, NULL after, so only one row can hold it
+    lines = db.Column(db.Integer, nullable=False, default=0)
+    punches = db.Column(db.Integer, nullable=False, default=0)
+    rows_written = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    dropped = db.Column(db.Integer, nullable=False, default=0)
+    samples = db.Column(db.Text)  # JSON: rejected reasons and lines, dropped punches
+    error = db.Column(db.Text)
+    started_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+    # Timestamps
+    heartbeat_at = db.Column(db.DateTime)  # Refreshed while the import runs
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<AttendanceImport {self.id} {self.status}>'
+
+# Permission set invalidation
+
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _user_roles_changed(user, role, initiator):
+    """Invalidate a user's compiled permissions when their roles change"""
+    user.permissions_version = (user.permissions_version or 0) + 1
+
+@event.listens_for(Role.permissions, 'append')
+@event.listens_for(Role.permissions, 'remove')
+def _role_permissions_changed(role, permission, initiator):
+    """Remember roles whose permissions changed until the next flush"""
+    session = db.object_session(role)
+    if session is not None:
+        session.info.setdefault('permission_changed_roles', set()).add(role)
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _bump_role_members(session, flush_context):
+    """Invalidate compiled permissions of every member of a changed role"""
+    roles = session.info.pop('permission_changed_roles', None)
+    if not roles:
+        return
+    
+    role_ids = [role.id for role in roles if role.id is not None]
+    if role_ids:
+        member_ids = db.select(user_roles.c.user_id).where(user_roles.c.role_id.in_(role_ids))
+        session.connection().execute(
+            db.update(User.__table__)
+            .where(User.__table__.c.id.in_(member_ids))
+            .values(permissions_version=User.__table__.c.permissions_version + 1)
+        )
+    
+    # Loaded members must re-read their version stamp
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, User):
+            session.expire(obj, ['permissions_version'])
+
+# Attendance minutes maintenance
+
+@event.listens_for(Attendance, 'before_insert')
+@event.listens_for(Attendance, 'before_update')
+def _compute_attendance_minutes(mapper, connection, target):
+    """Store worked and break minutes whenever ORM code writes punch times"""
+    target.compute_minutes()
+
+# Attendance summary maintenance
+
+@event.listens_for(db.session, 'after_flush')
+def _track_attendance_summary(session, flush_context):
+    """Keep daily attendance summaries in step with ORM attendance changes"""
+    from utils.attendance import apply_summary_changes
+    apply_summary_changes(session)
+
+# Payment counter maintenance
+
+@event.listens_for(db.session, 'after_flush')
+def _track_payment_counters(session, flush_context):
+    """Keep payment counters in step with ORM payment changes"""
+    from utils.payment_counters import apply_counter_changes
+    apply_counter_changes(session)
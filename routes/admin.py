@@ -1,14 +1,47 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app, abort
 from flask_login import login_required, current_user
 from models import User, Department, Role, Permission, Attendance, LeaveRequest, Employee, db
-from forms.auth_forms import RegistrationForm, DepartmentForm
+from forms.auth_forms import RegistrationForm, DepartmentForm, AttendanceImportForm
 from utils.decorators import admin_required
-from datetime import datetime, date, timedelta
-from sqlalchemy import func, desc
-import calendar
+from utils.attendance import daily_attendance_stats, monthly_attendance_trend
+from utils.attendance_import import import_job, start_import_job
+from utils.exports import export_response, query_rows
+from utils.pagination import SortKey, paginate
+from utils.loading import user_list_options, attendance_list_options, leave_request_list_options
+from datetime import datetime, date
+import os
+import tempfile
+from sqlalchemy import func, desc, select
+from sqlalchemy.orm import joinedload
 
 admin_bp = Blueprint('admin', __name__)
 
+def attendance_filters():
+    """Date, date range and department filters shared by the attendance list and export"""
+    department_filter = request.args.get('department', '', type=str)
+    start_filter = request.args.get('start', '', type=str)
+    end_filter = request.args.get('end', '', type=str)
+    # Today is the default only when no date range was asked for
+    default_date = '' if start_filter or end_filter else date.today().strftime('%Y-%m-%d')
+    date_filter = request.args.get('date', default_date)
+    filter_date = None
+    conditions = []
+    
+    if date_filter:
+        filter_date = datetime.strptime(date_filter, '%Y-%m-%d').date()
+        conditions.append(Attendance.date == filter_date)
+    
+    if start_filter:
+        conditions.append(Attendance.date >= datetime.strptime(start_filter, '%Y-%m-%d').date())
+    
+    if end_filter:
+        conditions.append(Attendance.date <= datetime.strptime(end_filter, '%Y-%m-%d').date())
+    
+    if department_filter:
+        conditions.append(User.department_id == department_filter)
+    
+    return date_filter, department_filter, filter_date, conditions
+
 @admin_bp.route('/dashboard')
 @login_required
 @admin_required
@@ -20,18 +53,13 @@ def dashboard():
     
     # Today's attendance
     today = date.today()
-    today_attendance = db.session.query(
-        func.count(Attendance.id).label('total'),
-        func.sum(func.case((Attendance.status == 'present', 1), else_=0)).label('present'),
-        func.sum(func.case((Attendance.status == 'late', 1), else_=0)).label('late'),
-        func.sum(func.case((Attendance.status == 'absent', 1), else_=0)).label('absent')
-    ).filter(Attendance.date == today).first()
+    today_attendance = daily_attendance_stats(today)
     
     # Pending leave requests
     pending_leaves = LeaveRequest.query.filter_by(status='pending').count()
     
     # Recent activities (last 10 users created)
-    recent_users = User.query.order_by(desc(User.created_at)).limit(5).all()
+    recent_users = User.query.options(joinedload(User.department)).order_by(desc(User.created_at)).limit(5).all()
     
     # Department statistics
     dept_stats = db.session.query(
@@ -42,28 +70,8 @@ def dashboard():
         Department.is_active == True
     ).group_by(Department.id, Department.name).all()
     
-    # Monthly attendance trend (last 6 months)
-    monthly_attendance = []
-    for i in range(6):
-        month_date = (date.today().replace(day=1) - timedelta(days=i*30))
-        month_start = month_date.replace(day=1)
-        if month_date.month == 12:
-            month_end = month_date.replace(year=month_date.year + 1, month=1, day=1) - timedelta(days=1)
-        else:
-            month_end = month_date.replace(month=month_date.month + 1, day=1) - timedelta(days=1)
-        
-        attendance_count = Attendance.query.filter(
-            Attendance.date >= month_start,
-            Attendance.date <= month_end,
-            Attendance.status == 'present'
-        ).count()
-        
-        monthly_attendance.append({
-            'month': calendar.month_name[month_date.month],
-            'count': attendance_count
-        })
-    
-    monthly_attendance.reverse()
+    # Monthly attendance trend
+    monthly_attendance = monthly_attendance_trend(current_app.config.get('ATTENDANCE_TREND_MONTHS', 12))
     
     return render_template('admin/dashboard.html',
                          total_users=total_users,
@@ -79,7 +87,6 @@ def dashboard():
 @admin_required
 def users():
     """User management"""
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '', type=str)
     department_filter = request.args.get('department', '', type=str)
     
@@ -98,9 +105,10 @@ def users():
     if department_filter:
         query = query.filter(User.department_id == department_filter)
     
-    users = query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    users = paginate(query, [
+        SortKey(User.created_at, descending=True),
+        SortKey(User.id, descending=True)
+    ], per_page=20, options=user_list_options())
     
     departments = Department.query.filter_by(is_active=True).all()
     
@@ -143,6 +151,7 @@ def toggle_user_status(user_id):
         flash('You cannot deactivate your own account.', 'error')
     else:
         user.is_active = not user.is_active
+        user.termination_date = None if user.is_active else date.today()
         db.session.commit()
         
         status = 'activated' if user.is_active else 'deactivated'
@@ -221,33 +230,21 @@ def edit_department(dept_id):
 @admin_required
 def attendance():
     """System-wide attendance management"""
-    page = request.args.get('page', 1, type=int)
-    date_filter = request.args.get('date', date.today().strftime('%Y-%m-%d'))
-    department_filter = request.args.get('department', '', type=str)
-    
-    query = db.session.query(Attendance).join(User)
-    
-    if date_filter:
-        filter_date = datetime.strptime(date_filter, '%Y-%m-%d').date()
-        query = query.filter(Attendance.date == filter_date)
+    date_filter, department_filter, filter_date, conditions = attendance_filters()
     
-    if department_filter:
-        query = query.filter(User.department_id == department_filter)
+    query = db.session.query(Attendance).join(Attendance.user).filter(*conditions)
     
-    attendance_records = query.order_by(desc(Attendance.date), User.first_name).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    attendance_records = paginate(query, [
+        SortKey(Attendance.date, descending=True),
+        SortKey(User.first_name, value=lambda attendance: attendance.user.first_name),
+        SortKey(Attendance.id)
+    ], per_page=50, options=attendance_list_options())
     
     departments = Department.query.filter_by(is_active=True).all()
     
     # Daily statistics
     if date_filter:
-        daily_stats = db.session.query(
-            func.count(Attendance.id).label('total'),
-            func.sum(func.case((Attendance.status == 'present', 1), else_=0)).label('present'),
-            func.sum(func.case((Attendance.status == 'late', 1), else_=0)).label('late'),
-            func.sum(func.case((Attendance.status == 'absent', 1), else_=0)).label('absent')
-        ).filter(Attendance.date == filter_date).first()
+        daily_stats = daily_attendance_stats(filter_date)
     else:
         daily_stats = None
     
@@ -258,27 +255,117 @@ def attendance():
                          department_filter=department_filter,
                          daily_stats=daily_stats)
 
+@admin_bp.route('/attendance/export')
+@login_required
+@admin_required
+def export_attendance():
+    """Export attendance with the attendance page filters as CSV or XLSX"""
+    _, _, _, conditions = attendance_filters()
+    
+    statement = select(
+        Attendance.date, User.employee_id, User.first_name, User.last_name, Department.name,
+        Attendance.check_in, Attendance.break_start, Attendance.break_end, Attendance.check_out,
+        Attendance.worked_minutes, Attendance.status
+    ).join(User, Attendance.user_id == User.id).join(
+        Department, User.department_id == Department.id
+    ).where(*conditions).order_by(Attendance.date, User.employee_id)
+    
+    rows = (
+        (row.date, row.employee_id, f'{row.first_name} {row.last_name}', row.name,
+         row.check_in, row.break_start, row.break_end, row.check_out,
+         round(row.worked_minutes / 60, 2), row.status)
+        for row in query_rows(statement)
+    )
+    
+    return export_response(request.args.get('format', 'csv'), 'attendance', [
+        'Date', 'Employee ID', 'Name', 'Department', 'Check In', 'Break Start',
+        'Break End', 'Check Out', 'Hours Worked', 'Status'
+    ], rows)
+
+@admin_bp.route('/attendance/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_attendance():
+    """Import attendance from a terminal punch log"""
+    form = AttendanceImportForm()
+    job_id = request.args.get('job', type=int)
+    report = import_job(job_id) if job_id else None
+    
+    if form.validate_on_submit():
+        # The import runs on a background thread, which removes the saved log when done
+        handle, path = tempfile.mkstemp(prefix='punches-', suffix='.csv')
+        with os.fdopen(handle, 'wb') as saved:
+            form.file.data.save(saved)
+        
+        job_id = start_import_job(path, delimiter=form.delimiter.data, started_by=current_user.id)
+        if job_id is None:
+            os.remove(path)
+            flash('Another attendance import is still running.', 'warning')
+            return redirect(url_for('admin.import_attendance'))
+        
+        flash('Attendance import started.', 'info')
+        return redirect(url_for('admin.import_attendance', job=job_id))
+    
+    return render_template('admin/attendance_import.html', form=form, report=report, job_id=job_id)
+
+@admin_bp.route('/attendance/import/status/<int:job_id>')
+@login_required
+@admin_required
+def attendance_import_status(job_id):
+    """Progress of a background attendance import as JSON"""
+    report = import_job(job_id)
+    if report is None:
+        abort(404)
+    return jsonify(report.to_dict())
+
 @admin_bp.route('/leave_requests')
 @login_required
 @admin_required
 def leave_requests():
     """Leave request management"""
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '', type=str)
     
-    query = LeaveRequest.query.join(User)
+    query = LeaveRequest.query.join(LeaveRequest.user)
     
     if status_filter:
         query = query.filter(LeaveRequest.status == status_filter)
     
-    leave_requests = query.order_by(desc(LeaveRequest.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
+    leave_requests = paginate(query, [
+        SortKey(LeaveRequest.created_at, descending=True),
+        SortKey(LeaveRequest.id, descending=True)
+    ], per_page=20, options=leave_request_list_options())
     
     return render_template('admin/leave_requests.html',
                          leave_requests=leave_requests,
                          status_filter=status_filter)
 
+@admin_bp.route('/leave_requests/export')
+@login_required
+@admin_required
+def export_leave_requests():
+    """Export leave requests with the list filters as CSV or XLSX"""
+    status_filter = request.args.get('status', '', type=str)
+    
+    statement = select(
+        User.employee_id, User.first_name, User.last_name, LeaveRequest.leave_type,
+        LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.days_requested,
+        LeaveRequest.status, LeaveRequest.created_at, LeaveRequest.reason
+    ).join(User, LeaveRequest.user_id == User.id).order_by(desc(LeaveRequest.created_at))
+    
+    if status_filter:
+        statement = statement.where(LeaveRequest.status == status_filter)
+    
+    rows = (
+        (row.employee_id, f'{row.first_name} {row.last_name}', row.leave_type, row.start_date,
+         row.end_date, row.days_requested, row.status, row.created_at, row.reason)
+        for row in query_rows(statement)
+    )
+    
+    return export_response(request.args.get('format', 'csv'), 'leave_requests', [
+        'Employee ID', 'Name', 'Leave Type', 'Start Date', 'End Date', 'Days',
+        'Status', 'Requested At', 'Reason'
+    ], rows)
+
 @admin_bp.route('/leave_requests/<int:request_id>/approve')
 @login_required
 @admin_required
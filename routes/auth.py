@@ -4,6 +4,7 @@ from werkzeug.urls import url_parse
 from models import User, db
 from forms.auth_forms import LoginForm, RegistrationForm, PasswordResetRequestForm, PasswordResetForm, ChangePasswordForm
 from utils.email import send_password_reset_email
+from utils.permissions import SESSION_KEY as PERMISSIONS_SESSION_KEY
 from datetime import datetime
 import secrets
 
@@ -44,6 +45,7 @@ def login():
 def logout():
     """User logout"""
     logout_user()
+    session.pop(PERMISSIONS_SESSION_KEY, None)
     flash('You have been logged out successfully.', 'info')
     return redirect(url_for('main.index'))
 
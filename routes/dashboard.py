@@ -3,8 +3,10 @@ from flask_login import login_required, current_user
 from models import User, Department, Attendance, LeaveRequest, db
 from forms.auth_forms import ProfileForm, LeaveRequestForm
 from utils.decorators import active_user_required
+from utils.attendance import record_clock_in, record_clock_out, worked_hours, CLOCKED_IN, CLOCKED_OUT, NOT_CLOCKED_IN
 from datetime import datetime, date, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, case
+import uuid
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -32,13 +34,7 @@ def index():
     
     # Calculate this month's working hours
     start_of_month = date.today().replace(day=1)
-    monthly_attendance = Attendance.query.filter(
-        Attendance.user_id == current_user.id,
-        Attendance.date >= start_of_month,
-        Attendance.date <= date.today()
-    ).all()
-    
-    total_hours = sum(att.hours_worked for att in monthly_attendance)
+    total_hours = worked_hours(current_user.id, start_of_month, date.today())
     
     # Get leave balance
     leave_balance = {
@@ -46,12 +42,16 @@ def index():
         'sick': current_user.employee_profile.sick_leave_balance if current_user.employee_profile else 10
     }
     
+    # Idempotency key for the clock in/out links, so a retried click is the same punch
+    punch_key = uuid.uuid4().hex
+    
     return render_template('dashboard/index.html',
                          recent_attendance=recent_attendance,
                          pending_leaves=pending_leaves,
                          today_attendance=today_attendance,
                          total_hours=total_hours,
-                         leave_balance=leave_balance)
+                         leave_balance=leave_balance,
+                         punch_key=punch_key)
 
 @dashboard_bp.route('/profile', methods=['GET', 'POST'])
 @login_required
@@ -91,19 +91,19 @@ def attendance():
     monthly_stats = db.session.query(
         func.count(Attendance.id).label('total_days'),
         func.sum(
-            func.case(
+            case(
                 (Attendance.status == 'present', 1),
                 else_=0
             )
         ).label('present_days'),
         func.sum(
-            func.case(
+            case(
                 (Attendance.status == 'late', 1),
                 else_=0
             )
         ).label('late_days'),
         func.sum(
-            func.case(
+            case(
                 (Attendance.status == 'absent', 1),
                 else_=0
             )
@@ -184,31 +184,13 @@ def request_leave():
 @active_user_required
 def clock_in():
     """Clock in for the day"""
-    today = date.today()
-    existing_attendance = Attendance.query.filter_by(
-        user_id=current_user.id,
-        date=today
-    ).first()
+    outcome = record_clock_in(current_user.id, key=request.args.get('key'), department_id=current_user.department_id)
+    db.session.commit()
     
-    if existing_attendance and existing_attendance.check_in:
-        flash('You have already clocked in today.', 'warning')
-    else:
-        if not existing_attendance:
-            existing_attendance = Attendance(
-                user_id=current_user.id,
-                date=today
-            )
-            db.session.add(existing_attendance)
-        
-        existing_attendance.check_in = datetime.now().time()
-        existing_attendance.status = 'present'
-        
-        # Check if late (assuming 8:00 AM is start time)
-        if existing_attendance.check_in > datetime.strptime('08:00', '%H:%M').time():
-            existing_attendance.status = 'late'
-        
-        db.session.commit()
+    if outcome == CLOCKED_IN:
         flash('Clocked in successfully!', 'success')
+    else:
+        flash('You have already clocked in today.', 'warning')
     
     return redirect(url_for('dashboard.index'))
 
@@ -217,19 +199,14 @@ def clock_in():
 @active_user_required
 def clock_out():
     """Clock out for the day"""
-    today = date.today()
-    attendance = Attendance.query.filter_by(
-        user_id=current_user.id,
-        date=today
-    ).first()
+    outcome = record_clock_out(current_user.id, key=request.args.get('key'))
+    db.session.commit()
     
-    if not attendance or not attendance.check_in:
+    if outcome == CLOCKED_OUT:
+        flash('Clocked out successfully!', 'success')
+    elif outcome == NOT_CLOCKED_IN:
         flash('You must clock in first.', 'error')
-    elif attendance.check_out:
-        flash('You have already clocked out today.', 'warning')
     else:
-        attendance.check_out = datetime.now().time()
-        db.session.commit()
-        flash('Clocked out successfully!', 'success')
+        flash('You have already clocked out today.', 'warning')
     
     return redirect(url_for('dashboard.index'))
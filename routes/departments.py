@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
 from models import User, Department, db
 from utils.decorators import department_access_required, permission_required
+from utils.loading import employee_list_options, department_employee_options
 from datetime import datetime, date
 
 departments_bp = Blueprint('departments', __name__)
@@ -12,7 +13,7 @@ departments_bp = Blueprint('departments', __name__)
 def procurement():
     """Procurement department dashboard"""
     # Get department-specific data
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Procurement',
         User.is_active == True
     ).all()
@@ -35,7 +36,7 @@ def accounts_hr():
     """Accounts/HR department dashboard"""
     # Get all employees for HR overview
     if current_user.has_role('admin') or current_user.department.name == 'Accounts/Human Resources':
-        all_employees = User.query.filter_by(is_active=True).all()
+        all_employees = User.query.options(*employee_list_options()).filter_by(is_active=True).all()
         total_employees = len(all_employees)
         
         # HR metrics
@@ -61,7 +62,7 @@ def accounts_hr():
 @department_access_required('Spare Shop')
 def spare_shop():
     """Spare Shop department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Spare Shop',
         User.is_active == True
     ).all()
@@ -82,7 +83,7 @@ def spare_shop():
 @department_access_required('Engineering Mechanical')
 def engineering():
     """Engineering Mechanical department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Engineering Mechanical',
         User.is_active == True
     ).all()
@@ -103,7 +104,7 @@ def engineering():
 @department_access_required('Rentals')
 def rentals():
     """Rentals department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Rentals',
         User.is_active == True
     ).all()
@@ -124,7 +125,7 @@ def rentals():
 @department_access_required('Financial Management')
 def financial():
     """Financial Management department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Financial Management',
         User.is_active == True
     ).all()
@@ -147,7 +148,7 @@ def financial():
 @department_access_required('Sales & Marketing')
 def sales_marketing():
     """Sales & Marketing department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Sales & Marketing',
         User.is_active == True
     ).all()
@@ -170,7 +171,7 @@ def sales_marketing():
 @department_access_required('Purchase & Payables')
 def purchase_payables():
     """Purchase & Payables department dashboard"""
-    dept_employees = User.query.join(Department).filter(
+    dept_employees = User.query.join(User.department).options(*department_employee_options()).filter(
         Department.name == 'Purchase & Payables',
         User.is_active == True
     ).all()
@@ -1,41 +1,111 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, abort, current_app, render_template, request, flash, redirect, url_for, jsonify, send_file
 from flask_login import login_required, current_user
-from models import User, Payment, Payroll, db
+from app import csrf
+from models import User, Payment, Payroll, PayrollRun, db
 from utils.decorators import admin_required, permission_required
 from utils.mpesa import MPESAClient, process_mpesa_callback
-from datetime import datetime, date
+from utils.payroll_runs import PayrollRunLocked, period_lock, run_progress, start_payroll_run
+from utils.payment_counters import payment_counts
+from utils.payroll_recompute import recompute_period_payroll
+from utils.payslips import FORMATS, job_progress, payslip_file, payslip_job, start_payslip_job
+from utils.exports import export_response, query_rows
+from utils.pagination import SortKey, paginate
+from utils.loading import payment_list_options, payroll_list_options
+from datetime import datetime, date, timedelta
+from sqlalchemy import select
 from decimal import Decimal
 import json
 
 payments_bp = Blueprint('payments', __name__)
 
+def can_view_all_payments():
+    """Whether the current user sees everyone's payments and payroll"""
+    return current_user.has_role('admin') or current_user.has_permission('payments.view_all')
+
+def payment_filters():
+    """Role scoping and list filters shared by the payment list and export"""
+    conditions = []
+    
+    if not can_view_all_payments():
+        conditions.append(Payment.user_id == current_user.id)
+    
+    status = request.args.get('status', '', type=str)
+    if status:
+        conditions.append(Payment.status == status)
+    
+    payment_type = request.args.get('payment_type', '', type=str)
+    if payment_type:
+        conditions.append(Payment.payment_type == payment_type)
+    
+    date_from = request.args.get('date_from', '', type=str)
+    if date_from:
+        conditions.append(Payment.created_at >= datetime.strptime(date_from, '%Y-%m-%d'))
+    
+    date_to = request.args.get('date_to', '', type=str)
+    if date_to:
+        conditions.append(Payment.created_at < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+    
+    return conditions
+
+def payroll_filters(month, year):
+    """Role scoping and period filters shared by the payroll list and export"""
+    conditions = [Payroll.month == month, Payroll.year == year]
+    
+    if not can_view_all_payments():
+        conditions.append(Payroll.user_id == current_user.id)
+    
+    return conditions
+
 @payments_bp.route('/')
 @login_required
 @permission_required('payments.read')
 def index():
     """Payment dashboard"""
-    page = request.args.get('page', 1, type=int)
+    # Filter payments based on user role and the filter form
+    payments = paginate(Payment.query.filter(*payment_filters()), [
+        SortKey(Payment.created_at, descending=True),
+        SortKey(Payment.id, descending=True)
+    ], per_page=20, options=payment_list_options())
     
-    # Filter payments based on user role
-    if current_user.has_role('admin') or current_user.has_permission('payments.view_all'):
-        payments = Payment.query.order_by(Payment.created_at.desc()).paginate(
-            page=page, per_page=20, error_out=False
-        )
-    else:
-        payments = Payment.query.filter_by(user_id=current_user.id).order_by(
-            Payment.created_at.desc()
-        ).paginate(page=page, per_page=20, error_out=False)
+    # Payment statistics, from the counters kept by status, type and method
+    counts = payment_counts()
+    can_view_all = can_view_all_payments()
     
-    # Payment statistics
-    total_payments = Payment.query.filter_by(status='completed').count()
-    pending_payments = Payment.query.filter_by(status='pending').count()
-    failed_payments = Payment.query.filter_by(status='failed').count()
+    # Filters carried over to the page links
+    filter_args = {name: value for name, value in request.args.items() if name not in ('page', 'cursor')}
     
     return render_template('payments/index.html',
                          payments=payments,
-                         total_payments=total_payments,
-                         pending_payments=pending_payments,
-                         failed_payments=failed_payments)
+                         filter_args=filter_args,
+                         total_payments=counts['completed'],
+                         pending_payments=counts['pending'],
+                         failed_payments=counts['failed'],
+                         can_view_all=can_view_all,
+                         # Company-wide amounts, only for those who see everyone's payments
+                         payment_breakdown=counts.breakdown if can_view_all else None)
+
+@payments_bp.route('/export')
+@login_required
+@permission_required('payments.read')
+def export_payments():
+    """Export payments with the payment list filters as CSV or XLSX"""
+    statement = select(
+        Payment.created_at, User.employee_id, User.first_name, User.last_name, Payment.payment_type,
+        Payment.amount, Payment.currency, Payment.payment_method, Payment.phone_number,
+        Payment.status, Payment.mpesa_receipt_number, Payment.reference_number, Payment.description
+    ).join(User, Payment.user_id == User.id).where(*payment_filters()).order_by(Payment.created_at.desc())
+    
+    rows = (
+        (row.created_at, row.employee_id, f'{row.first_name} {row.last_name}', row.payment_type,
+         row.amount, row.currency, row.payment_method, row.phone_number, row.status,
+         row.mpesa_receipt_number, row.reference_number, row.description)
+        for row in query_rows(statement)
+    )
+    
+    return export_response(request.args.get('format', 'csv'), 'payments', [
+        'Date', 'Employee ID', 'Name', 'Type', 'Amount', 'Currency', 'Method', 'Phone',
+        'Status', 'MPESA Receipt', 'Reference', 'Description'
+    ], rows)
 
 @payments_bp.route('/new', methods=['GET', 'POST'])
 @login_required
@@ -164,6 +234,7 @@ def reject_payment(payment_id):
     return redirect(url_for('payments.view_payment', payment_id=payment_id))
 
 @payments_bp.route('/mpesa/callback', methods=['POST'])
+@csrf.exempt
 def mpesa_callback():
     """Handle MPESA callback"""
     try:
@@ -205,6 +276,7 @@ def mpesa_callback():
         return jsonify({'ResultCode': 1, 'ResultDesc': 'Error processing callback'})
 
 @payments_bp.route('/mpesa/timeout', methods=['POST'])
+@csrf.exempt
 def mpesa_timeout():
     """Handle MPESA timeout"""
     try:
@@ -218,6 +290,7 @@ def mpesa_timeout():
         return jsonify({'ResultCode': 1, 'ResultDesc': 'Error processing timeout'})
 
 @payments_bp.route('/mpesa/result', methods=['POST'])
+@csrf.exempt
 def mpesa_result():
     """Handle MPESA B2C result"""
     try:
@@ -235,63 +308,135 @@ def mpesa_result():
 @permission_required('payments.read')
 def payroll():
     """Payroll management"""
-    page = request.args.get('page', 1, type=int)
     month = request.args.get('month', date.today().month, type=int)
     year = request.args.get('year', date.today().year, type=int)
     
     # Filter payroll records
-    if current_user.has_role('admin') or current_user.has_permission('payments.view_all'):
-        payroll_records = Payroll.query.filter_by(
-            month=month, year=year
-        ).order_by(Payroll.user_id).paginate(
-            page=page, per_page=20, error_out=False
-        )
-    else:
-        payroll_records = Payroll.query.filter_by(
-            user_id=current_user.id, month=month, year=year
-        ).paginate(page=page, per_page=20, error_out=False)
+    payroll_records = paginate(Payroll.query.filter(*payroll_filters(month, year)), [
+        SortKey(Payroll.user_id),
+        SortKey(Payroll.id)
+    ], per_page=20, options=payroll_list_options())
     
     return render_template('payments/payroll.html',
                          payroll_records=payroll_records,
                          month=month,
                          year=year)
 
+@payments_bp.route('/payroll/export')
+@login_required
+@permission_required('payments.read')
+def export_payroll():
+    """Export a payroll period as CSV or XLSX"""
+    month = request.args.get('month', date.today().month, type=int)
+    year = request.args.get('year', date.today().year, type=int)
+    
+    statement = select(
+        User.employee_id, User.first_name, User.last_name, Payroll.basic_salary, Payroll.allowances,
+        Payroll.overtime_hours, Payroll.overtime_pay, Payroll.gross_pay, Payroll.tax_deduction,
+        Payroll.nhif_deduction, Payroll.nssf_deduction, Payroll.other_deductions,
+        Payroll.total_deductions, Payroll.net_pay, Payroll.payment_status
+    ).join(User, Payroll.user_id == User.id).where(*payroll_filters(month, year)).order_by(Payroll.user_id)
+    
+    rows = (
+        (row.employee_id, f'{row.first_name} {row.last_name}', *row[3:])
+        for row in query_rows(statement)
+    )
+    
+    return export_response(request.args.get('format', 'csv'), f'payroll_{year}_{month:02d}', [
+        'Employee ID', 'Name', 'Basic Salary', 'Allowances', 'Overtime Hours', 'Overtime Pay',
+        'Gross Pay', 'Tax', 'NHIF', 'NSSF', 'Other Deductions', 'Total Deductions', 'Net Pay', 'Status'
+    ], rows)
+
 @payments_bp.route('/payroll/generate/<int:month>/<int:year>')
 @login_required
 @admin_required
 def generate_payroll(month, year):
     """Generate payroll for all active employees"""
-    # Check if payroll already exists for this month/year
-    existing_payroll = Payroll.query.filter_by(month=month, year=year).first()
-    if existing_payroll:
-        flash(f'Payroll for {month}/{year} already exists.', 'warning')
+    background = current_app.config['PAYROLL_RUN_BACKGROUND']
+    try:
+        run = start_payroll_run(month, year, started_by=current_user.id, background=background)
+    except PayrollRunLocked:
+        flash(f'Payroll for {month}/{year} is already being generated.', 'warning')
         return redirect(url_for('payments.payroll', month=month, year=year))
     
-    # Get all active employees
-    employees = User.query.filter_by(is_active=True).all()
-    
-    for employee in employees:
-        if employee.salary:
-            payroll = Payroll(
-                user_id=employee.id,
-                month=month,
-                year=year,
-                basic_salary=employee.salary,
-                allowances=0,  # Can be customized
-                overtime_hours=0,
-                overtime_rate=0
-            )
-            
-            # Calculate tax and deductions (simplified)
-            payroll.tax_deduction = payroll.basic_salary * Decimal('0.1')  # 10% tax
-            payroll.nhif_deduction = Decimal('500')  # Fixed NHIF
-            payroll.nssf_deduction = Decimal('400')  # Fixed NSSF
-            
-            payroll.calculate_totals()
-            
-            db.session.add(payroll)
+    if run is None:
+        flash(f'Payroll for {month}/{year} already exists.', 'warning')
+    elif background:
+        flash(f'Payroll run for {month}/{year} started ({len(run.units)} departments).', 'info')
+    elif run.status == 'completed':
+        flash(f'Payroll generated successfully for {month}/{year} ({run.employees} employees).', 'success')
+    else:
+        flash(f'Payroll run for {month}/{year} failed: {run.error}. Generate again to resume.', 'error')
+    return redirect(url_for('payments.payroll', month=month, year=year))
+
+@payments_bp.route('/payroll/recompute/<int:month>/<int:year>', methods=['POST'])
+@login_required
+@admin_required
+def recompute_payroll(month, year):
+    """Recompute payroll for employees whose inputs changed; returns the diff as JSON"""
+    dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true')
+    try:
+        with period_lock(month, year):
+            diff = recompute_period_payroll(month, year, dry_run=dry_run)
+            db.session.commit()
+    except PayrollRunLocked as e:
+        return jsonify({'error': str(e)}), 409
     
-    db.session.commit()
+    return jsonify(diff.to_dict())
+
+@payments_bp.route('/payroll/runs/<int:month>/<int:year>')
+@login_required
+@permission_required('payments.read')
+def payroll_run_status(month, year):
+    """Progress of a period's payroll run as JSON"""
+    run = PayrollRun.query.filter_by(month=month, year=year).first_or_404()
+    return jsonify(run_progress(run))
+
+@payments_bp.route('/payslips/<int:payroll_id>')
+@login_required
+def view_payslip(payroll_id):
+    """Download a payroll row's payslip, rendering it if it changed since the last run"""
+    payroll = Payroll.query.get_or_404(payroll_id)
+    
+    # Employees always see their own payslips
+    if not (can_view_all_payments() or payroll.user_id == current_user.id):
+        abort(403)
+    
+    fmt = request.args.get('format', current_app.config['PAYSLIP_FORMAT'])
+    if fmt not in FORMATS:
+        abort(400)
+    
+    try:
+        path = payslip_file(payroll, fmt)
+    except RuntimeError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('payments.payroll', month=payroll.month, year=payroll.year))
+    return send_file(path, mimetype=FORMATS[fmt], as_attachment=fmt == 'pdf',
+                     download_name=f'payslip_{payroll.year}_{payroll.month:02d}_{payroll.user.employee_id}.{fmt}')
+
+@payments_bp.route('/payslips/generate/<int:month>/<int:year>', methods=['POST'])
+@login_required
+@admin_required
+def generate_payslips(month, year):
+    """Render, and optionally email, a period's changed payslips in the background"""
+    fmt = request.form.get('format') or current_app.config['PAYSLIP_FORMAT']
+    if fmt not in FORMATS:
+        flash(f'Unknown payslip format: {fmt}.', 'error')
+        return redirect(url_for('payments.payroll', month=month, year=year))
     
-    flash(f'Payroll generated successfully for {month}/{year}.', 'success')
+    email = request.form.get('email', 'false').lower() in ('1', 'true', 'on')
+    if start_payslip_job(month, year, fmt, email, started_by=current_user.id) is None:
+        flash(f'Payslips for {month}/{year} are already being generated.', 'warning')
+    else:
+        flash(f'Payslip generation for {month}/{year} started{" with email delivery" if email else ""}.', 'info')
     return redirect(url_for('payments.payroll', month=month, year=year))
+
+@payments_bp.route('/payslips/status/<int:month>/<int:year>')
+@login_required
+@admin_required
+def payslip_status(month, year):
+    """Progress and throughput of a period's payslip job as JSON"""
+    job = payslip_job(month, year)
+    if job is None:
+        abort(404)
+    return jsonify(job_progress(job))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator tests for the Mutech Civil HRM System
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+class TestDataset(AppTestCase):
+    """Test the bulk synthetic company generator"""
+
+    database = 'test_dataset.db'
+    initialize_system = False
+
+    def snapshot(self):
+        """Aggregates that change if any generated value changes"""
+        from app import db
+        from models import Attendance, DailyAttendanceSummary, LeaveRequest, Payroll, User
+        from sqlalchemy import func
+
+        return {
+            'users': db.session.query(func.count(User.id), func.sum(User.salary), func.sum(User.department_id)).one(),
+            'attendance': db.session.query(Attendance.status, func.count(), func.sum(Attendance.worked_minutes))
+                .group_by(Attendance.status).order_by(Attendance.status).all(),
+            'leave': db.session.query(LeaveRequest.status, func.count(), func.sum(LeaveRequest.days_requested))
+                .group_by(LeaveRequest.status).order_by(LeaveRequest.status).all(),
+            'payroll': db.session.query(func.count(Payroll.id), func.sum(Payroll.net_pay),
+                                        func.sum(Payroll.overtime_hours), func.count(Payroll.payment_id)).one(),
+            'summary': db.session.query(func.sum(DailyAttendanceSummary.total)).scalar()
+        }
+
+    def test_generated_company(self):
+        """Test volumes, consistency and determinism"""
+        from app import db
+        from models import Attendance, Department, Employee, Payment, Payroll, User
+        from utils.dataset import generate_dataset
+
+        end = date(2024, 6, 30)
+        written = generate_dataset(employees=25, departments=10, years=0.5, seed=7, end=end, batch_size=500)
+
+        self.assertEqual(User.query.count(), 25)
+        self.assertEqual(Employee.query.count(), 25)
+        self.assertEqual(Department.query.count(), 10)
+        self.assertEqual(written['attendance'], Attendance.query.count())
+        self.assertGreater(written['attendance'], 20 * 100)
+        self.assertEqual(Payroll.query.count(), Payment.query.count())
+        self.assertEqual(Payroll.query.filter(Payroll.payment_id.is_(None)).count(), 0)
+        self.assertEqual({(payroll.month, payroll.year) for payroll in Payroll.query},
+                         {(month, 2024) for month in range(1, 7)})
+
+        # Stored minutes and statuses follow the usual rules
+        for record in Attendance.query.limit(200):
+            worked = record.worked_minutes
+            record.compute_minutes()
+            self.assertEqual(record.worked_minutes, worked)
+            self.assertEqual(record.check_in is None, record.status == 'absent')
+        db.session.rollback()
+
+        first = self.snapshot()
+        self.assertEqual(first['summary'], written['attendance'])
+
+        with self.assertRaises(ValueError):
+            generate_dataset(employees=1, end=end)
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        generate_dataset(employees=25, departments=10, years=0.5, seed=7, end=end, batch_size=97)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_empty_database_only(self):
+        """Test the generator refuses a database with users and defaults to a fixed end date"""
+        from app import db
+        from models import Attendance, Department, User
+        from utils.dataset import DEFAULT_END, generate_dataset
+        from utils.permissions import initialize_system
+
+        initialize_system()
+        db.session.add(User(employee_id='ADMIN001', email='admin@mutechcivil.com', password_hash='x',
+                            first_name='Admin', last_name='User',
+                            department_id=Department.query.filter_by(code='ACHR').first().id))
+        db.session.commit()
+        with self.assertRaises(ValueError):
+            generate_dataset(employees=1)
+
+        db.session.execute(db.delete(User))
+        db.session.commit()
+        generate_dataset(employees=3, years=0.1)
+        self.assertEqual(db.session.query(db.func.max(Attendance.date)).scalar(), DEFAULT_END)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Query count tests for the Mutech Civil HRM list views
+
+Each list page is rendered with a few rows and again with many rows. The
+number of statements must not change: relationships the templates walk are
+loaded by the view's loader profile (utils/loading.py), not lazily per row.
+Templates render only the relationships the real pages show, so a missing
+or incomplete profile shows up as extra queries.
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+from decimal import Decimal
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+# The relationships each list page renders per row
+LIST_TEMPLATES = {
+    'admin/users.html': '''{% for user in users.items %}
+        {{ user.full_name }} {{ user.department.name }}
+        {% for role in user.roles %}{{ role.name }}{% endfor %}
+    {% endfor %}''',
+    'admin/attendance.html': '''{% for record in attendance_records.items %}
+        {{ record.user.full_name }} {{ record.user.department.name }} {{ record.status }}
+    {% endfor %}''',
+    'admin/leave_requests.html': '''{% for leave in leave_requests.items %}
+        {{ leave.user.full_name }} {{ leave.user.department.name }}
+        {{ leave.approver.full_name if leave.approver }}
+    {% endfor %}''',
+    'payments/index.html': '''{% for payment in payments.items %}
+        {{ payment.user.full_name }} {{ payment.user.employee_id }}
+        {{ payment.processor.full_name if payment.processor }}
+    {% endfor %}''',
+    'payments/payroll.html': '''{% for record in payroll_records.items %}
+        {{ record.user.full_name }} {{ record.user.department.name }}
+        {{ record.payment.status if record.payment }}
+    {% endfor %}''',
+    'departments/engineering.html': '''{% for employee in dept_employees %}
+        {{ employee.full_name }} {{ employee.department.name }}
+        {{ employee.employee_profile.bank_name if employee.employee_profile }}
+    {% endfor %}''',
+    'departments/accounts_hr.html': '''{% for employee in all_employees %}
+        {{ employee.full_name }} {{ employee.department.name }}
+        {{ employee.employee_profile.bank_name if employee.employee_profile }}
+    {% endfor %}''',
+}
+
+class TestListQueries(AppTestCase):
+    """Test list pages run a fixed number of queries"""
+
+    database = 'test_list_queries.db'
+    config = {'PAGINATION_COUNT_TTL': 0, 'QUERY_STATS': True}
+
+    def configure_app(self, app):
+        from jinja2 import ChoiceLoader, DictLoader
+        app.jinja_loader = ChoiceLoader([DictLoader(LIST_TEMPLATES), app.jinja_loader])
+
+    def setUp(self):
+        """Set up a test database with list page templates"""
+        super().setUp()
+
+        from models import User, Department, Role, db
+        admin_role = Role.query.filter_by(name='admin').first()
+        self.admin = User(employee_id='ADMIN001', email='admin@mutechcivil.com',
+                          first_name='Admin', last_name='User',
+                          department_id=Department.query.filter_by(code='ACHR').first().id)
+        self.admin.set_password('adminpass')
+        self.admin.roles.append(admin_role)
+        db.session.add(self.admin)
+        db.session.commit()
+
+        self.seeded = 0
+
+    def seed(self, count):
+        """Add employees across departments, each with a row in every list"""
+        from models import (User, Department, Role, Employee, Attendance, LeaveRequest,
+                            Payment, Payroll, db)
+
+        departments = Department.query.order_by(Department.id).all()
+        employee_role = Role.query.filter_by(name='employee').first()
+        today = date.today()
+
+        for index in range(self.seeded, self.seeded + count):
+            user = User(employee_id=f'LIST{index:04d}', email=f'list{index}@mutechcivil.com',
+                        first_name='List', last_name=f'User{index}', is_active=True,
+                        department_id=departments[index % len(departments)].id,
+                        salary=Decimal('50000'))
+            user.set_password('listpass')
+            user.roles.append(employee_role)
+            db.session.add(user)
+            db.session.flush()
+
+            payment = Payment(user_id=user.id, payment_type='salary', amount=Decimal('50000'),
+                              payment_method='mpesa', status='completed', processed_by=self.admin.id)
+            db.session.add_all([
+                Employee(user_id=user.id, bank_name='KCB'),
+                Attendance(user_id=user.id, date=today, status='present'),
+                LeaveRequest(user_id=user.id, leave_type='annual', start_date=today, end_date=today,
+                             days_requested=1, status='approved', approved_by=self.admin.id),
+                payment
+            ])
+            db.session.flush()
+            db.session.add(Payroll(user_id=user.id, month=today.month, year=today.year,
+                                   basic_salary=user.salary, gross_pay=user.salary,
+                                   total_deductions=0, net_pay=user.salary, payment_id=payment.id))
+
+        db.session.commit()
+        self.seeded += count
+
+    def login(self):
+        """Log the test client in as the admin"""
+        from app import db
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.admin.id)
+            session['_fresh'] = True
+        db.session.expunge_all()
+
+    def count_queries(self, url):
+        """Render a page as the admin and count the statements it ran"""
+        from utils.query_stats import capture_queries
+
+        self.login()
+        with capture_queries() as stats:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200, url)
+        return stats.count
+
+    def assert_fixed_queries(self, *urls):
+        """Query counts must not grow with the number of rows on the page"""
+        self.seed(3)
+        # First requests also run one-off setup queries
+        for url in urls:
+            self.count_queries(url)
+        few = [self.count_queries(url) for url in urls]
+        self.seed(12)
+        many = [self.count_queries(url) for url in urls]
+
+        for url, before, after in zip(urls, few, many):
+            self.assertEqual(before, after, f'{url}: {before} queries with 3 rows, {after} with 15')
+
+    def test_admin_lists(self):
+        """Test admin list pages"""
+        self.assert_fixed_queries(
+            '/admin/users',
+            f'/admin/attendance?date={date.today():%Y-%m-%d}',
+            '/admin/leave_requests'
+        )
+
+    def test_payment_lists(self):
+        """Test payment and payroll list pages"""
+        today = date.today()
+        self.assert_fixed_queries(
+            '/payments/',
+            f'/payments/payroll?month={today.month}&year={today.year}'
+        )
+
+    def test_department_lists(self):
+        """Test department employee lists"""
+        self.assert_fixed_queries(
+            '/departments/engineering',
+            '/departments/accounts_hr'
+        )
+
+    def test_query_budgets(self):
+        """Test list pages stay within their query budgets and report them"""
+        from utils.query_stats import assert_max_queries
+
+        self.seed(5)
+        today = date.today()
+        budgets = {
+            '/admin/users': 8,
+            '/admin/leave_requests': 8,
+            f'/payments/payroll?month={today.month}&year={today.year}': 8
+        }
+
+        for url, budget in budgets.items():
+            self.count_queries(url)
+            self.login()
+            with assert_max_queries(budget, url) as stats:
+                response = self.client.get(url)
+
+            self.assertEqual(response.headers['Server-Timing'].split(';')[:2],
+                             ['db', f'desc="{stats.count} queries"'])
+
+    def test_repeated_query_detection(self):
+        """Test statements repeated within a request are flagged"""
+        from models import User
+        from utils.query_stats import capture_queries
+
+        self.seed(6)
+        with capture_queries() as stats:
+            for user_id in range(1, 7):
+                User.query.get(user_id)
+
+        repeated = stats.repeated(self.app.config['QUERY_REPEAT_THRESHOLD'])
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 6)
+        self.assertIn('FROM user', repeated[0][0])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
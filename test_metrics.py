@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics tests for the Mutech Civil HRM app
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import unittest
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+class TestMetrics(AppTestCase):
+    """Test the /metrics endpoint and instrumented calls"""
+
+    database = 'test_metrics.db'
+    initialize_system = False
+
+    def sample(self, name, labels=None):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+    def test_request_latency(self):
+        """Test requests are counted by endpoint and status"""
+        labels = {'blueprint': 'auth', 'endpoint': 'auth.login', 'method': 'GET', 'status': '200'}
+        before = self.sample('hrm_request_duration_seconds_count', labels)
+        checkouts = self.sample('hrm_db_pool_checkout_seconds_count')
+
+        self.client.get('/auth/login')
+        self.client.get('/auth/login')
+        self.client.get('/no-such-page')
+
+        from app import db
+        from models import User
+        db.session.remove()
+        User.query.count()
+
+        self.assertEqual(self.sample('hrm_request_duration_seconds_count', labels), before + 2)
+        self.assertGreaterEqual(self.sample('hrm_request_duration_seconds_count', {
+            'blueprint': '', 'endpoint': 'unmatched', 'method': 'GET', 'status': '404'
+        }), 1)
+        self.assertGreater(self.sample('hrm_db_pool_checkout_seconds_count'), checkouts)
+
+        self.app.config['METRICS_TOKEN'] = 'scrape-secret'
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        self.assertIn('hrm_request_duration_seconds_bucket{', body)
+        self.assertIn('hrm_db_pool_connections_in_use', body)
+
+    def test_metrics_token(self):
+        """Test METRICS_TOKEN protects the endpoint, which needs one outside debug mode"""
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.app.debug = True
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.app.debug = False
+
+        self.app.config['METRICS_TOKEN'] = 'scrape-secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_mpesa_outcomes(self):
+        """Test MPESA calls are timed with their outcome"""
+        from utils.mpesa import MPESAClient
+
+        labels = {'operation': 'access_token', 'outcome': 'error'}
+        before = self.sample('hrm_mpesa_request_duration_seconds_count', labels)
+
+        with self.app.test_request_context():
+            client = MPESAClient()
+            client.base_url = 'http://127.0.0.1:9'
+            self.assertIsNone(client.get_access_token())
+
+        self.assertEqual(self.sample('hrm_mpesa_request_duration_seconds_count', labels), before + 1)
+
+    def test_multiprocess_aggregation(self):
+        """Test samples written by separate worker processes are summed"""
+        metrics_dir = tempfile.mkdtemp()
+        try:
+            worker = ('from utils.metrics import PAYROLL_RUN_SECONDS, track_duration\n'
+                      'with track_duration(PAYROLL_RUN_SECONDS):\n'
+                      '    pass\n')
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+            root = os.path.dirname(os.path.abspath(__file__))
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', worker], env=env, cwd=root, check=True)
+
+            from prometheus_client import CollectorRegistry, multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=metrics_dir)
+            self.assertEqual(registry.get_sample_value(
+                'hrm_payroll_run_duration_seconds_count', {'outcome': 'success'}
+            ), 2)
+        finally:
+            shutil.rmtree(metrics_dir)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
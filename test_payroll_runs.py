@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Payroll run tests for the Mutech Civil HRM app
+"""
+
+import os
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+class TestPayrollRuns(AppTestCase):
+    """Test per-department, resumable payroll runs"""
+
+    database = 'test_payroll_runs.db'
+
+    def setUp(self):
+        """Set up a test app with employees in three departments"""
+        super().setUp()
+
+        from models import User, Department, Role, db
+        self.departments = [Department.query.filter_by(code=code).first().id for code in ('PROC', 'ACHR', 'ENGM')]
+        for index in range(9):
+            user = User(
+                employee_id=f'RUN{index:03d}',
+                email=f'run{index}@mutechcivil.com',
+                first_name='Run',
+                last_name=f'User{index}',
+                department_id=self.departments[index % 3],
+                salary=Decimal(40000 + index * 5000),
+                hire_date=date(2020, 1, 6)
+            )
+            user.set_password('runpass')
+            if index == 0:
+                user.roles.append(Role.query.filter_by(name='admin').first())
+            db.session.add(user)
+        db.session.commit()
+
+    def test_run_by_department(self):
+        """Test a run pays everyone once, one checkpointed unit per department"""
+        from models import Payroll, PayrollRun
+        from utils.payroll_runs import start_payroll_run
+
+        run = start_payroll_run(2, 2024, workers=1)
+        self.assertEqual((run.status, run.employees, run.workers), ('completed', 9, 1))
+        self.assertEqual([unit.department_id for unit in run.units], sorted(self.departments))
+        self.assertTrue(all(unit.status == 'completed' and unit.employees == 3 for unit in run.units))
+        self.assertEqual(Payroll.query.filter_by(month=2, year=2024).count(), 9)
+
+        self.assertIsNone(start_payroll_run(2, 2024, workers=1))
+        self.assertEqual(PayrollRun.query.count(), 1)
+
+    def test_resume(self):
+        """Test a crashed run is locked until stale, then resumes only unfinished units"""
+        from models import Payroll, PayrollRunUnit, User, db
+        from utils.payroll_runs import PayrollRunLocked, start_payroll_run
+
+        run = start_payroll_run(2, 2024, workers=1)
+        completed_at = {unit.id: unit.completed_at for unit in run.units}
+
+        # Crash after two of the three units committed
+        lost = run.units[0]
+        db.session.execute(db.delete(Payroll).where(
+            Payroll.user_id.in_(db.select(User.id).where(User.department_id == lost.department_id))
+        ))
+        lost.status = 'pending'
+        run.status = 'running'
+        run.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+        with self.assertRaises(PayrollRunLocked):
+            start_payroll_run(2, 2024, workers=1)
+
+        run.heartbeat_at = datetime.utcnow() - timedelta(seconds=self.app.config['PAYROLL_RUN_STALE_SECONDS'] + 1)
+        db.session.commit()
+
+        run = start_payroll_run(2, 2024, workers=1)
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(Payroll.query.filter_by(month=2, year=2024).count(), 9)
+        for unit in PayrollRunUnit.query.all():
+            if unit.id == lost.id:
+                self.assertNotEqual(unit.completed_at, completed_at[unit.id])
+            else:
+                self.assertEqual(unit.completed_at, completed_at[unit.id])
+
+    def test_heartbeat(self):
+        """Test the heartbeat is refreshed while a long unit executes"""
+        import time
+        from models import PayrollRun, db
+        from utils.payroll_runs import heartbeat
+
+        stale = datetime.utcnow() - timedelta(hours=1)
+        run = PayrollRun(month=2, year=2024, status='running', employees=0, heartbeat_at=stale)
+        db.session.add(run)
+        db.session.commit()
+
+        with heartbeat(run.id, interval=0.05):
+            time.sleep(0.3)
+        db.session.refresh(run)
+        self.assertGreater(run.heartbeat_at, stale + timedelta(minutes=59))
+
+    def test_failed_unit(self):
+        """Test a failing department fails the run without losing the others"""
+        from models import Payroll
+        from utils import payroll_runs
+
+        generate = payroll_runs.generate_period_payroll
+        failing = self.departments[1]
+
+        def generate_or_fail(month, year, department_id=None):
+            if department_id == failing:
+                raise RuntimeError('bank file unavailable')
+            return generate(month, year, department_id=department_id)
+
+        with mock.patch.object(payroll_runs, 'generate_period_payroll', generate_or_fail):
+            run = payroll_runs.start_payroll_run(2, 2024, workers=1)
+
+        self.assertEqual((run.status, run.error), ('failed', '1 of 3 departments failed'))
+        self.assertEqual(payroll_runs.run_progress(run)['units_failed'], [failing])
+        self.assertEqual(Payroll.query.count(), 6)
+
+        run = payroll_runs.start_payroll_run(2, 2024, workers=1)
+        self.assertEqual((run.status, run.employees), ('completed', 9))
+        self.assertEqual(Payroll.query.count(), 9)
+
+    def test_process_pool(self):
+        """Test units execute on worker processes"""
+        from models import Payroll
+        from utils.payroll_runs import start_payroll_run
+
+        run = start_payroll_run(3, 2024, workers=2)
+        self.assertEqual((run.status, run.employees, run.workers), ('completed', 9, 2))
+        self.assertEqual(Payroll.query.filter_by(month=3, year=2024).count(), 9)
+
+    def test_recompute(self):
+        """Test a recompute rewrites only employees whose inputs changed and reports the diff"""
+        from datetime import date, time
+        from models import Attendance, Payroll, User, db
+        from utils.payroll_recompute import recompute_period_payroll
+        from utils.payroll_runs import start_payroll_run
+        from utils.query_stats import capture_queries
+        from utils.statutory import employee_deductions
+
+        start_payroll_run(2, 2024, workers=1)
+        self.assertEqual(recompute_period_payroll(2, 2024).changes, [])
+
+        users = User.query.order_by(User.id).all()
+        untouched = {row.user_id: row.updated_at for row in Payroll.query}
+
+        users[1].salary = Decimal('99999.99')                  # salary correction
+        db.session.add(Attendance(user_id=users[2].id, date=date(2024, 2, 1), check_in=time(8, 0),
+                                  check_out=time(18, 30), status='present'))   # 150 minutes overtime
+        users[3].is_active = False                             # termination inside the period
+        users[3].termination_date = date(2024, 2, 15)
+        users[7].is_active = False                             # left after the period: kept
+        users[7].termination_date = date(2024, 3, 10)
+        hand_edited = Payroll.query.filter_by(user_id=users[4].id).one()
+        hand_edited.other_deductions = Decimal('1500')         # deduction without updated totals
+        paid = Payroll.query.filter_by(user_id=users[5].id).one()
+        paid.payment_status = 'completed'
+        users[5].salary = Decimal('1000.00')
+        hire = User(employee_id='RUN999', email='run999@mutechcivil.com', first_name='Run', last_name='Hire',
+                    department_id=self.departments[0], salary=Decimal('52000'), hire_date=date(2024, 2, 12))
+        hire.set_password('runpass')
+        late_hire = User(employee_id='RUN998', email='run998@mutechcivil.com', first_name='Run', last_name='Late',
+                         department_id=self.departments[0], salary=Decimal('52000'), hire_date=date(2024, 3, 4))
+        late_hire.set_password('runpass')
+        db.session.add_all([hire, late_hire])
+        db.session.commit()
+
+        preview = recompute_period_payroll(2, 2024, dry_run=True)
+        self.assertEqual(Payroll.query.filter_by(user_id=users[1].id).one().basic_salary, Decimal('45000'))
+
+        with capture_queries() as stats:
+            diff = recompute_period_payroll(2, 2024)
+        db.session.commit()
+        self.assertLessEqual(stats.count, 6)  # Includes the removed row's payslips
+        self.assertEqual(preview.to_dict()['changes'], diff.to_dict()['changes'])
+
+        actions = {change.user_id: change.action for change in diff.changes}
+        self.assertEqual(actions, {users[1].id: 'updated', users[2].id: 'updated', users[3].id: 'removed',
+                                   users[4].id: 'updated', users[5].id: 'paid', users[7].id: 'inactive',
+                                   hire.id: 'added'})
+        self.assertEqual(diff.checked, 7)
+        changes = {change.user_id: change.changes for change in diff.changes}
+        self.assertEqual(changes[users[1].id]['basic_salary'], (Decimal('45000.00'), Decimal('99999.99')))
+        self.assertEqual(changes[users[2].id]['overtime_hours'], (Decimal('0.00'), Decimal('2.50')))
+        self.assertNotIn('gross_pay', changes[users[4].id])
+
+        corrected = Payroll.query.filter_by(user_id=users[1].id).one()
+        statutory = employee_deductions(Decimal('99999.99'), date(2024, 2, 29))
+        self.assertEqual((corrected.tax_deduction, corrected.nhif_deduction, corrected.nssf_deduction),
+                         (statutory['paye'], statutory['health'], statutory['nssf']))
+        edited = Payroll.query.filter_by(user_id=users[4].id).one()
+        self.assertEqual(edited.net_pay, edited.gross_pay - edited.total_deductions)
+        self.assertEqual(edited.total_deductions, edited.tax_deduction + edited.nhif_deduction +
+                         edited.nssf_deduction + Decimal('1500'))
+        self.assertEqual(Payroll.query.filter_by(user_id=users[5].id).one().basic_salary, Decimal('65000'))
+        self.assertIsNone(Payroll.query.filter_by(user_id=users[3].id).first())
+        self.assertEqual(Payroll.query.filter_by(user_id=users[6].id).one().updated_at, untouched[users[6].id])
+        self.assertIsNotNone(Payroll.query.filter_by(user_id=users[7].id).first())
+        self.assertIsNone(Payroll.query.filter_by(user_id=late_hire.id).first())
+
+        # Only the paid row's outstanding difference and the inactive employee are left
+        diff = recompute_period_payroll(2, 2024)
+        self.assertEqual([(change.user_id, change.action) for change in diff.changes],
+                         [(users[5].id, 'paid'), (users[7].id, 'inactive')])
+
+    def test_employment_window(self):
+        """Test generate and recompute pay only employees employed in the period"""
+        from datetime import date
+        from decimal import Decimal
+        from models import Payroll, User, db
+        from utils.payroll_recompute import recompute_period_payroll
+        from utils.payroll_runs import start_payroll_run
+
+        users = User.query.order_by(User.id).all()
+        users[1].hire_date = date(2024, 3, 4)                  # hired after the period
+        users[2].is_active = False                             # left before the period
+        users[2].termination_date = date(2024, 1, 31)
+        users[3].is_active = False                             # left after it: still paid
+        users[3].termination_date = date(2024, 3, 10)
+        db.session.commit()
+
+        run = start_payroll_run(2, 2024, workers=1)
+        self.assertEqual(run.employees, 7)
+        paid = {row.user_id for row in Payroll.query.filter_by(month=2, year=2024)}
+        self.assertNotIn(users[1].id, paid)
+        self.assertNotIn(users[2].id, paid)
+        self.assertIn(users[3].id, paid)
+        self.assertEqual([(change.user_id, change.action) for change in recompute_period_payroll(2, 2024).changes],
+                         [(users[3].id, 'inactive')])
+
+        # A row written before hire dates were respected is removed by a recompute
+        db.session.add(Payroll(user_id=users[1].id, month=2, year=2024, basic_salary=Decimal('45000'),
+                               gross_pay=Decimal('45000'), total_deductions=Decimal('0'), net_pay=Decimal('45000')))
+        db.session.commit()
+        diff = recompute_period_payroll(2, 2024)
+        db.session.commit()
+        self.assertEqual([(change.user_id, change.action) for change in diff.changes],
+                         [(users[1].id, 'removed'), (users[3].id, 'inactive')])
+        self.assertIsNone(Payroll.query.filter_by(user_id=users[1].id).first())
+
+    def test_recompute_lock(self):
+        """Test a recompute holds the period's run lock and restores the run afterwards"""
+        from models import PayrollRun, db
+        from utils.payroll_runs import PayrollRunLocked, period_lock, start_payroll_run
+
+        start_payroll_run(2, 2024, workers=1)
+        with period_lock(2, 2024):
+            self.assertEqual(db.session.scalar(db.select(PayrollRun.status)), 'running')
+            with self.assertRaises(PayrollRunLocked):
+                start_payroll_run(2, 2024, workers=1)
+            with self.assertRaises(PayrollRunLocked):
+                with period_lock(2, 2024):
+                    pass
+        run = PayrollRun.query.one()
+        db.session.refresh(run)
+        self.assertEqual(run.status, 'completed')
+
+        run.status = 'running'
+        run.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+        response = self.client.post('/auth/login', data={'email': 'run0@mutechcivil.com', 'password': 'runpass'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.post('/payments/payroll/recompute/2/2024').status_code, 409)
+
+    def test_generate_route(self):
+        """Test the generate route runs the period and reports its progress"""
+        response = self.client.post('/auth/login', data={'email': 'run0@mutechcivil.com', 'password': 'runpass'})
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(self.client.get('/payments/payroll/runs/2/2024').status_code, 404)
+        self.client.get('/payments/payroll/generate/2/2024')
+        with self.client.session_transaction() as session:
+            self.assertIn(('success', 'Payroll generated successfully for 2/2024 (9 employees).'),
+                          session['_flashes'])
+
+        progress = self.client.get('/payments/payroll/runs/2/2024').get_json()
+        self.assertEqual((progress['status'], progress['units'], progress['units_completed']), ('completed', 3, 3))
+
+        from models import User, db
+        user = User.query.filter_by(employee_id='RUN001').one()
+        user.salary = Decimal('50000')
+        db.session.commit()
+        report = self.client.post('/payments/payroll/recompute/2/2024?dry_run=1').get_json()
+        self.assertEqual((report['dry_run'], report['summary']),
+                         (True, '2/2024: 1 employees recomputed; 0 added, 1 updated, 0 removed, 0 paid, 0 inactive'))
+        self.assertEqual(report['changes'][0]['changes']['basic_salary'], ['45000.00', '50000.00'])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
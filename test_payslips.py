@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Payslip tests for the Mutech Civil HRM app
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+class TestPayslips(AppTestCase):
+    """Test payslip rendering, caching and email delivery"""
+
+    database = 'test_payslips.db'
+    config = {'PAYSLIP_EMAIL_BATCH': 2}
+
+    def configure_app(self, app):
+        app.config['PAYSLIP_DIR'] = tempfile.mkdtemp()
+        app.extensions['mail'].suppress = True
+        app.extensions['mail'].default_sender = 'payroll@mutechcivil.com'
+
+    def setUp(self):
+        """Set up a test app with a generated payroll period"""
+        super().setUp()
+
+        from models import User, Department, Role, db
+        department = Department.query.filter_by(code='PROC').first()
+        for index in range(5):
+            user = User(
+                employee_id=f'SLIP{index:03d}',
+                email=f'slip{index}@mutechcivil.com',
+                first_name='Slip',
+                last_name=f'User{index}',
+                department_id=department.id,
+                salary=Decimal(40000 + index * 5000),
+                hire_date=date(2020, 1, 6)
+            )
+            user.set_password('slippass')
+            if index == 0:
+                user.roles.append(Role.query.filter_by(name='admin').first())
+            if index == 1:
+                user.roles.append(Role.query.filter_by(name='hr_manager').first())
+            db.session.add(user)
+        db.session.commit()
+
+        from utils.payroll_runs import start_payroll_run
+        start_payroll_run(2, 2024, workers=1)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        super().tearDown()
+        shutil.rmtree(self.app.config['PAYSLIP_DIR'], ignore_errors=True)
+
+    def test_render_and_skip_unchanged(self):
+        """Test payslips render once and only changed payroll rows render again"""
+        from models import Payroll, Payslip, User, db
+        from utils.payslips import generate_payslips
+
+        progress = generate_payslips(2, 2024, 'html', workers=1)
+        self.assertEqual((progress.status, progress.total, progress.rendered, progress.skipped),
+                         ('completed', 5, 5, 0))
+
+        payslip = Payslip.query.join(Payroll).join(User).filter(User.employee_id == 'SLIP002').one()
+        with open(os.path.join(self.app.config['PAYSLIP_DIR'], payslip.path), encoding='utf-8') as rendered:
+            html = rendered.read()
+        self.assertIn('SLIP002', html)
+        self.assertIn('50,000.00', html)
+        self.assertIn(f'{payslip.payroll.net_pay:,.2f}', html)
+
+        progress = generate_payslips(2, 2024, 'html', workers=1)
+        self.assertEqual((progress.rendered, progress.skipped), (0, 5))
+
+        hashes = {slip.payroll_id: slip.content_hash for slip in Payslip.query}
+        payslip.payroll.allowances = Decimal('2500')
+        db.session.commit()
+        os.remove(os.path.join(self.app.config['PAYSLIP_DIR'], Payslip.query.filter(
+            Payslip.payroll_id != payslip.payroll_id).first().path))
+
+        progress = generate_payslips(2, 2024, 'html', workers=1)
+        self.assertEqual((progress.rendered, progress.skipped), (2, 3))
+        changed = [slip.payroll_id for slip in Payslip.query if slip.content_hash != hashes[slip.payroll_id]]
+        self.assertEqual(changed, [payslip.payroll_id])
+
+    def test_process_pool(self):
+        """Test payslips render on worker processes"""
+        from models import Payslip
+        from utils import payslips
+
+        payslips.RENDER_CHUNK = 2
+        try:
+            progress = payslips.generate_payslips(2, 2024, 'html', workers=2)
+        finally:
+            payslips.RENDER_CHUNK = 50
+        self.assertEqual(progress.rendered, 5)
+        self.assertEqual(Payslip.query.count(), 5)
+        for slip in Payslip.query:
+            self.assertEqual(os.path.getsize(os.path.join(self.app.config['PAYSLIP_DIR'], slip.path)), slip.size)
+
+    def test_email_batches(self):
+        """Test payslips are emailed once per version, one SMTP connection per batch"""
+        from app import mail
+        from models import Payroll, Payslip, db
+        from utils import payslips
+
+        connections = []
+        connect = mail.connect
+
+        def counting_connect():
+            connections.append(1)
+            return connect()
+
+        mail.connect = counting_connect
+        try:
+            with mail.record_messages() as outbox:
+                progress = payslips.generate_payslips(2, 2024, 'html', email=True, workers=1)
+                self.assertEqual((progress.emailed, progress.email_failed), (5, 0))
+                self.assertEqual(len(outbox), 5)
+                self.assertEqual(len(connections), 3)
+                self.assertEqual(outbox[0].attachments[0].content_type, 'text/html')
+                self.assertEqual(outbox[0].recipients, ['slip0@mutechcivil.com'])
+
+                self.assertEqual(payslips.generate_payslips(2, 2024, 'html', email=True, workers=1).emailed, 0)
+
+                row = Payroll.query.order_by(Payroll.id).first()
+                row.other_deductions = Decimal('100')
+                db.session.commit()
+                progress = payslips.generate_payslips(2, 2024, 'html', email=True, workers=1)
+                self.assertEqual((progress.rendered, progress.emailed), (1, 1))
+                self.assertEqual(len(outbox), 6)
+        finally:
+            mail.connect = connect
+
+        self.assertEqual(Payslip.query.filter(Payslip.emailed_hash == Payslip.content_hash).count(), 5)
+
+    def test_view_payslip(self):
+        """Test employees download their own payslips and only payroll viewers see others"""
+        from models import Payroll, User
+
+        own = Payroll.query.join(User).filter(User.employee_id == 'SLIP003').one()
+        other = Payroll.query.join(User).filter(User.employee_id == 'SLIP004').one()
+
+        self.client.post('/auth/login', data={'email': 'slip3@mutechcivil.com', 'password': 'slippass'})
+        response = self.client.get(f'/payments/payslips/{own.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'SLIP003', response.data)
+        self.assertEqual(self.client.get(f'/payments/payslips/{other.id}').status_code, 403)
+        self.client.get('/auth/logout')
+
+        self.client.post('/auth/login', data={'email': 'slip1@mutechcivil.com', 'password': 'slippass'})
+        self.assertEqual(self.client.get(f'/payments/payslips/{other.id}').status_code, 403)
+        self.client.get('/auth/logout')
+
+        self.client.post('/auth/login', data={'email': 'slip0@mutechcivil.com', 'password': 'slippass'})
+        self.assertEqual(self.client.get(f'/payments/payslips/{other.id}').status_code, 200)
+        self.assertEqual(self.client.get(f'/payments/payslips/{other.id}?format=doc').status_code, 400)
+
+    def test_period_lock(self):
+        """Test a live job keeps the period to itself and its progress is read from the database"""
+        import time
+        from datetime import datetime, timedelta
+        from models import PayslipJob, db
+        from utils.payslips import PayslipJobLocked, claim_payslip_job, generate_payslips, start_payslip_job
+
+        claim_payslip_job(2, 2024, 'html')
+        with self.assertRaises(PayslipJobLocked):
+            generate_payslips(2, 2024, 'html', workers=1)
+        self.assertIsNone(start_payslip_job(2, 2024, 'html'))
+
+        # A job without a heartbeat for PAYROLL_RUN_STALE_SECONDS has crashed and is taken over
+        job = PayslipJob.query.filter_by(month=2, year=2024).one()
+        job.heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        self.assertIsNotNone(start_payslip_job(2, 2024, 'html', workers=1))
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db.session.expire_all()
+            if PayslipJob.query.filter_by(month=2, year=2024).one().status != 'running':
+                break
+            time.sleep(0.05)
+
+        self.client.post('/auth/login', data={'email': 'slip0@mutechcivil.com', 'password': 'slippass'})
+        status = self.client.get('/payments/payslips/status/2/2024').get_json()
+        self.assertEqual((status['status'], status['total'], status['rendered']), ('completed', 5, 5))
+        self.assertEqual(self.client.get('/payments/payslips/status/3/2024').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Sampling profiler tests for the Mutech Civil HRM app
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+class TestProfiler(AppTestCase):
+    """Test request profiling and collapsed-stack output"""
+
+    database = 'test_profiler.db'
+    config = {'PROFILER_INTERVAL': 0.001}
+
+    def configure_app(self, app):
+        @app.route('/profiled')
+        def profiled():
+            from flask import render_template_string
+            time.sleep(0.02)
+            return render_template_string('{% for n in range(3) %}{{ n }}{% endfor %}')
+
+    def setUp(self):
+        """Set up an app with the profiler enabled"""
+        self.output = tempfile.mkdtemp()
+        os.environ['PROFILER_ENABLED'] = 'true'
+        os.environ['PROFILER_OUTPUT'] = self.output
+        super().setUp()
+
+        from models import User, Role, Department, db
+        department_id = Department.query.filter_by(code='ACHR').first().id
+        self.admin = User(employee_id='ADMIN001', email='admin@mutechcivil.com',
+                          first_name='Admin', last_name='User', department_id=department_id)
+        self.admin.set_password('adminpass')
+        self.admin.roles.append(Role.query.filter_by(name='admin').first())
+        self.employee = User(employee_id='EMP001', email='employee@mutechcivil.com',
+                             first_name='Test', last_name='Employee', department_id=department_id)
+        self.employee.set_password('employeepass')
+        self.employee.roles.append(Role.query.filter_by(name='employee').first())
+        db.session.add_all([self.admin, self.employee])
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        super().tearDown()
+
+        del os.environ['PROFILER_ENABLED']
+        del os.environ['PROFILER_OUTPUT']
+        shutil.rmtree(self.output)
+
+    def login(self, user):
+        from flask import g
+        # Requests share the test's app context, where Flask-Login caches the user
+        g.pop('_login_user', None)
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+    def folded_lines(self, endpoint):
+        from utils.profiler import profile_path
+        path = profile_path(self.output, endpoint)
+        if not os.path.exists(path):
+            return []
+        with open(path) as folded:
+            return folded.read().splitlines()
+
+    def test_header_profiles_admin_requests(self):
+        """Test the profile header is honoured for administrators only"""
+        self.login(self.employee)
+        self.client.get('/profiled', headers={'X-Profile': '1'})
+        self.assertEqual(self.folded_lines('profiled'), [])
+
+        self.login(self.admin)
+        self.client.get('/profiled', headers={'X-Profile': '1'})
+        lines = self.folded_lines('profiled')
+        self.assertTrue(lines)
+
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            frames = stack.split(';')
+            self.assertEqual(frames[0], 'profiled')
+            self.assertIn(frames[1], ('[sql]', '[render]', '[app]'))
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any('time:sleep' in line or 'test_profiler:profiled' in line for line in lines))
+
+    def test_sampled_requests_aggregate(self):
+        """Test sampled requests accumulate into one file per endpoint"""
+        self.app.config['PROFILER_SAMPLE_RATE'] = 1.0
+        self.client.get('/profiled')
+        first = sum(int(line.rsplit(' ', 1)[1]) for line in self.folded_lines('profiled'))
+        self.client.get('/profiled')
+        second = sum(int(line.rsplit(' ', 1)[1]) for line in self.folded_lines('profiled'))
+
+        self.assertGreater(first, 0)
+        self.assertGreater(second, first)
+
+    def test_stack_categories(self):
+        """Test stacks are split into SQL, render and application time"""
+        from utils.profiler import stack_category
+        self.assertEqual(stack_category('app:run;sqlalchemy.engine.default:do_execute'), '[sql]')
+        self.assertEqual(stack_category('app:run;flask.templating:_render;jinja2.environment:render'), '[render]')
+        self.assertEqual(stack_category('app:run;routes.admin:dashboard'), '[app]')
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Query plan regression tests for the Mutech Civil HRM hot tables
+
+Every statement the admin, dashboard and payments routes send to the database
+is captured and run through EXPLAIN. A test fails when any of them reads one
+of the hot tables with a full table scan instead of an index.
+"""
+
+import os
+import re
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testing import AppTestCase
+
+HOT_TABLES = ('attendance', 'leave_request', 'payment', 'payroll')
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+
+class TestQueryPlans(AppTestCase):
+    """Test that hot queries stay on their indexes"""
+
+    database = 'test_query_plans.db'
+    # Statements are captured as in production, where a failing page is a 500
+    config = {'TESTING': False}
+
+    def setUp(self):
+        """Set up a seeded test database"""
+        super().setUp()
+        self.seed()
+
+        from app import db
+        from sqlalchemy import event
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.capture)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        from app import db
+        from sqlalchemy import event
+        event.remove(db.engine, 'before_cursor_execute', self.capture)
+        super().tearDown()
+
+    def seed(self):
+        """Create users with a few weeks of attendance, leave and payments"""
+        from models import User, Department, Role, Attendance, LeaveRequest, Payment, Payroll, db
+
+        dept = Department.query.filter_by(code='ACHR').first()
+        admin_role = Role.query.filter_by(name='admin').first()
+        accountant_role = Role.query.filter_by(name='accountant').first()
+
+        self.admin = User(employee_id='ADMIN001', email='admin@mutechcivil.com',
+                          first_name='Admin', last_name='User', department_id=dept.id,
+                          salary=Decimal('100000'))
+        self.admin.set_password('adminpass')
+        self.admin.roles.append(admin_role)
+
+        self.accountant = User(employee_id='ACHR0001', email='accounts@mutechcivil.com',
+                               first_name='Account', last_name='User', department_id=dept.id,
+                               salary=Decimal('60000'))
+        self.accountant.set_password('accountpass')
+        self.accountant.roles.append(accountant_role)
+
+        db.session.add_all([self.admin, self.accountant])
+        db.session.flush()
+
+        today = date.today()
+        for user in (self.admin, self.accountant):
+            for offset in range(40):
+                db.session.add(Attendance(user_id=user.id, date=today - timedelta(days=offset),
+                                          status='present' if offset % 3 else 'late'))
+            for offset in range(5):
+                db.session.add(LeaveRequest(user_id=user.id, leave_type='annual',
+                                            start_date=today + timedelta(days=offset),
+                                            end_date=today + timedelta(days=offset + 1),
+                                            days_requested=2,
+                                            status='pending' if offset % 2 else 'approved'))
+                db.session.add(Payment(user_id=user.id, payment_type='salary', amount=Decimal('1000'),
+                                       payment_method='mpesa', checkout_request_id=f'ws_CO_{user.id}_{offset}',
+                                       status='pending' if offset % 2 else 'completed',
+                                       created_at=datetime.utcnow() - timedelta(days=offset)))
+            db.session.add(Payroll(user_id=user.id, month=1, year=today.year - 1,
+                                   basic_salary=user.salary, gross_pay=user.salary,
+                                   total_deductions=0, net_pay=user.salary))
+
+        db.session.commit()
+
+    def capture(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def login(self, user):
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+
+    def full_scans(self, statement, parameters):
+        """Return the hot tables a statement reads with a full table scan"""
+        from app import db
+
+        with db.engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.exec_driver_sql('SET enable_seqscan = off')
+                plan = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).fetchall()
+                matches = (POSTGRES_FULL_SCAN.search(row[0]) for row in plan)
+            else:
+                plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                matches = (SQLITE_FULL_SCAN.match(row[-1]) for row in plan)
+
+            return [match.group(1) for match in matches if match and match.group(1) in HOT_TABLES]
+
+    def assert_indexed(self, user, method, url, **kwargs):
+        """Request a URL and check every captured statement against its plan"""
+        self.login(user)
+        self.statements = []
+        self.client.open(url, method=method, **kwargs)
+
+        self.assertTrue(self.statements, f'No statements captured for {url}')
+        for statement, parameters in self.statements:
+            scans = self.full_scans(statement, parameters)
+            self.assertFalse(scans, f'{url} scans {", ".join(scans)}:\n{statement}')
+
+    def test_admin_queries(self):
+        """Test admin routes use indexes"""
+        today = date.today().strftime('%Y-%m-%d')
+        self.assert_indexed(self.admin, 'GET', '/admin/dashboard')
+        self.assert_indexed(self.admin, 'GET', '/admin/users')
+        self.assert_indexed(self.admin, 'GET', f'/admin/users/{self.accountant.id}')
+        self.assert_indexed(self.admin, 'GET', f'/admin/attendance?date={today}')
+        self.assert_indexed(self.admin, 'GET', '/admin/leave_requests')
+        self.assert_indexed(self.admin, 'GET', '/admin/leave_requests?status=pending')
+
+    def test_dashboard_queries(self):
+        """Test employee dashboard routes use indexes"""
+        self.assert_indexed(self.accountant, 'GET', '/dashboard/')
+        self.assert_indexed(self.accountant, 'GET', '/dashboard/attendance')
+        self.assert_indexed(self.accountant, 'GET', '/dashboard/leave_requests')
+
+    def test_payments_queries(self):
+        """Test payment and payroll routes use indexes"""
+        year = date.today().year - 1
+        self.assert_indexed(self.admin, 'GET', '/payments/')
+        self.assert_indexed(self.accountant, 'GET', '/payments/')
+        self.assert_indexed(self.admin, 'GET', f'/payments/payroll?month=1&year={year}')
+        self.assert_indexed(self.accountant, 'GET', f'/payments/payroll?month=1&year={year}')
+        self.assert_indexed(self.admin, 'GET', f'/payments/payroll/generate/2/{year}')
+
+    def test_mpesa_callback_query(self):
+        """Test the MPESA callback finds payments by index"""
+        self.assert_indexed(self.admin, 'POST', '/payments/mpesa/callback', json={
+            'Body': {'stkCallback': {
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CheckoutRequestID': f'ws_CO_{self.admin.id}_1',
+                'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QAB1CDE2FG'}]}
+            }}
+        })
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
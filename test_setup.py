@@ -6,7 +6,7 @@ Test script to verify the Mutech Civil HRM system setup
 import os
 import sys
 import unittest
-from datetime import date
+from datetime import date, datetime
 
 # Add the project root to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -124,7 +124,721 @@ class TestSystemSetup(unittest.TestCase):
         # Test permissions
         self.assertTrue(admin_user.has_permission('users.create'))
         self.assertTrue(admin_user.has_permission('departments.read'))
-    
+
+    def test_permission_set_invalidation(self):
+        """Test compiled permissions follow role and permission changes"""
+        from models import User, Department, Role, Permission, db
+
+        employee_role = Role.query.filter_by(name='employee').first()
+        dept = Department.query.filter_by(code='PROC').first()
+
+        user = User(
+            employee_id='PERM001',
+            email='perm@mutechcivil.com',
+            first_name='Perm',
+            last_name='User',
+            department_id=dept.id
+        )
+        user.set_password('permpass')
+        user.roles.append(employee_role)
+
+        db.session.add(user)
+        db.session.commit()
+
+        self.assertTrue(user.has_permission('leave.create'))
+        self.assertFalse(user.has_permission('payments.read'))
+        self.assertFalse(user.has_role('accountant'))
+
+        # Role membership change
+        user.roles.append(Role.query.filter_by(name='accountant').first())
+        db.session.commit()
+        self.assertTrue(user.has_role('accountant'))
+        self.assertTrue(user.has_permission('payments.read'))
+
+        # Permission membership change on a role the user already has
+        leave_create = Permission.query.filter_by(name='leave.create').first()
+        employee_role.permissions.remove(leave_create)
+        db.session.commit()
+        self.assertFalse(user.has_permission('leave.create'))
+
+    def test_principal_loading(self):
+        """Test the principal loads without roles and permissions while the session's set is current"""
+        from flask import session
+        from models import User, Department, Role, db
+        from utils.permissions import SESSION_KEY
+        from utils.principal import load_principal
+        from utils.query_stats import capture_queries
+
+        user = User(employee_id='PRIN001', email='principal@mutechcivil.com', first_name='Prin',
+                    last_name='User', department_id=Department.query.filter_by(code='PROC').first().id)
+        user.set_password('prinpass')
+        user.roles.append(Role.query.filter_by(name='accountant').first())
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        with self.app.test_request_context():
+            session['_user_id'] = str(user_id)
+            self.assertTrue(user.has_permission('payments.read'))
+            self.assertIn(SESSION_KEY, session)
+            db.session.expunge_all()
+
+            with capture_queries() as stats:
+                principal = load_principal(user_id)
+                self.assertTrue(principal.has_permission('payments.read'))
+                self.assertTrue(principal.has_role('accountant'))
+            self.assertEqual(stats.count, 1)
+
+            # A stale version stamp recompiles the set with one more query
+            db.session.execute(db.update(User).where(User.id == user_id)
+                               .values(permissions_version=User.permissions_version + 1))
+            db.session.commit()
+            db.session.expunge_all()
+            with capture_queries() as stats:
+                principal = load_principal(user_id)
+                self.assertTrue(principal.has_permission('payments.read'))
+            self.assertEqual(stats.count, 2)
+
+    def test_attendance_summary_maintenance(self):
+        """Test the daily attendance summary follows attendance changes"""
+        from datetime import date, datetime
+        from models import User, Department, Attendance, DailyAttendanceSummary, db
+        from utils.attendance import record_clock_in, rebuild_attendance_summary, daily_attendance_stats
+
+        dept = Department.query.filter_by(code='PROC').first()
+        users = []
+        for index in range(3):
+            user = User(
+                employee_id=f'SUMM00{index}',
+                email=f'summary{index}@mutechcivil.com',
+                first_name='Summary',
+                last_name=f'User{index}',
+                department_id=dept.id
+            )
+            user.set_password('summarypass')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+
+        today = date.today()
+
+        # Clock-in path
+        record_clock_in(users[0].id, now=datetime.combine(today, datetime.min.time().replace(hour=7)))
+        record_clock_in(users[1].id, now=datetime.combine(today, datetime.min.time().replace(hour=9)))
+        db.session.commit()
+
+        # ORM insert, status change and delete paths
+        absent = Attendance(user_id=users[2].id, date=today, status='absent')
+        db.session.add(absent)
+        db.session.commit()
+        late = Attendance.query.filter_by(user_id=users[1].id, date=today).first()
+        late.status = 'present'
+        db.session.commit()
+
+        stats = daily_attendance_stats(today)
+        self.assertEqual((stats.total, stats.present, stats.late, stats.absent), (3, 2, 0, 1))
+
+        db.session.delete(absent)
+        db.session.commit()
+        stats = daily_attendance_stats(today)
+        self.assertEqual((stats.total, stats.present, stats.late, stats.absent), (2, 2, 0, 0))
+
+        # Rebuild repairs a drifted summary
+        summary = db.session.get(DailyAttendanceSummary, (today, dept.id))
+        summary.total = 99
+        db.session.commit()
+        rebuild_attendance_summary(today, today)
+        db.session.commit()
+        stats = daily_attendance_stats(today)
+        self.assertEqual((stats.total, stats.present, stats.late, stats.absent), (2, 2, 0, 0))
+
+    def test_monthly_attendance_trend(self):
+        """Test the attendance trend covers calendar months across year ends"""
+        from datetime import date
+        from models import User, Department, Attendance, db
+        from utils.attendance import monthly_attendance_trend
+
+        dept = Department.query.filter_by(code='PROC').first()
+        user = User(
+            employee_id='TREND001',
+            email='trend@mutechcivil.com',
+            first_name='Trend',
+            last_name='User',
+            department_id=dept.id
+        )
+        user.set_password('trendpass')
+        db.session.add(user)
+        db.session.flush()
+
+        for day in (date(2023, 11, 30), date(2023, 12, 1), date(2023, 12, 31), date(2024, 1, 31), date(2024, 3, 1)):
+            db.session.add(Attendance(user_id=user.id, date=day, status='present'))
+        db.session.add(Attendance(user_id=user.id, date=date(2024, 2, 29), status='late'))
+        db.session.commit()
+
+        trend = monthly_attendance_trend(5, today=date(2024, 3, 15))
+        self.assertEqual([month['month'] for month in trend],
+                         ['Nov 2023', 'Dec 2023', 'Jan 2024', 'Feb 2024', 'Mar 2024'])
+        self.assertEqual([month['count'] for month in trend], [1, 2, 1, 0, 1])
+
+        # Closed months come from the cache; the current month is recounted
+        db.session.add(Attendance(user_id=user.id, date=date(2024, 3, 2), status='present'))
+        db.session.commit()
+        trend = monthly_attendance_trend(5, today=date(2024, 3, 15))
+        self.assertEqual([month['count'] for month in trend], [1, 2, 1, 0, 2])
+
+        # A correction written by another worker shows once the cached months expire
+        import time
+        from unittest import mock
+        from models import DailyAttendanceSummary
+        db.session.query(DailyAttendanceSummary).filter_by(date=date(2024, 2, 29)).update({'present': 1})
+        db.session.commit()
+        trend = monthly_attendance_trend(5, today=date(2024, 3, 15))
+        self.assertEqual([month['count'] for month in trend], [1, 2, 1, 0, 2])
+        later = self.app.config['ATTENDANCE_TREND_TTL'] + 1
+        with mock.patch('utils.attendance.monotonic', side_effect=lambda: time.monotonic() + later):
+            trend = monthly_attendance_trend(5, today=date(2024, 3, 15))
+        self.assertEqual([month['count'] for month in trend], [1, 2, 1, 1, 2])
+        self.assertEqual(monthly_attendance_trend(0, today=date(2024, 3, 15)), [])
+
+    def test_worked_minutes(self):
+        """Test worked minutes are stored at clock-out, correction and backfill"""
+        from datetime import datetime, time
+        from models import User, Department, Attendance, db
+        from utils.attendance import record_clock_in, record_clock_out, backfill_worked_minutes, worked_hours
+
+        dept = Department.query.filter_by(code='PROC').first()
+        user = User(
+            employee_id='HOURS001',
+            email='hours@mutechcivil.com',
+            first_name='Hours',
+            last_name='User',
+            department_id=dept.id
+        )
+        user.set_password('hourspass')
+        db.session.add(user)
+        db.session.commit()
+
+        day = date(2024, 5, 6)
+        record_clock_in(user.id, now=datetime.combine(day, time(7, 55, 30)))
+        attendance = Attendance.query.filter_by(user_id=user.id, date=day).first()
+        attendance.break_start = time(12, 0)
+        attendance.break_end = time(12, 45)
+        db.session.commit()
+
+        # SQL computation at clock-out
+        record_clock_out(user.id, now=datetime.combine(day, time(17, 10)))
+        db.session.commit()
+        db.session.refresh(attendance)
+        self.assertEqual((attendance.worked_minutes, attendance.break_minutes), (509, 45))
+
+        # ORM correction
+        attendance.check_out = time(16, 55, 30)
+        db.session.commit()
+        self.assertEqual((attendance.worked_minutes, attendance.break_minutes), (495, 45))
+        self.assertEqual(attendance.hours_worked, 8.25)
+
+        # Backfill repairs stale values
+        db.session.execute(db.update(Attendance).values(worked_minutes=0, break_minutes=0))
+        backfill_worked_minutes()
+        db.session.commit()
+        db.session.refresh(attendance)
+        self.assertEqual((attendance.worked_minutes, attendance.break_minutes), (495, 45))
+        self.assertEqual(worked_hours(user.id, date(2024, 5, 1), date(2024, 5, 31)), 8.25)
+
+    def test_payroll_engine(self):
+        """Test vectorized overtime, late minutes and absences for a period"""
+        from datetime import time
+        from models import User, Department, Attendance, LeaveRequest, db
+        from utils.payroll_engine import load_leave, load_period, compute_period, working_days
+
+        dept = Department.query.filter_by(code='PROC').first()
+        users = []
+        for index in range(2):
+            user = User(
+                employee_id=f'OVER00{index}',
+                email=f'overtime{index}@mutechcivil.com',
+                first_name='Overtime',
+                last_name=f'User{index}',
+                department_id=dept.id
+            )
+            user.set_password('overtimepass')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+
+        # February 2024: 21 working days; the 3rd is a Saturday
+        db.session.add_all([
+            Attendance(user_id=users[0].id, date=date(2024, 2, 1), check_in=time(8, 0), check_out=time(18, 0), status='present'),
+            Attendance(user_id=users[0].id, date=date(2024, 2, 2), check_in=time(8, 20), check_out=time(16, 20), status='late'),
+            Attendance(user_id=users[0].id, date=date(2024, 2, 3), check_in=time(9, 0), check_out=time(12, 0), status='present'),
+            Attendance(user_id=users[0].id, date=date(2024, 2, 5), status='absent'),
+        ])
+        db.session.commit()
+
+        totals = compute_period([user.id for user in users], load_period(2, 2024), working_days(2, 2024))
+
+        self.assertEqual(totals[users[0].id], {
+            'worked_minutes': 600 + 480 + 180,
+            'overtime_minutes': 120 + 180,
+            'late_minutes': 20,
+            'days_present': 3,
+            'absences': 21 - 2
+        })
+        self.assertEqual(totals[users[1].id]['absences'], 21)
+        self.assertEqual(totals[users[1].id]['overtime_minutes'], 0)
+
+        # Approved leave is not absence; leave outside the month or not approved is ignored
+        db.session.add_all([
+            LeaveRequest(user_id=users[1].id, leave_type='annual', start_date=date(2024, 1, 29),
+                         end_date=date(2024, 2, 6), days_requested=7, status='approved'),   # 1, 2, 5, 6 Feb
+            LeaveRequest(user_id=users[1].id, leave_type='sick', start_date=date(2024, 2, 28),
+                         end_date=date(2024, 3, 1), days_requested=3, status='approved'),   # 28, 29 Feb
+            LeaveRequest(user_id=users[1].id, leave_type='annual', start_date=date(2024, 2, 12),
+                         end_date=date(2024, 2, 16), days_requested=5, status='pending'),
+            LeaveRequest(user_id=users[0].id, leave_type='annual', start_date=date(2024, 2, 1),
+                         end_date=date(2024, 2, 5), days_requested=3, status='approved')    # 5 Feb, the absence
+        ])
+        db.session.commit()
+        totals = compute_period([user.id for user in users], load_period(2, 2024), working_days(2, 2024),
+                                load_leave(2, 2024))
+        self.assertEqual(totals[users[1].id]['absences'], 21 - 6)
+        self.assertEqual(totals[users[0].id]['absences'], 21 - 3)
+
+        # The same overtime rule aggregated in the database
+        from utils.payroll_engine import overtime_statement
+        self.assertEqual(dict(db.session.execute(overtime_statement(2, 2024)).all()), {users[0].id: 300})
+
+    def test_bulk_payroll(self):
+        """Test set-based payroll matches the Decimal formulas and is generated once per period"""
+        from datetime import time
+        from decimal import Decimal
+        from models import User, Department, Attendance, Payroll, db
+        from utils.payroll_engine import generate_period_payroll, overtime_hours, overtime_rate
+        from utils.statutory import employee_deductions
+
+        dept = Department.query.filter_by(code='PROC').first()
+        salaries = [Decimal('45678.91'), Decimal('120000.00'), None, Decimal('30000.00')]
+        users = []
+        for index, salary in enumerate(salaries):
+            user = User(
+                employee_id=f'BULK00{index}',
+                email=f'bulk{index}@mutechcivil.com',
+                first_name='Bulk',
+                last_name=f'User{index}',
+                department_id=dept.id,
+                salary=salary,
+                hire_date=date(2020, 1, 6),
+                is_active=index != 3
+            )
+            user.set_password('bulkpass')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+
+        # 2 hours 13 minutes of overtime on a working day
+        db.session.add(Attendance(user_id=users[0].id, date=date(2024, 2, 1), check_in=time(8, 0),
+                                  check_out=time(18, 13), status='present'))
+        db.session.commit()
+
+        self.assertEqual(generate_period_payroll(2, 2024), 2)
+        db.session.commit()
+
+        payroll = Payroll.query.filter_by(user_id=users[0].id, month=2, year=2024).one()
+        hours = overtime_hours(133)
+        rate = overtime_rate(salaries[0])
+        overtime_pay = (hours * rate).quantize(Decimal('0.01'))
+        gross = salaries[0] + overtime_pay
+        statutory = employee_deductions(gross, date(2024, 2, 29))
+        deductions = statutory['paye'] + statutory['health'] + statutory['nssf']
+        self.assertEqual((payroll.overtime_hours, payroll.overtime_rate, payroll.overtime_pay),
+                         (hours, rate, overtime_pay))
+        self.assertEqual(payroll.gross_pay, gross)
+        self.assertEqual((payroll.tax_deduction, payroll.nhif_deduction, payroll.nssf_deduction),
+                         (statutory['paye'], statutory['health'], statutory['nssf']))
+        self.assertEqual(payroll.total_deductions, deductions)
+        self.assertEqual(payroll.net_pay, gross - deductions)
+        self.assertEqual(payroll.payment_status, 'pending')
+
+        # Unsalaried and inactive employees are skipped; a second run adds nothing
+        self.assertEqual({row.user_id for row in Payroll.query.all()}, {users[0].id, users[1].id})
+        self.assertEqual(generate_period_payroll(2, 2024), 0)
+        self.assertEqual(Payroll.query.count(), 2)
+
+    def test_statutory_deductions(self):
+        """Test vectorized PAYE, NHIF/SHIF and NSSF match the per-employee reference"""
+        import random
+        from decimal import Decimal
+        from utils.statutory import compute_deductions, employee_deductions
+
+        # Finance Act 2023 bands, NHIF, NSSF year 2
+        self.assertEqual(employee_deductions(Decimal('50000'), date(2024, 2, 29)), {
+            'nssf_tier_i': Decimal('420.00'), 'nssf_tier_ii': Decimal('1740.00'), 'nssf': Decimal('2160.00'),
+            'health': Decimal('1200.00'), 'taxable_pay': Decimal('47840.00'), 'income_tax': Decimal('9135.35'),
+            'insurance_relief': Decimal('180.00'), 'paye': Decimal('6555.35')
+        })
+        # SHIF deducted from taxable pay, no insurance relief
+        january = employee_deductions(Decimal('50000'), date(2025, 1, 31))
+        self.assertEqual((january['health'], january['taxable_pay'], january['paye']),
+                         (Decimal('1375.00'), Decimal('46465.00'), Decimal('6322.85')))
+        self.assertEqual(employee_deductions(Decimal('5000'), date(2025, 1, 31))['health'], Decimal('300.00'))
+        self.assertEqual(employee_deductions(Decimal('20000'), date(2022, 6, 30))['paye'], Decimal('0.00'))
+
+        rng = random.Random(7)
+        boundaries = [0, 4000, 5999.99, 6000, 7000, 24000, 32333, 36000, 72000, 100000, 500000, 800000]
+        gross_cents = [int(amount * 100) for amount in boundaries] + [rng.randrange(0, 150000000) for _ in range(2000)]
+        for on in [date(2022, 6, 30), date(2023, 3, 31), date(2023, 7, 31), date(2024, 10, 31),
+                   date(2024, 12, 31), date(2025, 3, 31)]:
+            vectorized = compute_deductions(gross_cents, on)
+            for position, gross in enumerate(gross_cents):
+                reference = employee_deductions(Decimal(gross) / 100, on)
+                self.assertEqual({name: Decimal(int(values[position])) / 100 for name, values in vectorized.items()},
+                                 reference, f'{gross} cents on {on}')
+
+        with self.assertRaises(ValueError):
+            compute_deductions([100000], date(2020, 12, 31))
+
+    def test_attendance_import(self):
+        """Test punch logs collapse into daily attendance rows"""
+        from datetime import time
+        from models import User, Department, Attendance, db
+        from utils.attendance import daily_attendance_stats
+        from utils.attendance_import import import_punches
+
+        dept = Department.query.filter_by(code='PROC').first()
+        user = User(
+            employee_id='BADGE001',
+            email='badge@mutechcivil.com',
+            first_name='Badge',
+            last_name='User',
+            department_id=dept.id
+        )
+        user.set_password('badgepass')
+        db.session.add(user)
+        db.session.commit()
+
+        punch_log = [
+            'badge,timestamp,terminal',
+            'BADGE001,2024-03-04 08:15:00,T1',
+            'BADGE001,2024-03-04 12:30:00,T1',
+            'BADGE001,2024-03-04 13:00:00,T1',
+            'BADGE001,2024-03-04 17:15:00,T1',
+            'BADGE001,2024-03-05T07:50,T2',
+            'UNKNOWN9,2024-03-05 08:00:00,T2',
+            'BADGE001,yesterday,T2',
+            'BADGE001',
+        ]
+        report = import_punches(punch_log, batch_size=1)
+
+        self.assertEqual(report.punches, 5)
+        self.assertEqual(Attendance.query.filter_by(user_id=user.id).count(), 2)
+        self.assertEqual(dict(report.rejected), {'unknown badge': 1, 'invalid timestamp': 1, 'missing columns': 1})
+
+        monday = Attendance.query.filter_by(user_id=user.id, date=date(2024, 3, 4)).first()
+        self.assertEqual((monday.check_in, monday.break_start, monday.break_end, monday.check_out),
+                         (time(8, 15), time(12, 30), time(13, 0), time(17, 15)))
+        self.assertEqual((monday.status, monday.worked_minutes, monday.break_minutes), ('late', 510, 30))
+
+        # A later file with the evening punch merges into the stored day
+        report = import_punches(['BADGE001,2024-03-05 16:50:00', 'BADGE001,2024-03-05T07:50'])
+        tuesday = Attendance.query.filter_by(user_id=user.id, date=date(2024, 3, 5)).first()
+        db.session.refresh(tuesday)
+        self.assertEqual((tuesday.check_in, tuesday.check_out, tuesday.status), (time(7, 50), time(16, 50), 'present'))
+        self.assertEqual(Attendance.query.filter_by(user_id=user.id).count(), 2)
+
+        stats = daily_attendance_stats(date(2024, 3, 4))
+        self.assertEqual((stats.total, stats.late), (1, 1))
+
+        # Punches between the break and the check-out are reported, not silently lost
+        report = import_punches([f'BADGE001,2024-03-06 {stamp}' for stamp in
+                                 ('08:00', '10:00', '10:15', '12:30', '13:00', '17:00')])
+        wednesday = Attendance.query.filter_by(user_id=user.id, date=date(2024, 3, 6)).first()
+        self.assertEqual((wednesday.check_in, wednesday.break_start, wednesday.break_end, wednesday.check_out),
+                         (time(8, 0), time(10, 0), time(10, 15), time(17, 0)))
+        self.assertEqual((report.dropped, report.dropped_days), (2, 1))
+        self.assertEqual(report.dropped_samples, [('BADGE001', date(2024, 3, 6), [time(12, 30), time(13, 0)])])
+        self.assertIn('2 dropped on 1 days', report.summary())
+
+        # Offsets are converted to the server's local time, as clock-ins record it
+        import_punches(['BADGE001,2024-03-07T06:00:00+00:00'])
+        thursday = Attendance.query.filter_by(user_id=user.id, date=date(2024, 3, 7)).first()
+        self.assertEqual(thursday.check_in,
+                         datetime.fromisoformat('2024-03-07T06:00:00+00:00').astimezone().time().replace(tzinfo=None))
+
+    def test_attendance_import_upload(self):
+        """Test uploaded punch logs are imported on a background thread"""
+        import io
+        import time
+        from models import User, Department, Role, Attendance, db
+        from models import AttendanceImport
+        from utils.attendance_import import claim_import, import_job
+
+        dept = Department.query.filter_by(code='ACHR').first()
+        admin = User(employee_id='UPLOAD01', email='upload@mutechcivil.com', first_name='Upload',
+                     last_name='Admin', department_id=dept.id)
+        admin.set_password('uploadpass')
+        admin.roles.append(Role.query.filter_by(name='admin').first())
+        db.session.add(admin)
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        punch_log = b'UPLOAD01;2024-03-04 07:45\nUPLOAD01;2024-03-04 16:30\nNOBODY;2024-03-04 08:00\n'
+        response = self.client.post('/admin/attendance/import', content_type='multipart/form-data', data={
+            'file': (io.BytesIO(punch_log), 'punches.csv'), 'delimiter': ';'})
+        self.assertEqual(response.status_code, 302)
+        job_id = int(response.headers['Location'].split('job=')[1])
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db.session.expire_all()
+            report = import_job(job_id)
+            if report.status != 'running':
+                break
+            time.sleep(0.05)
+        self.assertEqual(report.status, 'completed')
+        self.assertEqual(report.rejected_samples, [(3, 'unknown badge', 'NOBODY;2024-03-04 08:00')])
+        self.assertEqual((report.punches, report.rows_written, report.rejected_total), (2, 1, 1))
+
+        status = self.client.get(f'/admin/attendance/import/status/{job_id}').get_json()
+        self.assertEqual((status['status'], status['rows_written']), ('completed', 1))
+        self.assertEqual(self.client.get(f'/admin/attendance/import/status/{job_id + 1}').status_code, 404)
+        self.assertIn(b'1 attendance rows written', self.client.get(f'/admin/attendance/import?job={job_id}').data)
+
+        db.session.expire_all()
+        record = Attendance.query.filter_by(user_id=admin.id).one()
+        self.assertEqual(record.worked_minutes, 525)
+
+        # One import runs at a time, across workers; a stalled one is taken over
+        running = claim_import()
+        self.assertIsNone(claim_import())
+        db.session.get(AttendanceImport, running).heartbeat_at = datetime(2000, 1, 1)
+        db.session.commit()
+        self.assertIsNotNone(claim_import())
+        self.assertEqual(db.session.get(AttendanceImport, running).status, 'failed')
+
+    def test_streaming_exports(self):
+        """Test attendance, payment and payroll exports honour the list filters"""
+        from datetime import timedelta
+        from decimal import Decimal
+        from models import User, Department, Role, Attendance, Payment, Payroll, db
+
+        dept = Department.query.filter_by(code='ACHR').first()
+        admin = User(
+            employee_id='EXPORT01',
+            email='export@mutechcivil.com',
+            first_name='Export',
+            last_name='Admin',
+            department_id=dept.id
+        )
+        admin.set_password('exportpass')
+        admin.roles.append(Role.query.filter_by(name='admin').first())
+        db.session.add(admin)
+        db.session.flush()
+
+        start = date(2023, 1, 1)
+        for offset in range(365):
+            db.session.add(Attendance(user_id=admin.id, date=start + timedelta(days=offset),
+                                      status='late' if offset % 5 == 0 else 'present'))
+        db.session.add_all([
+            Payment(user_id=admin.id, payment_type='salary', amount=Decimal('1000'),
+                    payment_method='mpesa', status='completed'),
+            Payment(user_id=admin.id, payment_type='bonus', amount=Decimal('250'),
+                    payment_method='mpesa', status='pending'),
+            Payroll(user_id=admin.id, month=6, year=2023, basic_salary=Decimal('50000'),
+                    gross_pay=Decimal('50000'), total_deductions=Decimal('5000'), net_pay=Decimal('45000'))
+        ])
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        response = self.client.get('/admin/attendance/export?date=&start=2023-01-01&end=2023-12-31')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 366)
+        self.assertTrue(lines[1].startswith('2023-01-01,EXPORT01,Export Admin,Accounts'))
+
+        # A range without date= is not narrowed to today
+        response = self.client.get('/admin/attendance/export?start=2023-03-01&end=2023-03-31')
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 32)
+
+        response = self.client.get('/admin/attendance/export?date=2023-03-01&format=xlsx')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data()[:2], b'PK')
+
+        response = self.client.get('/payments/export?status=pending')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('bonus', lines[1])
+
+        response = self.client.get('/payments/payroll/export?month=6&year=2023')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('45000', lines[1])
+
+        self.assertEqual(self.client.get('/payments/export?format=pdf').status_code, 400)
+
+    def test_keyset_pagination(self):
+        """Test cursor pages walk the sort order forwards and back without gaps"""
+        from datetime import datetime, timedelta
+        from decimal import Decimal
+        from models import User, Department, Payment, db
+        from utils.pagination import SortKey, keyset_paginate
+
+        dept = Department.query.filter_by(code='ACHR').first()
+        user = User(
+            employee_id='PAGE001',
+            email='page@mutechcivil.com',
+            first_name='Page',
+            last_name='User',
+            department_id=dept.id
+        )
+        user.set_password('pagepass')
+        db.session.add(user)
+        db.session.flush()
+
+        # Pairs of payments share a timestamp, so the id tiebreak matters
+        stamp = datetime(2024, 1, 1)
+        for index in range(45):
+            db.session.add(Payment(user_id=user.id, payment_type='salary', amount=Decimal(index),
+                                   payment_method='cash', created_at=stamp + timedelta(hours=index // 2)))
+        db.session.commit()
+
+        # Count every time; cached totals from other tests share the SQL
+        self.app.config['PAGINATION_COUNT_TTL'] = 0
+        keys = [SortKey(Payment.created_at, descending=True), SortKey(Payment.id, descending=True)]
+        expected = [payment.id for payment in Payment.query.order_by(Payment.created_at.desc(), Payment.id.desc())]
+
+        with self.app.test_request_context():
+            pages = [keyset_paginate(Payment.query, keys, per_page=10)]
+            while pages[-1].has_next:
+                pages.append(keyset_paginate(Payment.query, keys, per_page=10, cursor=pages[-1].next_cursor))
+
+            self.assertEqual([payment.id for page in pages for payment in page.items], expected)
+            self.assertEqual([len(page.items) for page in pages], [10, 10, 10, 10, 5])
+            self.assertFalse(pages[0].has_prev)
+            self.assertEqual(pages[0].total, 45)
+
+            # Back from the last page
+            previous = keyset_paginate(Payment.query, keys, per_page=10, cursor=pages[-1].prev_cursor)
+            self.assertEqual([payment.id for payment in previous.items], expected[30:40])
+            self.assertTrue(previous.has_next and previous.has_prev)
+
+            # A tampered cursor starts again from the first page
+            restarted = keyset_paginate(Payment.query, keys, per_page=10, cursor=pages[1].next_cursor + 'x')
+            self.assertEqual([payment.id for payment in restarted.items], expected[:10])
+
+    def test_payment_counters(self):
+        """Test payment counters follow status transitions and reconcile after bulk writes"""
+        from decimal import Decimal
+        from models import User, Department, Role, Payment, db
+        from flask import g
+        from utils.payment_counters import payment_counts, reconcile_payment_counters
+        from utils.query_stats import capture_queries
+
+        dept = Department.query.filter_by(code='ACHR').first()
+        admin = User(
+            employee_id='COUNT001',
+            email='count@mutechcivil.com',
+            first_name='Count',
+            last_name='Admin',
+            department_id=dept.id
+        )
+        admin.set_password('countpass')
+        admin.roles.append(Role.query.filter_by(name='admin').first())
+        db.session.add(admin)
+        db.session.flush()
+
+        payments = [
+            Payment(user_id=admin.id, payment_type='salary', amount=Decimal('1000'), payment_method='mpesa',
+                    checkout_request_id='ws_CO_COUNT1'),
+            Payment(user_id=admin.id, payment_type='salary', amount=Decimal('2000'), payment_method='mpesa',
+                    checkout_request_id='ws_CO_COUNT2'),
+            Payment(user_id=admin.id, payment_type='bonus', amount=Decimal('500'), payment_method='bank'),
+            Payment(user_id=admin.id, payment_type='bonus', amount=Decimal('250'), payment_method='cash')
+        ]
+        db.session.add_all(payments)
+        db.session.commit()
+
+        counts = payment_counts()
+        self.assertEqual((counts['pending'], counts['completed'], counts['failed']), (4, 0, 0))
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+            session['_fresh'] = True
+
+        self.client.get(f'/payments/{payments[2].id}/approve')
+        self.client.get(f'/payments/{payments[3].id}/reject')
+        self.client.post('/payments/mpesa/callback', json={'Body': {'stkCallback': {
+            'ResultCode': 0, 'CheckoutRequestID': 'ws_CO_COUNT1',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QCOUNT1'}]}
+        }}})
+        self.client.post('/payments/mpesa/callback', json={'Body': {'stkCallback': {
+            'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user', 'CheckoutRequestID': 'ws_CO_COUNT2'
+        }}})
+
+        counts = payment_counts()
+        self.assertEqual((counts['pending'], counts['completed'], counts['failed']), (0, 2, 2))
+        breakdown = {(row.status, row.payment_type, row.payment_method): (row.count, row.amount)
+                     for row in counts.breakdown}
+        self.assertEqual(breakdown, {
+            ('completed', 'salary', 'mpesa'): (1, Decimal('1000')),
+            ('completed', 'bonus', 'bank'): (1, Decimal('500')),
+            ('failed', 'bonus', 'cash'): (1, Decimal('250')),
+            ('failed', 'salary', 'mpesa'): (1, Decimal('2000'))
+        })
+        self.assertEqual(reconcile_payment_counters(), 0)
+
+        # Writes that bypass the ORM are caught by reconciliation, which the dashboard never runs
+        db.session.execute(db.insert(Payment), [{'user_id': admin.id, 'payment_type': 'salary', 'amount': 300,
+                                                 'payment_method': 'mpesa', 'status': 'pending'}])
+        db.session.commit()
+        self.assertEqual(payment_counts()['pending'], 0)
+
+        # The dashboard reads the counters in one statement, however many payments there are
+        with capture_queries() as stats:
+            response = self.client.get('/payments/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([sql for sql in stats.statements if 'payment_counter' in sql]), 1)
+        self.assertFalse([sql for sql in stats.statements if 'FROM payment' in sql and 'GROUP BY' in sql])
+
+        self.assertEqual(reconcile_payment_counters(), 1)
+        db.session.commit()
+        self.assertEqual(payment_counts()['pending'], 1)
+        self.assertIn(b'Payments by Type and Method', response.data)
+
+        # Company-wide amounts stay hidden from roles that only see their own payments
+        accountant = User(employee_id='COUNT002', email='count2@mutechcivil.com', first_name='Count',
+                          last_name='Accountant', department_id=dept.id)
+        accountant.set_password('countpass')
+        accountant.roles.append(Role.query.filter_by(name='accountant').first())
+        db.session.add(accountant)
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(accountant.id)
+        # Requests share the test's app context, where Flask-Login keeps the last user
+        g.pop('_login_user', None)
+        response = self.client.get('/payments/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Payments by Type and Method', response.data)
+
+    def test_unsupported_database(self):
+        """Test the app refuses databases without INSERT ... ON CONFLICT"""
+        from app import create_app
+
+        url = os.environ['DATABASE_URL']
+        os.environ['DATABASE_URL'] = 'mysql://hrm@localhost/hrm'
+        try:
+            with self.assertRaises(RuntimeError):
+                create_app()
+        finally:
+            os.environ['DATABASE_URL'] = url
+
     def test_routes_accessibility(self):
         """Test that main routes are accessible"""
         # Test main page
@@ -192,6 +906,66 @@ class TestSystemSetup(unittest.TestCase):
         except ImportError:
             self.skipTest("MPESA client dependencies not available")
 
+    def test_mpesa_token_cache(self):
+        """Test MPESA tokens are fetched once per expiry and shared by threads and workers"""
+        import shutil
+        import tempfile
+        import threading
+        import time
+        from unittest import mock
+        import requests
+        from utils import mpesa
+
+        cache_dir = tempfile.mkdtemp()
+        self.app.config['MPESA_CONSUMER_KEY'] = 'cache_key'
+        self.app.config['MPESA_TOKEN_CACHE'] = os.path.join(cache_dir, 'mpesa_token.json')
+        mpesa._tokens.clear()
+        issued = []
+
+        def oauth(url, headers=None, timeout=None):
+            time.sleep(0.05)  # Long enough for the burst to pile up
+            issued.append(f'token-{len(issued)}')
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {'access_token': issued[-1], 'expires_in': '3599'}
+            return response
+
+        try:
+            with mock.patch.object(mpesa.requests, 'get', side_effect=oauth):
+                tokens = []
+                clients = [mpesa.MPESAClient() for _ in range(8)]
+                burst = [threading.Thread(target=lambda client=client: tokens.append(client.get_access_token()))
+                         for client in clients]
+                for thread in burst:
+                    thread.start()
+                for thread in burst:
+                    thread.join()
+                self.assertEqual((tokens, issued), (['token-0'] * 8, ['token-0']))
+
+                # Another worker reads the shared file instead of calling the endpoint
+                mpesa._tokens.clear()
+                self.assertEqual(mpesa.MPESAClient().get_access_token(), 'token-0')
+                self.assertEqual(len(issued), 1)
+
+                # Within the margin of expiry the token is refreshed, once
+                client = mpesa.MPESAClient()
+                with mock.patch.object(mpesa.time, 'time', return_value=time.time() + 3599 - 30):
+                    self.assertEqual(client.get_access_token(), 'token-1')
+                    self.assertEqual(client.get_access_token(), 'token-1')
+
+                # A rejected token is dropped
+                rejected = requests.exceptions.HTTPError(response=mock.Mock(status_code=401))
+                client.forget_access_token('token-1', rejected)
+                self.assertEqual(client.get_access_token(), 'token-2')
+                self.assertEqual(mpesa.read_token_cache(client.token_cache)[client.token_key()]['access_token'],
+                                 'token-2')
+
+                # Other credentials get their own token
+                self.app.config['MPESA_CONSUMER_KEY'] = 'other_key'
+                self.assertEqual(mpesa.MPESAClient().get_access_token(), 'token-3')
+        finally:
+            mpesa._tokens.clear()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
 def run_tests():
     """Run all tests"""
     print("Running Mutech Civil HRM System Tests...")
@@ -0,0 +1,58 @@
+"""
+Shared unittest base for the Mutech Civil HRM tests
+
+Tests drop every table when they finish, so they never read DATABASE_URL:
+each test case gets its own SQLite file, or the throwaway database named by
+TEST_DATABASE_URL (e.g. to check query plans on PostgreSQL).
+"""
+
+import os
+import sys
+import unittest
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+class AppTestCase(unittest.TestCase):
+    """Test case with an app context, a test client and freshly created tables"""
+
+    # SQLite file the test case runs against
+    database = 'test.db'
+    # Config applied on top of the testing defaults
+    config = {}
+    # Whether to create the system departments, roles and permissions
+    initialize_system = True
+
+    def setUp(self):
+        """Set up a test app on an empty database"""
+        os.environ['FLASK_ENV'] = 'testing'
+        os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f'sqlite:///{self.database}'
+
+        from app import create_app, db
+        self.app = create_app()
+        self.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, SESSION_COOKIE_SECURE=False,
+                               PAYROLL_RUN_BACKGROUND=False)
+        self.app.config.update(self.config)
+        self.configure_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+
+        db.create_all()
+
+        if self.initialize_system:
+            from utils.permissions import initialize_system
+            initialize_system()
+
+    def configure_app(self, app):
+        """Hook to adjust the app before its context is pushed"""
+
+    def tearDown(self):
+        """Clean up after tests"""
+        from app import db
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+        if os.path.exists(self.database):
+            os.remove(self.database)
@@ -0,0 +1,364 @@
+"""
+Attendance recording utilities
+
+Clock-in and clock-out are written with single statements keyed on the
+(user_id, date) unique index, so the shift-start burst never races between
+reading a user's row for the day and writing it.
+
+Every change to an attendance row is also folded into
+daily_attendance_summary, so the admin views read pre-aggregated counts
+per day and department instead of aggregating raw punches.
+"""
+
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, time
+from time import monotonic
+from sqlalchemy import Integer, and_, case, extract, func, inspect, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from flask import current_app
+from models import Attendance, DailyAttendanceSummary, User, db
+
+# Shift start; check-ins after this are marked late
+SHIFT_START = time(8, 0)
+
+# Punch outcomes
+CLOCKED_IN = 'clocked_in'
+ALREADY_CLOCKED_IN = 'already_clocked_in'
+CLOCKED_OUT = 'clocked_out'
+ALREADY_CLOCKED_OUT = 'already_clocked_out'
+NOT_CLOCKED_IN = 'not_clocked_in'
+
+# Statuses counted in daily_attendance_summary
+SUMMARY_STATUSES = ('present', 'late', 'absent', 'half_day')
+
+attendance_table = Attendance.__table__
+summary_table = DailyAttendanceSummary.__table__
+
+# Present counts of closed months, {(year, month): (expires, count)}; only the
+# current month changes through normal clock-ins, and corrections made by
+# other workers show up once an entry expires (ATTENDANCE_TREND_TTL)
+_closed_month_counts = {}
+
+# INSERT constructs supporting ON CONFLICT, by dialect; create_app refuses
+# databases without one
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
+def upsert(table):
+    """Dialect-specific INSERT supporting ON CONFLICT"""
+    return UPSERT_INSERTS[db.session.get_bind().dialect.name](table)
+
+class seconds_of_day(FunctionElement):
+    """Whole seconds since midnight of a TIME value"""
+    type = Integer()
+    name = 'seconds_of_day'
+    inherit_cache = True
+
+@compiles(seconds_of_day)
+def _seconds_of_day_default(element, compiler, **kw):
+    return 'CAST(FLOOR(EXTRACT(EPOCH FROM %s)) AS INTEGER)' % compiler.process(element.clauses, **kw)
+
+@compiles(seconds_of_day, 'sqlite')
+def _seconds_of_day_sqlite(element, compiler, **kw):
+    value = compiler.process(element.clauses, **kw)
+    return ("(CAST(strftime('%%H', %s) AS INTEGER) * 3600 + CAST(strftime('%%M', %s) AS INTEGER) * 60"
+            " + CAST(strftime('%%S', %s) AS INTEGER))" % (value, value, value))
+
+def minutes_expressions(check_out):
+    """SQL for (worked_minutes, break_minutes), matching models.attendance_minutes"""
+    columns = attendance_table.c
+    break_span = seconds_of_day(columns.break_end) - seconds_of_day(columns.break_start)
+    break_seconds = case(
+        (and_(columns.break_start.isnot(None), columns.break_end.isnot(None), break_span > 0), break_span),
+        else_=0
+    )
+    worked_span = seconds_of_day(check_out) - seconds_of_day(columns.check_in) - break_seconds
+    worked_seconds = case(
+        (and_(columns.check_in.isnot(None), check_out.isnot(None), worked_span > 0), worked_span),
+        else_=0
+    )
+    return worked_seconds // 60, break_seconds // 60
+
+def record_clock_in(user_id, key=None, now=None, department_id=None):
+    """Clock a user in for today in one statement"""
+    now = now or datetime.now()
+    status = 'late' if now.time() > SHIFT_START else 'present'
+    created_at = datetime.utcnow()
+
+    # Insert today's row, or fill in check_in on a row that exists without
+    # one (e.g. created by an administrator)
+    stmt = upsert(attendance_table).values(
+        user_id=user_id,
+        date=now.date(),
+        check_in=now.time(),
+        check_in_key=key,
+        status=status,
+        created_at=created_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[attendance_table.c.user_id, attendance_table.c.date],
+        set_={
+            'check_in': stmt.excluded.check_in,
+            'check_in_key': stmt.excluded.check_in_key,
+            'status': stmt.excluded.status
+        },
+        where=attendance_table.c.check_in.is_(None)
+    ).returning(attendance_table.c.created_at)
+
+    row = db.session.execute(stmt).first()
+    if row:
+        if department_id is None:
+            department_id = db.session.execute(
+                select(User.department_id).where(User.id == user_id)
+            ).scalar()
+
+        if row.created_at == created_at:
+            # A fresh row: count it without touching the rest of the day
+            deltas = defaultdict(_empty_counts)
+            _count(deltas, (now.date(), department_id, status), 1)
+            _apply_summary_deltas(db.session.connection(), deltas)
+        else:
+            # An existing row changed status; recount its cell
+            rebuild_attendance_summary(now.date(), now.date(), department_id)
+        return CLOCKED_IN
+
+    # Already clocked in; a retry of the punch that succeeded is still a success
+    if key:
+        existing_key = db.session.execute(
+            select(attendance_table.c.check_in_key).where(
+                attendance_table.c.user_id == user_id,
+                attendance_table.c.date == now.date()
+            )
+        ).scalar()
+        if existing_key == key:
+            return CLOCKED_IN
+
+    return ALREADY_CLOCKED_IN
+
+def record_clock_out(user_id, key=None, now=None):
+    """Clock a user out for today in one statement"""
+    now = now or datetime.now()
+    worked_minutes, break_minutes = minutes_expressions(literal(now.time(), attendance_table.c.check_out.type))
+
+    result = db.session.execute(
+        update(attendance_table).where(
+            attendance_table.c.user_id == user_id,
+            attendance_table.c.date == now.date(),
+            attendance_table.c.check_in.isnot(None),
+            attendance_table.c.check_out.is_(None)
+        ).values(
+            check_out=now.time(),
+            check_out_key=key,
+            worked_minutes=worked_minutes,
+            break_minutes=break_minutes
+        )
+    )
+
+    if result.rowcount:
+        return CLOCKED_OUT
+
+    # Nothing updated: find out why
+    row = db.session.execute(
+        select(attendance_table.c.check_in, attendance_table.c.check_out_key).where(
+            attendance_table.c.user_id == user_id,
+            attendance_table.c.date == now.date()
+        )
+    ).first()
+
+    if row is None or row.check_in is None:
+        return NOT_CLOCKED_IN
+    if key and row.check_out_key == key:
+        return CLOCKED_OUT
+
+    return ALREADY_CLOCKED_OUT
+
+def backfill_worked_minutes(start=None, end=None):
+    """Recompute stored worked and break minutes in SQL for a date range"""
+    worked_minutes, break_minutes = minutes_expressions(attendance_table.c.check_out)
+    conditions = []
+    if start:
+        conditions.append(attendance_table.c.date >= start)
+    if end:
+        conditions.append(attendance_table.c.date <= end)
+
+    result = db.session.execute(
+        update(attendance_table).where(*conditions).values(
+            worked_minutes=worked_minutes,
+            break_minutes=break_minutes
+        )
+    )
+    return result.rowcount
+
+def worked_hours(user_id, start, end):
+    """Total hours a user worked between two dates, summed in SQL"""
+    minutes = db.session.execute(
+        select(func.coalesce(func.sum(attendance_table.c.worked_minutes), 0)).where(
+            attendance_table.c.user_id == user_id,
+            attendance_table.c.date >= start,
+            attendance_table.c.date <= end
+        )
+    ).scalar()
+    return minutes / 60
+
+# Daily attendance summary
+
+def _empty_counts():
+    return dict.fromkeys(('total',) + SUMMARY_STATUSES, 0)
+
+def _count(deltas, cell, sign):
+    """Add (or remove) one attendance row to a (date, department_id, status) cell"""
+    day, department_id, status = cell
+    counts = deltas[(day, department_id)]
+    counts['total'] += sign
+    if status in counts:
+        counts[status] += sign
+
+def _apply_summary_deltas(connection, deltas):
+    """Add counter deltas to summary rows, creating rows as needed"""
+    for (day, department_id), counts in deltas.items():
+        counts = {name: delta for name, delta in counts.items() if delta}
+        if not counts:
+            continue
+
+        _closed_month_counts.pop((day.year, day.month), None)
+
+        stmt = upsert(summary_table).values(date=day, department_id=department_id, **counts)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[summary_table.c.date, summary_table.c.department_id],
+            set_={name: summary_table.c[name] + stmt.excluded[name] for name in counts}
+        )
+        connection.execute(stmt)
+
+def _previous_value(state, key):
+    """Value of an attribute as last loaded from the database"""
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+def apply_summary_changes(session):
+    """Fold attendance rows inserted, updated or deleted in a flush into the summary"""
+    changes = []
+
+    for obj in session.new:
+        if isinstance(obj, Attendance):
+            changes.append((None, (obj.date, obj.user_id, obj.status)))
+
+    for obj in session.dirty:
+        if isinstance(obj, Attendance) and session.is_modified(obj):
+            state = inspect(obj)
+            old = tuple(_previous_value(state, key) for key in ('date', 'user_id', 'status'))
+            new = (obj.date, obj.user_id, obj.status)
+            if old != new:
+                changes.append((old, new))
+
+    for obj in session.deleted:
+        if isinstance(obj, Attendance):
+            state = inspect(obj)
+            changes.append((tuple(_previous_value(state, key) for key in ('date', 'user_id', 'status')), None))
+
+    if not changes:
+        return
+
+    connection = session.connection()
+    user_ids = {row[1] for change in changes for row in change if row}
+    departments = dict(connection.execute(
+        select(User.id, User.department_id).where(User.id.in_(user_ids))
+    ).all())
+
+    deltas = defaultdict(_empty_counts)
+    for old, new in changes:
+        if old:
+            _count(deltas, (old[0], departments.get(old[1]), old[2]), -1)
+        if new:
+            _count(deltas, (new[0], departments.get(new[1]), new[2]), 1)
+
+    _apply_summary_deltas(connection, deltas)
+
+def rebuild_attendance_summary(start=None, end=None, department_id=None):
+    """Recompute summary rows from raw attendance, optionally for a date range and department"""
+    conditions = []
+    filters = []
+    if start:
+        conditions.append(summary_table.c.date >= start)
+        filters.append(Attendance.date >= start)
+    if end:
+        conditions.append(summary_table.c.date <= end)
+        filters.append(Attendance.date <= end)
+    if department_id is not None:
+        conditions.append(summary_table.c.department_id == department_id)
+        filters.append(User.department_id == department_id)
+
+    aggregate = select(
+        Attendance.date,
+        User.department_id,
+        func.count(Attendance.id),
+        *[func.sum(case((Attendance.status == status, 1), else_=0)) for status in SUMMARY_STATUSES]
+    ).join(User, User.id == Attendance.user_id).where(*filters).group_by(Attendance.date, User.department_id)
+
+    _closed_month_counts.clear()
+    db.session.execute(summary_table.delete().where(*conditions))
+    result = db.session.execute(
+        insert(summary_table).from_select(['date', 'department_id', 'total', *SUMMARY_STATUSES], aggregate)
+    )
+    return result.rowcount
+
+def daily_attendance_stats(day):
+    """Total/present/late/absent counts for a day, read from the summary"""
+    return db.session.query(
+        func.coalesce(func.sum(DailyAttendanceSummary.total), 0).label('total'),
+        func.coalesce(func.sum(DailyAttendanceSummary.present), 0).label('present'),
+        func.coalesce(func.sum(DailyAttendanceSummary.late), 0).label('late'),
+        func.coalesce(func.sum(DailyAttendanceSummary.absent), 0).label('absent')
+    ).filter(DailyAttendanceSummary.date == day).first()
+
+def _recent_months(count, today=None):
+    """The last count calendar months as (year, month), oldest first"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1
+    return [divmod(index - offset, 12) for offset in range(count - 1, -1, -1)]
+
+def monthly_attendance_trend(months=12, today=None):
+    """Present counts for the last N calendar months from one grouped query"""
+    if months < 1:
+        return []
+
+    today = today or date.today()
+    periods = [(year, month + 1) for year, month in _recent_months(months, today)]
+    current = (today.year, today.month)
+    ttl = current_app.config.get('ATTENDANCE_TREND_TTL', 300)
+    now = monotonic()
+
+    cached = {period: entry[1] for period, entry in _closed_month_counts.items() if entry[0] > now}
+    missing = [period for period in periods if period == current or period not in cached]
+
+    counts = {}
+    if missing:
+        year, month = missing[0]
+        month_year = extract('year', DailyAttendanceSummary.date)
+        month_number = extract('month', DailyAttendanceSummary.date)
+        counts = dict(((int(row_year), int(row_month)), count) for row_year, row_month, count in db.session.query(
+            month_year,
+            month_number,
+            func.sum(DailyAttendanceSummary.present)
+        ).filter(
+            DailyAttendanceSummary.date >= date(year, month, 1),
+            DailyAttendanceSummary.date <= today
+        ).group_by(month_year, month_number))
+
+    for period in missing:
+        if period != current and ttl:
+            _closed_month_counts[period] = (now + ttl, counts.get(period, 0))
+
+    return [
+        {
+            'month': f'{calendar.month_abbr[month]} {year}',
+            'count': cached[(year, month)] if (year, month) in cached else counts.get((year, month), 0)
+        }
+        for year, month in periods
+    ]
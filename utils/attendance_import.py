@@ -0,0 +1,348 @@
+"""
+Bulk attendance import from access-control punch logs
+
+Terminals export one line per punch: badge number and timestamp, optionally
+followed by other columns that are ignored. Files are read as a stream and
+punches are grouped into per-user, per-day buffers that are flushed in
+batches, so memory is bounded by the batch size rather than the file size.
+
+Each flushed day is merged with the punches already stored for it (from
+clock-in, or from an earlier import of the same file) and written back with
+one executemany upsert per batch. Re-importing a file is therefore harmless.
+The first punch of a day is the check-in, the last the check-out, and the
+second and third bracket the break. A day with three punches keeps the
+middle one as an open break, so a day split across batches or files loses
+no punches when it is merged back together. Attendance rows hold a single
+break, so further punches between the break and the check-out are dropped
+and listed in the import report.
+
+Timestamps carrying a UTC offset are converted to the server's local time,
+which clock-ins record, before the offset is dropped.
+
+Every import runs as an AttendanceImport row that holds its counters and
+report, so the upload page and status endpoint answer from any worker. The
+row is also the import lock: only one import runs at a time, and one whose
+heartbeat is older than PAYROLL_RUN_STALE_SECONDS is taken to have crashed.
+Web uploads are imported on a daemon thread.
+"""
+
+import csv
+import json
+import os
+import threading
+import time as timer
+from collections import Counter, defaultdict
+from datetime import date, datetime, time
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from models import AttendanceImport, User, attendance_minutes, db
+from utils.attendance import SHIFT_START, attendance_table, rebuild_attendance_summary, upsert
+from utils.payroll_runs import heartbeat, stale_before
+
+# Day rows buffered before a batch is written
+BATCH_SIZE = 5000
+
+# Rejected lines and dropped days kept for the import report
+MAX_REJECTED_SAMPLES = 50
+
+# Statuses the importer may overwrite; others (half_day) were set by hand
+PUNCH_STATUSES = (None, 'present', 'late', 'absent')
+
+class ImportReport:
+    """Counters for an attendance import run, saved to its AttendanceImport row"""
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.lines = 0
+        self.punches = 0
+        self.rows_written = 0
+        self.rejected = Counter()
+        self.rejected_samples = []
+        self.dropped = 0
+        self.dropped_days = 0
+        self.dropped_samples = []  # (user id, date, dropped times); badges once finished
+        self.first_date = None
+        self.last_date = None
+        self.status = 'running'
+        self.error = None
+        self.started = timer.perf_counter()
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.elapsed = 0
+
+    def reject(self, line_number, line, reason):
+        self.rejected[reason] += 1
+        if len(self.rejected_samples) < MAX_REJECTED_SAMPLES:
+            self.rejected_samples.append((line_number, reason, line))
+
+    def drop(self, user_id, day, punches):
+        self.dropped += len(punches)
+        self.dropped_days += 1
+        if len(self.dropped_samples) < MAX_REJECTED_SAMPLES:
+            self.dropped_samples.append((user_id, day, punches))
+
+    def save(self, **values):
+        """Write the counters to the job row, if the import has one"""
+        if self.job_id is None:
+            return
+        db.session.execute(
+            update(AttendanceImport).where(AttendanceImport.id == self.job_id)
+            .values(lines=self.lines, punches=self.punches, rows_written=self.rows_written,
+                    rejected=self.rejected_total, dropped=self.dropped, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def finish(self, status='completed', error=None):
+        self.status = status
+        self.error = error
+        self.elapsed = timer.perf_counter() - self.started
+        self.finished_at = datetime.utcnow()
+        self.save(status=status, running=None, error=error, finished_at=self.finished_at, samples=json.dumps({
+            'rejected': dict(self.rejected),
+            'rejected_samples': self.rejected_samples,
+            'dropped_days': self.dropped_days,
+            'dropped_samples': [(badge, day.isoformat(), [punch.isoformat() for punch in punches])
+                                for badge, day, punches in self.dropped_samples]
+        }))
+
+    @classmethod
+    def from_job(cls, job):
+        """The report of an AttendanceImport row, as far as the import has got"""
+        report = cls(job.id)
+        report.lines, report.punches, report.rows_written = job.lines, job.punches, job.rows_written
+        report.dropped = job.dropped
+        report.status, report.error = job.status, job.error
+        report.started_at, report.finished_at = job.started_at, job.finished_at
+        report.elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+
+        # Reasons and samples are saved when the import finishes; until then only the total is known
+        samples = json.loads(job.samples) if job.samples else {}
+        report.rejected = Counter(samples.get('rejected', {'rejected': job.rejected} if job.rejected else {}))
+        report.rejected_samples = [tuple(sample) for sample in samples.get('rejected_samples', [])]
+        report.dropped_days = samples.get('dropped_days', 0)
+        report.dropped_samples = [(badge, date.fromisoformat(day), [time.fromisoformat(punch) for punch in punches])
+                                  for badge, day, punches in samples.get('dropped_samples', [])]
+        return report
+
+    @property
+    def rejected_total(self):
+        return sum(self.rejected.values())
+
+    @property
+    def rows_per_second(self):
+        return self.lines / self.elapsed if self.elapsed else 0
+
+    def summary(self):
+        dropped = f', {self.dropped} dropped on {self.dropped_days} days' if self.dropped else ''
+        return (f'{self.lines} lines, {self.punches} punches, {self.rows_written} attendance rows written, '
+                f'{self.rejected_total} rejected{dropped} in {self.elapsed:.1f}s ({self.rows_per_second:,.0f} rows/s)')
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'lines': self.lines,
+            'punches': self.punches,
+            'rows_written': self.rows_written,
+            'rejected': self.rejected_total,
+            'dropped': self.dropped,
+            'seconds': round(self.elapsed, 3),
+            'error': self.error,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+def badge_index():
+    """Map badge numbers (User.employee_id) to user ids in one query"""
+    return {employee_id.strip().upper(): user_id
+            for employee_id, user_id in db.session.execute(select(User.employee_id, User.id))}
+
+def parse_punches(lines, badges, report, delimiter=','):
+    """Yield (user_id, datetime) for every valid punch line, recording rejects"""
+    for line_number, row in enumerate(csv.reader(lines, delimiter=delimiter), start=1):
+        report.lines += 1
+
+        if not row or not any(field.strip() for field in row):
+            report.lines -= 1
+            continue
+
+        if len(row) < 2:
+            report.reject(line_number, delimiter.join(row), 'missing columns')
+            continue
+
+        badge, stamp = row[0].strip().upper(), row[1].strip()
+
+        try:
+            punched_at = datetime.fromisoformat(stamp)
+        except ValueError:
+            # A header line is not an error
+            if line_number == 1:
+                report.lines -= 1
+            else:
+                report.reject(line_number, delimiter.join(row), 'invalid timestamp')
+            continue
+
+        user_id = badges.get(badge)
+        if user_id is None:
+            report.reject(line_number, delimiter.join(row), 'unknown badge')
+            continue
+
+        if punched_at.tzinfo is not None:
+            punched_at = punched_at.astimezone().replace(tzinfo=None)
+
+        report.punches += 1
+        yield user_id, punched_at
+
+def collapse_day(punches, existing_status=None):
+    """Turn a day's punch times into attendance column values"""
+    punches = sorted(set(punches))
+    check_in = punches[0]
+    check_out = punches[-1] if len(punches) > 1 else None
+    break_start = punches[1] if len(punches) >= 3 else None
+    break_end = punches[2] if len(punches) >= 4 else None
+    worked_minutes, break_minutes = attendance_minutes(check_in, check_out, break_start, break_end)
+
+    if existing_status in PUNCH_STATUSES:
+        status = 'late' if check_in > SHIFT_START else 'present'
+    else:
+        status = existing_status
+
+    return {
+        'check_in': check_in,
+        'check_out': check_out,
+        'break_start': break_start,
+        'break_end': break_end,
+        'status': status,
+        'worked_minutes': worked_minutes,
+        'break_minutes': break_minutes
+    }
+
+def write_batch(days, report):
+    """Merge buffered days with stored punches and upsert them in one statement"""
+    dates = [day for _, day in days]
+    first, last = min(dates), max(dates)
+    user_ids = {user_id for user_id, _ in days}
+
+    columns = attendance_table.c
+    statuses = {}
+    for row in db.session.execute(
+        select(columns.user_id, columns.date, columns.check_in, columns.break_start,
+               columns.break_end, columns.check_out, columns.status).where(
+            columns.date >= first,
+            columns.date <= last,
+            columns.user_id.in_(user_ids)
+        )
+    ):
+        key = (row.user_id, row.date)
+        if key in days:
+            days[key].extend(value for value in (row.check_in, row.break_start, row.break_end, row.check_out) if value)
+            statuses[key] = row.status
+
+    created_at = datetime.utcnow()
+    rows = []
+    for key, punches in days.items():
+        punches = sorted(set(punches))
+        if len(punches) > 4:
+            report.drop(*key, punches[3:-1])
+        rows.append(dict(collapse_day(punches, statuses.get(key)), user_id=key[0], date=key[1],
+                         created_at=created_at))
+
+    stmt = upsert(attendance_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[columns.user_id, columns.date],
+        set_={name: stmt.excluded[name] for name in
+              ('check_in', 'check_out', 'break_start', 'break_end', 'status', 'worked_minutes', 'break_minutes')}
+    )
+    db.session.execute(stmt, rows)
+    db.session.commit()
+
+    report.rows_written += len(rows)
+    report.first_date = min(first, report.first_date or first)
+    report.last_date = max(last, report.last_date or last)
+    report.save()
+
+def import_punches(lines, delimiter=',', batch_size=BATCH_SIZE, report=None):
+    """Import a punch log from an iterable of text lines"""
+    report = report or ImportReport()
+    badges = badge_index()
+    days = defaultdict(list)
+
+    for user_id, punched_at in parse_punches(lines, badges, report, delimiter):
+        days[(user_id, punched_at.date())].append(punched_at.time())
+
+        if len(days) >= batch_size:
+            write_batch(days, report)
+            days = defaultdict(list)
+
+    if days:
+        write_batch(days, report)
+
+    # Upserts bypass the ORM hooks, so recount the imported dates
+    if report.first_date:
+        rebuild_attendance_summary(report.first_date, report.last_date)
+        db.session.commit()
+
+    if report.dropped_samples:
+        employees = {user_id: badge for badge, user_id in badges.items()}
+        report.dropped_samples = [(employees.get(user_id), day, punches)
+                                  for user_id, day, punches in report.dropped_samples]
+
+    report.finish()
+    return report
+
+def claim_import(started_by=None):
+    """Take the import lock for a new AttendanceImport; returns its id, or None while another import runs"""
+    now = datetime.utcnow()
+    db.session.execute(
+        update(AttendanceImport)
+        .where(AttendanceImport.running.is_(True), AttendanceImport.heartbeat_at < stale_before())
+        .values(status='failed', running=None, error='The import stopped responding', finished_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    job = AttendanceImport(status='running', running=True, started_by=started_by, started_at=now, heartbeat_at=now)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return job.id
+
+def run_import(job_id, lines, delimiter=',', batch_size=BATCH_SIZE):
+    """Import a punch log under a claimed AttendanceImport, keeping its heartbeat fresh"""
+    report = ImportReport(job_id)
+    try:
+        with heartbeat(job_id, model=AttendanceImport):
+            return import_punches(lines, delimiter, batch_size, report)
+    except Exception as e:
+        db.session.rollback()
+        report.finish('failed', f'{type(e).__name__}: {e}')
+        raise
+
+def _import_in_background(app, job_id, path, delimiter):
+    with app.app_context():
+        try:
+            with open(path, encoding='utf-8-sig', errors='replace', newline='') as punch_log:
+                run_import(job_id, punch_log, delimiter)
+        except Exception:
+            app.logger.exception('Attendance import %s failed', job_id)
+        finally:
+            db.session.remove()
+            os.remove(path)
+
+def start_import_job(path, delimiter=',', started_by=None):
+    """Import a saved punch log on a daemon thread, removing the file afterwards; None while an import is running"""
+    job_id = claim_import(started_by)
+    if job_id is None:
+        return None
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_import_in_background, args=(app, job_id, path, delimiter), daemon=True,
+                     name=f'attendance-import-{job_id}').start()
+    return job_id
+
+def import_job(job_id):
+    """Report of an import, from whichever process ran it"""
+    job = db.session.get(AttendanceImport, job_id)
+    return ImportReport.from_job(job) if job else None
@@ -0,0 +1,318 @@
+"""
+Synthetic company generator
+
+Builds departments, users with roles and employee profiles, years of
+weekday attendance, leave requests, and monthly payroll with its salary
+payments, at production-like volumes. Rows go to the database in bulk:
+COPY on PostgreSQL, executemany elsewhere, never one ORM object at a time.
+
+Everything is drawn from one random.Random(seed) in a fixed order, and the
+end date defaults to a fixed day rather than today, so a seed alone always
+produces the same data and benchmark runs compare like with like. Only an
+empty database is filled.
+"""
+
+import csv
+import io
+import random
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from werkzeug.security import generate_password_hash
+from models import (Attendance, Department, Employee, LeaveRequest, Payment, Payroll, Role, User, db,
+                    attendance_minutes, user_roles)
+from utils.attendance import rebuild_attendance_summary
+from utils.payment_counters import rebuild_payment_counters
+from utils.payroll_engine import SHIFT_MINUTES, overtime_hours, overtime_rate
+from utils.permissions import initialize_system
+from utils.statutory import employee_deductions, tables_version
+
+# Prefix of generated employee numbers, emails and payment references
+PREFIX = 'SYN'
+
+# Rows sent per INSERT / COPY
+BATCH_SIZE = 5000
+
+# Last day of generated activity unless given; mid-month, so the last month
+# has attendance but no payroll for benchmarks to generate
+DEFAULT_END = date(2024, 6, 14)
+
+FIRST_NAMES = ['James', 'Mary', 'John', 'Grace', 'Peter', 'Faith', 'David', 'Mercy', 'Joseph', 'Esther',
+               'Daniel', 'Ann', 'Samuel', 'Joyce', 'Paul', 'Jane', 'Brian', 'Lucy', 'Kevin', 'Ruth']
+LAST_NAMES = ['Otieno', 'Wanjiku', 'Kamau', 'Achieng', 'Mwangi', 'Njeri', 'Kiprono', 'Atieno', 'Mutua',
+              'Wambui', 'Odhiambo', 'Chebet', 'Kariuki', 'Nyambura', 'Kiptoo', 'Awino', 'Maina', 'Jeptoo']
+POSITIONS = ['Technician', 'Officer', 'Clerk', 'Assistant', 'Engineer', 'Analyst', 'Supervisor', 'Driver']
+BANKS = ['KCB', 'Equity', 'Co-operative Bank', 'NCBA', 'Absa', 'Stanbic']
+
+# Weighted day outcomes for a working day
+STATUSES = ['present'] * 85 + ['late'] * 7 + ['half_day'] * 3 + ['absent'] * 5
+
+LEAVE_TYPES = ['annual'] * 14 + ['sick'] * 5 + ['compassionate']
+
+def bulk_insert(table, rows):
+    """Insert row dicts with COPY on PostgreSQL and executemany elsewhere"""
+    if not rows:
+        return 0
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        preparer = connection.dialect.identifier_preparer
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if row[column] is None else row[column] for column in columns])
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(column) for column in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    else:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+class BatchWriter:
+    """Buffers rows per table and flushes them in bulk"""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = defaultdict(list)
+        self.written = Counter()
+
+    def add(self, table, row):
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for pending_table in ([table] if table is not None else list(self.pending)):
+            self.written[pending_table.name] += bulk_insert(pending_table, self.pending.pop(pending_table, []))
+
+def weekdays(start, end):
+    """Weekdays from start to end inclusive"""
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+def _minute_time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+def create_departments(count):
+    """Default departments plus numbered ones up to count"""
+    departments = Department.query.order_by(Department.id).all()
+    for number in range(len(departments) + 1, count + 1):
+        department = Department(name=f'Department {number}', code=f'D{number:03d}',
+                                description='Generated department')
+        db.session.add(department)
+        departments.append(department)
+    db.session.flush()
+    return [department.id for department in departments[:max(count, 1)]]
+
+def generate_users(rng, writer, employees, department_ids, start, end, created_at):
+    """Users, role memberships and employee profiles; returns the users' payroll fields"""
+    password_hash = generate_password_hash('password123')
+    roles = {role.name: role.id for role in Role.query}
+
+    for number in range(1, employees + 1):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        hire_date = start - timedelta(days=rng.randint(0, 3650)) if rng.random() < 0.8 else \
+            start + timedelta(days=rng.randint(0, max((end - start).days, 0)))
+        writer.add(User.__table__, {
+            'employee_id': f'{PREFIX}{number:06d}',
+            'email': f'{PREFIX.lower()}{number}@mutechcivil.com',
+            'password_hash': password_hash,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone': f'07{rng.randint(10000000, 99999999)}',
+            'national_id': f'{PREFIX}{number:08d}',
+            'department_id': department_ids[rng.randrange(len(department_ids))],
+            'position': rng.choice(POSITIONS),
+            'hire_date': hire_date,
+            'salary': Decimal(rng.randrange(25000, 250000, 500)),
+            'is_active': rng.random() < 0.97,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'permissions_version': 0
+        })
+    writer.flush(User.__table__)
+
+    users = db.session.execute(
+        db.select(User.id, User.employee_id, User.salary, User.hire_date, User.is_active)
+        .where(User.employee_id.like(f'{PREFIX}%')).order_by(User.employee_id)
+    ).all()
+
+    for user in users:
+        writer.add(user_roles, {'user_id': user.id, 'role_id': roles['employee']})
+        if rng.random() < 0.04:
+            writer.add(user_roles, {'user_id': user.id, 'role_id': roles['department_manager']})
+        writer.add(Employee.__table__, {
+            'user_id': user.id,
+            'emergency_contact_name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            'emergency_contact_phone': f'07{rng.randint(10000000, 99999999)}',
+            'emergency_contact_relationship': rng.choice(['Spouse', 'Parent', 'Sibling']),
+            'bank_name': rng.choice(BANKS),
+            'bank_account_number': str(rng.randint(10 ** 9, 10 ** 10 - 1)),
+            'annual_leave_balance': rng.randint(0, 21),
+            'sick_leave_balance': rng.randint(0, 10),
+            'performance_rating': rng.choice(['excellent', 'good', 'good', 'satisfactory'])
+        })
+    writer.flush()
+    return users
+
+def generate_leave(rng, writer, users, start, end, leave_per_year, approver_id, created_at):
+    """Leave requests; returns {user_id: set of days on approved leave}"""
+    on_leave = defaultdict(set)
+    requests = round(leave_per_year * max((end - start).days + 1, 1) / 365)
+
+    for user in users:
+        for _ in range(requests):
+            first = start + timedelta(days=rng.randint(0, max((end - start).days, 0)))
+            days = list(weekdays(first, first + timedelta(days=rng.randint(0, 13))))[:rng.randint(1, 10)]
+            if not days:
+                continue
+
+            status = 'pending' if days[-1] > end - timedelta(days=14) and rng.random() < 0.5 else \
+                rng.choice(['approved'] * 9 + ['rejected'])
+            if status == 'approved':
+                on_leave[user.id].update(days)
+
+            writer.add(LeaveRequest.__table__, {
+                'user_id': user.id,
+                'leave_type': rng.choice(LEAVE_TYPES),
+                'start_date': days[0],
+                'end_date': days[-1],
+                'days_requested': len(days),
+                'reason': 'Generated leave request',
+                'status': status,
+                'approved_by': approver_id if status != 'pending' else None,
+                'approved_at': created_at if status != 'pending' else None,
+                'created_at': created_at
+            })
+    writer.flush()
+    return on_leave
+
+def generate_attendance(rng, writer, users, start, end, on_leave):
+    """Weekday attendance; returns {(user_id, year, month): overtime minutes}"""
+    overtime = Counter()
+    active = [user for user in users if user.is_active]
+
+    for day in weekdays(start, end):
+        for user in active:
+            if user.hire_date and user.hire_date > day or day in on_leave[user.id]:
+                continue
+
+            status = rng.choice(STATUSES)
+            row = {'user_id': user.id, 'date': day, 'status': status, 'check_in': None, 'check_out': None,
+                   'break_start': None, 'break_end': None, 'worked_minutes': 0, 'break_minutes': 0}
+
+            if status != 'absent':
+                check_in = rng.randint(8 * 60 + 16, 9 * 60 + 30) if status == 'late' else rng.randint(7 * 60 + 30, 8 * 60 + 15)
+                check_out = check_in + rng.randint(240, 300) if status == 'half_day' else \
+                    rng.randint(16 * 60 + 45, 19 * 60 if rng.random() < 0.2 else 17 * 60 + 45)
+                row['check_in'], row['check_out'] = _minute_time(check_in), _minute_time(check_out)
+                if status != 'half_day':
+                    row['break_start'], row['break_end'] = time(13, 0), _minute_time(13 * 60 + rng.randint(30, 60))
+
+                row['worked_minutes'], row['break_minutes'] = attendance_minutes(
+                    row['check_in'], row['check_out'], row['break_start'], row['break_end']
+                )
+                overtime[(user.id, day.year, day.month)] += max(0, row['worked_minutes'] - SHIFT_MINUTES)
+
+            writer.add(Attendance.__table__, row)
+    writer.flush()
+    return overtime
+
+def generate_payroll(rng, writer, users, start, end, overtime, processor_id):
+    """Payroll and its salary payment for every whole month within the period"""
+    month = date(start.year, start.month, 1)
+    if month < start:
+        month = (month + timedelta(days=32)).replace(day=1)
+    while month <= end:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        if next_month - timedelta(days=1) > end:
+            break
+
+        pay_date = next_month - timedelta(days=1)
+        paid_at = datetime.combine(pay_date, time(10, 0))
+        slips = {}
+        for user in users:
+            if not user.is_active or not user.salary or (user.hire_date and user.hire_date > pay_date):
+                continue
+
+            basic = Decimal(user.salary)
+            slip = {
+                'user_id': user.id, 'month': month.month, 'year': month.year, 'basic_salary': basic,
+                'allowances': Decimal(rng.choice([0, 0, 2000, 5000])),
+                'overtime_hours': overtime_hours(overtime[(user.id, month.year, month.month)]),
+                'overtime_rate': overtime_rate(basic),
+                'other_deductions': Decimal('0'),
+                'payment_status': 'completed', 'payment_date': pay_date, 'created_at': paid_at, 'updated_at': paid_at
+            }
+            slip['overtime_pay'] = (slip['overtime_hours'] * slip['overtime_rate']).quantize(Decimal('0.01'))
+            slip['gross_pay'] = basic + slip['allowances'] + slip['overtime_pay']
+            statutory = employee_deductions(slip['gross_pay'], pay_date)
+            slip['tax_deduction'] = statutory['paye']
+            slip['nhif_deduction'] = statutory['health']
+            slip['nssf_deduction'] = statutory['nssf']
+            slip['statutory_version'] = tables_version(pay_date)
+            slip['total_deductions'] = slip['tax_deduction'] + slip['nhif_deduction'] + slip['nssf_deduction']
+            slip['net_pay'] = slip['gross_pay'] - slip['total_deductions']
+
+            reference = f'{PREFIX}-{month:%Y%m}-{user.id}'
+            slips[reference] = slip
+            writer.add(Payment.__table__, {
+                'user_id': user.id, 'payment_type': 'salary', 'amount': slip['net_pay'], 'currency': 'KES',
+                'payment_method': rng.choice(['mpesa', 'bank', 'bank']), 'status': 'completed',
+                'transaction_date': paid_at, 'description': f'Salary {month:%B %Y}', 'reference_number': reference,
+                'processed_by': processor_id, 'created_at': paid_at, 'updated_at': paid_at
+            })
+        writer.flush(Payment.__table__)
+
+        for payment_id, reference in db.session.execute(
+            db.select(Payment.id, Payment.reference_number)
+            .where(Payment.reference_number.like(f'{PREFIX}-{month:%Y%m}-%'))
+        ):
+            writer.add(Payroll.__table__, dict(slips[reference], payment_id=payment_id))
+        writer.flush(Payroll.__table__)
+
+        month = next_month
+
+def is_generated_database():
+    """Whether the database holds a generated company and no users of its own"""
+    generated = User.employee_id.like(f'{PREFIX}%')
+    return (db.session.query(User.id).filter(generated).first() is not None and
+            db.session.query(User.id).filter(~generated).first() is None)
+
+def generate_dataset(employees=1000, departments=8, years=1, leave_per_year=3, seed=42, end=None,
+                     batch_size=BATCH_SIZE):
+    """Generate a company into an empty database; returns rows written per table"""
+    for model in (User, Attendance, LeaveRequest, Payment, Payroll):
+        if db.session.query(model.id).first():
+            raise ValueError(f'The database already holds {model.__tablename__} rows; use an empty database')
+
+    rng = random.Random(seed)
+    end = end or DEFAULT_END
+    start = end - timedelta(days=round(365.25 * years) - 1)
+    created_at = datetime.combine(end, time(0, 0))
+    writer = BatchWriter(batch_size)
+
+    initialize_system()
+    department_ids = create_departments(departments)
+
+    users = generate_users(rng, writer, employees, department_ids, start, end, created_at)
+    approver_id = next((user.id for user in users if user.is_active), None)
+
+    on_leave = generate_leave(rng, writer, users, start, end, leave_per_year, approver_id, created_at)
+    overtime = generate_attendance(rng, writer, users, start, end, on_leave)
+    generate_payroll(rng, writer, users, start, end, overtime, approver_id)
+
+    writer.written['daily_attendance_summary'] = rebuild_attendance_summary(start, end)
+    writer.written['payment_counter'] = rebuild_payment_counters()
+    db.session.commit()
+    return writer.written
@@ -1,6 +1,7 @@
 from flask import current_app
 from flask_mail import Message
 from app import mail
+from utils.metrics import EMAIL_SEND_SECONDS, track_duration
 import jwt
 from datetime import datetime, timedelta
 
@@ -24,7 +25,8 @@ def send_password_reset_email(user):
     )
     
     try:
-        mail.send(msg)
+        with track_duration(EMAIL_SEND_SECONDS):
+            mail.send(msg)
         return True
     except Exception as e:
         print(f"Error sending email: {e}")
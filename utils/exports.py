@@ -0,0 +1,91 @@
+"""
+Streaming CSV and XLSX exports
+
+Rows are read from the database in batches (yield_per, which uses a
+server-side cursor on PostgreSQL) and written to the response as they
+arrive, so an export of any size holds only one batch in memory.
+"""
+
+import csv
+import io
+import tempfile
+from datetime import datetime, time
+from flask import Response, abort, send_file, stream_with_context
+import xlsxwriter
+from models import db
+
+# Rows fetched from the cursor per batch
+EXPORT_BATCH_SIZE = 1000
+
+def query_rows(statement, batch_size=EXPORT_BATCH_SIZE):
+    """Yield result rows of a column select without loading them all"""
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield from partition
+
+def _cell(value):
+    """Render times as text; other values are written as-is"""
+    if isinstance(value, time):
+        return value.strftime('%H:%M:%S')
+    return value
+
+def stream_csv(filename, header, rows):
+    """Chunked CSV response written while rows are fetched"""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+
+        for count, row in enumerate(rows, start=1):
+            writer.writerow([_cell(value) for value in row])
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+    )
+
+def stream_xlsx(filename, header, rows):
+    """XLSX response built with xlsxwriter's constant-memory mode"""
+    # The zip container is assembled on disk, then streamed back in chunks
+    workbook_file = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(workbook_file, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd'
+    })
+    worksheet = workbook.add_worksheet()
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm'})
+    bold = workbook.add_format({'bold': True})
+
+    worksheet.write_row(0, 0, header, bold)
+    for row_number, row in enumerate(rows, start=1):
+        for column, value in enumerate(row):
+            if isinstance(value, datetime):
+                worksheet.write_datetime(row_number, column, value, datetime_format)
+            elif value is not None:
+                worksheet.write(row_number, column, _cell(value))
+
+    workbook.close()
+    workbook_file.seek(0)
+
+    return send_file(
+        workbook_file,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'{filename}.xlsx'
+    )
+
+def export_response(export_format, filename, header, rows):
+    """Stream rows in the requested export format"""
+    if export_format == 'xlsx':
+        return stream_xlsx(filename, header, rows)
+    if export_format == 'csv':
+        return stream_csv(filename, header, rows)
+
+    abort(400)
@@ -0,0 +1,62 @@
+"""
+Loader profiles for list views
+
+Each list template walks relationships of its rows (payment.user,
+attendance.user.department, user.roles, ...). Loading those with the rows
+keeps every page at a fixed number of queries however many rows it shows:
+many-to-one relationships are joined, collections are fetched with one
+extra SELECT ... IN for the whole page.
+
+test_list_queries.py holds each view to its profile.
+"""
+
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from models import Attendance, LeaveRequest, Payment, Payroll, User
+
+def employee_list_options():
+    """Employee listings showing department and profile details"""
+    return [
+        joinedload(User.department),
+        joinedload(User.employee_profile)
+    ]
+
+def department_employee_options():
+    """Department dashboards: the query already joins Department to filter by name"""
+    return [
+        contains_eager(User.department),
+        joinedload(User.employee_profile)
+    ]
+
+def user_list_options():
+    """admin.users: department and role badges per user"""
+    return [
+        joinedload(User.department),
+        selectinload(User.roles)
+    ]
+
+def attendance_list_options():
+    """admin.attendance: the query already joins User for its filters and sort"""
+    return [
+        contains_eager(Attendance.user).joinedload(User.department)
+    ]
+
+def leave_request_list_options():
+    """admin.leave_requests: requester (joined by the query), department and approver"""
+    return [
+        contains_eager(LeaveRequest.user).joinedload(User.department),
+        joinedload(LeaveRequest.approver)
+    ]
+
+def payment_list_options():
+    """payments.index: payee and the user who processed the payment"""
+    return [
+        joinedload(Payment.user),
+        joinedload(Payment.processor)
+    ]
+
+def payroll_list_options():
+    """payments.payroll: employee, department and the salary payment"""
+    return [
+        joinedload(Payroll.user).joinedload(User.department),
+        joinedload(Payroll.payment)
+    ]
@@ -0,0 +1,125 @@
+"""
+Prometheus metrics
+
+Request latency per endpoint, database pool usage, MPESA API calls, email
+delivery and payroll runs, served in the Prometheus text format at /metrics.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set up by gunicorn.conf.py) and /metrics aggregates the directory, so the
+numbers cover all workers whichever one answers the scrape. Outside debug
+mode /metrics is only served with METRICS_TOKEN set and presented.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from flask import Response, abort, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+
+REQUEST_SECONDS = Histogram(
+    'hrm_request_duration_seconds', 'Request latency by endpoint and status',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+
+DB_CHECKOUT_SECONDS = Histogram(
+    'hrm_db_pool_checkout_seconds', 'Time spent waiting for a database connection from the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+)
+
+DB_CONNECTIONS_IN_USE = Gauge(
+    'hrm_db_pool_connections_in_use', 'Database connections checked out of the pool',
+    multiprocess_mode='livesum'
+)
+
+MPESA_REQUEST_SECONDS = Histogram(
+    'hrm_mpesa_request_duration_seconds', 'MPESA API call latency by operation and outcome',
+    ['operation', 'outcome']
+)
+
+EMAIL_SEND_SECONDS = Histogram(
+    'hrm_email_send_duration_seconds', 'Email delivery time by outcome',
+    ['outcome']
+)
+
+PAYROLL_RUN_SECONDS = Histogram(
+    'hrm_payroll_run_duration_seconds', 'Payroll generation time by outcome',
+    ['outcome'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+
+@contextmanager
+def track_duration(histogram, **labels):
+    """Observe the block's duration, labelled outcome='success' or 'error'"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - started)
+
+def metrics_registry():
+    """Registry to expose: all workers' samples when running multiprocess"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def instrument_pool(engine):
+    """Time connection checkouts and track connections in use"""
+    pool = engine.pool
+    checkout = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return checkout()
+        finally:
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+    @event.listens_for(pool, 'checkout')
+    def connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+        DB_CONNECTIONS_IN_USE.inc()
+
+    @event.listens_for(pool, 'checkin')
+    def connection_checked_in(dbapi_connection, connection_record):
+        DB_CONNECTIONS_IN_USE.dec()
+
+def init_metrics(app):
+    """Record request latency and serve /metrics when METRICS_ENABLED"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    with app.app_context():
+        from models import db
+        instrument_pool(db.engine)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            REQUEST_SECONDS.labels(
+                blueprint=request.blueprint or '',
+                endpoint=request.endpoint or 'unmatched',
+                method=request.method,
+                status=response.status_code
+            ).observe(time.perf_counter() - started)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = current_app.config.get('METRICS_TOKEN')
+        # Without a token the samples are only served to a debug server
+        authorized = request.headers.get('Authorization') == f'Bearer {token}' if token else current_app.debug
+        if not authorized:
+            abort(403)
+        return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
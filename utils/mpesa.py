@@ -2,7 +2,75 @@ import requests
 import base64
 from datetime import datetime
 import json
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
 from flask import current_app
+from utils.metrics import MPESA_REQUEST_SECONDS, track_duration
+
+# File locks: flock on POSIX, msvcrt byte-range locks on Windows (local development)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Seconds to wait for Safaricom's OAuth endpoint
+TOKEN_REQUEST_TIMEOUT = 10
+
+# Access tokens this process holds, {credentials key: (access_token, expires_at)}
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+@contextmanager
+def token_cache_lock(path):
+    """Exclusive lock on the shared token file, held across this host's workers"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock:
+        _lock_file(lock)
+        try:
+            yield
+        finally:
+            _unlock_file(lock)
+
+def _lock_file(lock):
+    if fcntl:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return
+
+    # LK_LOCK gives up after ten one-second retries; keep waiting like flock does
+    lock.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+def _unlock_file(lock):
+    if fcntl:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    else:
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+def read_token_cache(path):
+    """Tokens shared by this host's workers, {credentials key: {'access_token', 'expires_at'}}"""
+    try:
+        with open(path, encoding='utf-8') as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+def write_token_cache(path, tokens):
+    """Replace the shared token file atomically, readable by this user only"""
+    partial = f'{path}.{os.getpid()}.tmp'
+    descriptor = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as cache:
+        json.dump(tokens, cache)
+    os.replace(partial, path)
 
 class MPESAClient:
     """MPESA API client for payment processing"""
@@ -13,6 +81,8 @@ class MPESAClient:
         self.shortcode = current_app.config.get('MPESA_SHORTCODE')
         self.passkey = current_app.config.get('MPESA_PASSKEY')
         self.environment = current_app.config.get('MPESA_ENVIRONMENT', 'sandbox')
+        self.token_cache = current_app.config.get('MPESA_TOKEN_CACHE')
+        self.token_margin = current_app.config.get('MPESA_TOKEN_MARGIN', 60)
         
         # Set base URLs based on environment
         if self.environment == 'production':
@@ -20,8 +90,69 @@ class MPESAClient:
         else:
             self.base_url = 'https://sandbox.safaricom.co.ke'
     
+    def token_key(self):
+        """Identifies the credentials a token belongs to, without storing the secret"""
+        return hashlib.sha256(f"{self.base_url}\n{self.consumer_key}".encode()).hexdigest()[:16]
+    
     def get_access_token(self):
-        """Get OAuth access token"""
+        """OAuth access token, shared by threads and workers until shortly before it expires
+        
+        A token held by this process is used without any I/O. Otherwise the
+        host's token file is read under an exclusive lock, and only the
+        holder of the lock fetches a new token when the file has none, so a
+        burst of payments costs one OAuth round trip.
+        """
+        key = self.token_key()
+        cached = _tokens.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+        
+        with _tokens_lock:
+            cached = _tokens.get(key)
+            if cached and cached[1] > time.time():
+                return cached[0]
+            
+            if not self.token_cache:
+                return self._fetch_and_hold(key)
+            
+            with token_cache_lock(self.token_cache):
+                tokens = read_token_cache(self.token_cache)
+                shared = tokens.get(key)
+                if shared and shared['expires_at'] > time.time():
+                    _tokens[key] = (shared['access_token'], shared['expires_at'])
+                    return shared['access_token']
+                
+                access_token = self._fetch_and_hold(key)
+                if access_token:
+                    tokens[key] = {'access_token': access_token, 'expires_at': _tokens[key][1]}
+                    write_token_cache(self.token_cache, tokens)
+                return access_token
+    
+    def _fetch_and_hold(self, key):
+        access_token, expires_in = self.request_access_token()
+        if access_token:
+            _tokens[key] = (access_token, time.time() + max(expires_in - self.token_margin, 0))
+        return access_token
+    
+    def forget_access_token(self, access_token, error):
+        """Drop a cached token the API rejected, so the next call fetches a new one"""
+        response = getattr(error, 'response', None)
+        if response is None or response.status_code != 401:
+            return
+        
+        key = self.token_key()
+        with _tokens_lock:
+            if _tokens.get(key, (None,))[0] == access_token:
+                del _tokens[key]
+            if self.token_cache and os.path.exists(self.token_cache):
+                with token_cache_lock(self.token_cache):
+                    tokens = read_token_cache(self.token_cache)
+                    if tokens.get(key, {}).get('access_token') == access_token:
+                        del tokens[key]
+                        write_token_cache(self.token_cache, tokens)
+    
+    def request_access_token(self):
+        """Fetch a new OAuth access token; returns (access_token, expires_in seconds)"""
         url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
         
         # Create basic auth header
@@ -34,15 +165,16 @@ class MPESAClient:
         }
         
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            with track_duration(MPESA_REQUEST_SECONDS, operation='access_token'):
+                response = requests.get(url, headers=headers, timeout=TOKEN_REQUEST_TIMEOUT)
+                response.raise_for_status()
             
             data = response.json()
-            return data.get('access_token')
+            return data.get('access_token'), int(data.get('expires_in', 3599))
         
         except requests.exceptions.RequestException as e:
             print(f"Error getting access token: {e}")
-            return None
+            return None, None
     
     def generate_password(self):
         """Generate password for STK push"""
@@ -90,8 +222,9 @@ class MPESAClient:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+            with track_duration(MPESA_REQUEST_SECONDS, operation='stk_push'):
+                response = requests.post(url, json=payload, headers=headers)
+                response.raise_for_status()
             
             data = response.json()
             
@@ -109,6 +242,7 @@ class MPESAClient:
                 }
         
         except requests.exceptions.RequestException as e:
+            self.forget_access_token(access_token, e)
             print(f"Error initiating STK push: {e}")
             return {'success': False, 'message': 'Network error occurred'}
     
@@ -135,13 +269,15 @@ class MPESAClient:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+            with track_duration(MPESA_REQUEST_SECONDS, operation='stk_query'):
+                response = requests.post(url, json=payload, headers=headers)
+                response.raise_for_status()
             
             data = response.json()
             return data
         
         except requests.exceptions.RequestException as e:
+            self.forget_access_token(access_token, e)
             print(f"Error querying STK status: {e}")
             return {'success': False, 'message': 'Network error occurred'}
     
@@ -180,13 +316,15 @@ class MPESAClient:
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
+            with track_duration(MPESA_REQUEST_SECONDS, operation='b2c_payment'):
+                response = requests.post(url, json=payload, headers=headers)
+                response.raise_for_status()
             
             data = response.json()
             return data
         
         except requests.exceptions.RequestException as e:
+            self.forget_access_token(access_token, e)
             print(f"Error initiating B2C payment: {e}")
             return {'success': False, 'message': 'Network error occurred'}
 
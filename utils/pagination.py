@@ -0,0 +1,167 @@
+"""
+Pagination for large list views
+
+In keyset mode a page is fetched by seeking past the sort key of the last
+row shown (WHERE (date, id) < (...) ORDER BY date DESC, id DESC LIMIT n), so
+page 500 costs the same index range scan as page 1. Positions travel as
+signed, opaque cursor tokens. Offset mode (Flask-SQLAlchemy's paginate())
+remains available for numbered page links.
+
+Total counts are optional. When shown they are cached per query for
+PAGINATION_COUNT_TTL seconds instead of running COUNT(*) on every view.
+"""
+
+import math
+import time
+from datetime import date, datetime
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_
+
+# {(sql, params): (expires_at, count)}
+_count_cache = {}
+
+# Distinct filtered queries remembered before the cache is reset
+COUNT_CACHE_SIZE = 1024
+
+class SortKey:
+    """One column of a list view's sort order"""
+
+    def __init__(self, column, descending=False, value=None):
+        self.column = column
+        self.descending = descending
+        # Reads the key from a result row; defaults to the column's attribute
+        self.value = value or (lambda item: getattr(item, column.key))
+
+    def ordering(self, reverse=False):
+        return self.column.asc() if self.descending == reverse else self.column.desc()
+
+    def beyond(self, value, reverse=False):
+        """Condition for rows after value in this key's direction"""
+        return self.column > value if self.descending == reverse else self.column < value
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-pagination')
+
+def _encode_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+def _decode_value(key, value):
+    if value is None:
+        return None
+
+    python_type = key.column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+def encode_cursor(keys, item, direction):
+    """Opaque token for the position of a row"""
+    return _serializer().dumps({
+        'v': [_encode_value(key.value(item)) for key in keys],
+        'd': direction
+    })
+
+def decode_cursor(keys, token):
+    """Sort key values and direction from a cursor token, or None if invalid"""
+    try:
+        payload = _serializer().loads(token)
+        values = [_decode_value(key, value) for key, value in zip(keys, payload['v'], strict=True)]
+        return values, payload['d']
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+def seek_condition(keys, values, reverse=False):
+    """Rows strictly after the given key values in sort order"""
+    conditions = []
+    for index, key in enumerate(keys):
+        equal = [keys[prior].column == values[prior] for prior in range(index)]
+        conditions.append(and_(*equal, key.beyond(values[index], reverse)))
+    return or_(*conditions)
+
+def cached_count(query):
+    """COUNT(*) of a query, cached for PAGINATION_COUNT_TTL seconds"""
+    ttl = current_app.config.get('PAGINATION_COUNT_TTL', 60)
+    query = query.order_by(None)
+
+    if not ttl:
+        return query.count()
+
+    compiled = query.statement.compile()
+    cache_key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+
+    cached = _count_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    count = query.count()
+    if len(_count_cache) >= COUNT_CACHE_SIZE:
+        _count_cache.clear()
+    _count_cache[cache_key] = (now + ttl, count)
+    return count
+
+class KeysetPage:
+    """A page of a keyset-paginated query"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        return math.ceil(self.total / self.per_page) if self.total else 0
+
+def keyset_paginate(query, keys, per_page, cursor=None, count=True, options=()):
+    """Fetch the page after (or before) a cursor by seeking on the sort keys"""
+    position = decode_cursor(keys, cursor) if cursor else None
+    reverse = bool(position) and position[1] == 'prev'
+
+    page_query = query.options(*options).order_by(None).order_by(*(key.ordering(reverse) for key in keys))
+    if position:
+        page_query = page_query.filter(seek_condition(keys, position[0], reverse))
+
+    items = page_query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if reverse:
+        items.reverse()
+
+    # Moving forward there are earlier rows behind us; moving back, later ones
+    has_next = more if not reverse else True
+    has_prev = bool(position) if not reverse else more
+
+    return KeysetPage(
+        items=items,
+        per_page=per_page,
+        next_cursor=encode_cursor(keys, items[-1], 'next') if items and has_next else None,
+        prev_cursor=encode_cursor(keys, items[0], 'prev') if items and has_prev else None,
+        total=cached_count(query) if count else None
+    )
+
+def paginate(query, keys, per_page=20, options=()):
+    """Paginate a list view in the configured PAGINATION_MODE, loading rows with options"""
+    count = current_app.config.get('PAGINATION_COUNT', True)
+
+    if current_app.config.get('PAGINATION_MODE', 'keyset') == 'offset' and 'cursor' not in request.args:
+        page = request.args.get('page', 1, type=int)
+        pagination = query.options(*options).order_by(None).order_by(*(key.ordering() for key in keys)).paginate(
+            page=page, per_page=per_page, error_out=False, count=False
+        )
+        pagination.total = cached_count(query) if count else None
+        return pagination
+
+    return keyset_paginate(query, keys, per_page, cursor=request.args.get('cursor'), count=count, options=options)
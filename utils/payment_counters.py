@@ -0,0 +1,132 @@
+"""
+Payment status counters
+
+payment_counter holds the number and total amount of payments per status,
+payment type and method. Every ORM flush that adds, deletes or moves a
+payment between statuses (approval, rejection, MPESA callbacks) folds the
+change into the counters in the same transaction, so the payments dashboard
+reads a few pre-aggregated rows instead of counting the payment table.
+
+Writes that bypass the ORM rebuild the counters with one GROUP BY over
+payments. That scan is what the counters avoid, so requests never run it:
+schedule manage.py reconcile-payment-counters (cron or similar) to correct
+and report any drift.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import func, insert, inspect, select, text
+from models import Payment, PaymentCounter, db
+from utils.attendance import _previous_value, upsert
+
+counter_table = PaymentCounter.__table__
+
+# Payment attributes a counter cell is keyed on, then the one it totals
+CELL_KEYS = ('status', 'payment_type', 'payment_method')
+
+class PaymentCounts:
+    """Counter rows, with the totals per status the dashboard shows"""
+
+    def __init__(self, rows):
+        self.breakdown = [row for row in rows if row.count]
+        self.by_status = defaultdict(int)
+        for row in self.breakdown:
+            self.by_status[row.status] += row.count
+
+    def __getitem__(self, status):
+        return self.by_status.get(status, 0)
+
+def _cell(values):
+    status, payment_type, payment_method, amount = values
+    return (status or 'pending', payment_type, payment_method), amount or Decimal('0')
+
+def apply_counter_changes(session):
+    """Fold payments inserted, updated or deleted in a flush into the counters"""
+    changes = []
+
+    for obj in session.new:
+        if isinstance(obj, Payment):
+            changes.append((None, tuple(getattr(obj, key) for key in CELL_KEYS + ('amount',))))
+
+    for obj in session.dirty:
+        if isinstance(obj, Payment) and session.is_modified(obj):
+            state = inspect(obj)
+            old = tuple(_previous_value(state, key) for key in CELL_KEYS + ('amount',))
+            new = tuple(getattr(obj, key) for key in CELL_KEYS + ('amount',))
+            if old != new:
+                changes.append((old, new))
+
+    for obj in session.deleted:
+        if isinstance(obj, Payment):
+            state = inspect(obj)
+            changes.append((tuple(_previous_value(state, key) for key in CELL_KEYS + ('amount',)), None))
+
+    if not changes:
+        return
+
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            if values:
+                cell, amount = _cell(values)
+                deltas[cell][0] += sign
+                deltas[cell][1] += sign * Decimal(amount)
+
+    connection = session.connection()
+    for (status, payment_type, payment_method), (count, amount) in deltas.items():
+        if not count and not amount:
+            continue
+        stmt = upsert(counter_table).values(status=status, payment_type=payment_type,
+                                            payment_method=payment_method, count=count, amount=amount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[counter_table.c[key] for key in CELL_KEYS],
+            set_={name: counter_table.c[name] + stmt.excluded[name] for name in ('count', 'amount')}
+        )
+        connection.execute(stmt)
+
+def payment_aggregate():
+    """Counter rows computed from the payment table with one GROUP BY"""
+    return select(
+        func.coalesce(Payment.status, 'pending').label('status'), Payment.payment_type, Payment.payment_method,
+        func.count(Payment.id).label('count'), func.coalesce(func.sum(Payment.amount), 0).label('amount')
+    ).group_by(func.coalesce(Payment.status, 'pending'), Payment.payment_type, Payment.payment_method)
+
+def lock_counters():
+    """Hold back concurrent counter deltas until the transaction ends
+
+    Flushes apply their deltas in their own transactions; on PostgreSQL the
+    lock waits for those in flight to commit, so the GROUP BY that follows
+    sees their payments, and later ones apply on top of the rebuilt rows.
+    SQLite already serializes writers.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text(f'LOCK TABLE {counter_table.name} IN EXCLUSIVE MODE'))
+
+def rebuild_payment_counters():
+    """Recompute every counter from the payment table"""
+    lock_counters()
+    db.session.execute(counter_table.delete())
+    result = db.session.execute(
+        insert(counter_table).from_select([*CELL_KEYS, 'count', 'amount'], payment_aggregate())
+    )
+    return result.rowcount
+
+def reconcile_payment_counters():
+    """Compare the counters with the payment table and rebuild them on drift; returns the cells that drifted"""
+    lock_counters()
+    actual = {tuple(row[:3]): (row.count, Decimal(row.amount)) for row in db.session.execute(payment_aggregate())}
+    cached = {tuple(row[:3]): (row.count, Decimal(row.amount))
+              for row in db.session.execute(select(counter_table)) if row.count or row.amount}
+
+    drifted = [cell for cell in actual.keys() | cached.keys() if actual.get(cell) != cached.get(cell)]
+    if drifted:
+        current_app.logger.warning('Payment counters drifted in %d cells; rebuilding', len(drifted))
+        rebuild_payment_counters()
+    return len(drifted)
+
+def payment_counts():
+    """Payment counts and totals by status, type and method, read from the counters"""
+    return PaymentCounts(db.session.execute(
+        select(counter_table).order_by(*(counter_table.c[key] for key in CELL_KEYS))
+    ).all())
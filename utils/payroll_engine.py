@@ -0,0 +1,294 @@
+"""
+Vectorized attendance engine for payroll periods
+
+A period's punches are read as integer columns (user, day of month, check-in
+second, worked minutes, attended flag) and reduced per employee with NumPy,
+so a month for the whole company is a handful of array operations rather
+than one Python iteration per Attendance object. Days of approved leave are
+not counted as absences.
+
+Payroll for a period is generated the same way: the (user, salary) projection
+of the employees employed through the period is combined with their overtime
+as integer cents, priced with the statutory tables in utils.statutory, and the
+rows are written with a single INSERT that skips employees already paid for
+the period.
+"""
+
+import calendar
+from itertools import chain
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from sqlalchemy import BigInteger, Integer, case, cast, extract, func, or_, select, true
+from models import Attendance, LeaveRequest, Payroll, User, db
+from utils.attendance import SHIFT_START, seconds_of_day, upsert
+from utils.statutory import compute_deductions, round_div, tables_version
+
+# Standard working day; time worked beyond it is overtime
+SHIFT_MINUTES = 8 * 60
+
+# Hours in a standard working month (40 hours x 52 weeks / 12 months)
+STANDARD_MONTHLY_HOURS = Decimal('173.33')
+
+# Overtime is paid at time and a half
+OVERTIME_MULTIPLIER = Decimal('1.5')
+
+# Column positions in the period array
+USER, DAY, CHECK_IN, WORKED, ATTENDED = range(5)
+
+class PeriodAttendance:
+    """Per-employee attendance totals for a payroll period, as parallel arrays"""
+
+    def __init__(self, user_ids, worked_minutes, overtime_minutes, late_minutes, days_present, absences):
+        self.user_ids = user_ids
+        self.worked_minutes = worked_minutes
+        self.overtime_minutes = overtime_minutes
+        self.late_minutes = late_minutes
+        self.days_present = days_present
+        self.absences = absences
+        self._positions = None
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __getitem__(self, user_id):
+        """Totals for one employee as a dict of plain ints"""
+        if self._positions is None:
+            self._positions = {int(user_id): position for position, user_id in enumerate(self.user_ids)}
+
+        position = self._positions[user_id]
+        return {
+            'worked_minutes': int(self.worked_minutes[position]),
+            'overtime_minutes': int(self.overtime_minutes[position]),
+            'late_minutes': int(self.late_minutes[position]),
+            'days_present': int(self.days_present[position]),
+            'absences': int(self.absences[position])
+        }
+
+def working_days(month, year, through=None):
+    """Boolean array of Monday-Friday days in a month, optionally only up to a date"""
+    days = calendar.monthrange(year, month)[1]
+    working = np.array([date(year, month, day).weekday() < 5 for day in range(1, days + 1)])
+
+    if through and (through.year, through.month) == (year, month):
+        working[through.day:] = False
+
+    return working
+
+def period_end(month, year):
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+def employed_through(on):
+    """Employees hired by `on` who were not terminated by then"""
+    return (or_(User.hire_date.is_(None), User.hire_date <= on),
+            or_(User.is_active.is_(True), User.termination_date > on))
+
+def in_department(user_id, department_id):
+    """Filter on a user id column, restricted to one department's employees when one is given"""
+    if department_id is None:
+        return true()
+    return user_id.in_(select(User.id).where(User.department_id == department_id))
+
+def load_period(month, year, department_id=None):
+    """Read a month of attendance as an int64 array with USER, DAY, CHECK_IN, WORKED, ATTENDED columns"""
+    start = date(year, month, 1)
+    end = period_end(month, year)
+
+    rows = db.session.connection().execute(
+        select(
+            Attendance.user_id,
+            cast(extract('day', Attendance.date), Integer) - 1,
+            func.coalesce(seconds_of_day(Attendance.check_in), -1),
+            Attendance.worked_minutes,
+            case((Attendance.status == 'absent', 0), else_=1)
+        ).where(Attendance.date >= start, Attendance.date <= end, in_department(Attendance.user_id, department_id))
+    ).all()
+
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 5).reshape(-1, 5)
+
+def load_leave(month, year, department_id=None):
+    """Approved leave overlapping a month as an int64 array of (user, first day, last day) rows, days from 0"""
+    start = date(year, month, 1)
+    end = period_end(month, year)
+
+    rows = db.session.connection().execute(
+        select(LeaveRequest.user_id, LeaveRequest.start_date, LeaveRequest.end_date).where(
+            LeaveRequest.status == 'approved', LeaveRequest.start_date <= end, LeaveRequest.end_date >= start,
+            in_department(LeaveRequest.user_id, department_id)
+        )
+    ).all()
+
+    return np.array([(user_id, (max(first, start) - start).days, (min(last, end) - start).days)
+                     for user_id, first, last in rows], dtype=np.int64).reshape(-1, 3)
+
+def leave_days(user_ids, leave, days):
+    """Boolean (employee, day) array of the days each employee is on approved leave"""
+    marks = np.zeros((len(user_ids), days + 1), dtype=np.int64)
+    if leave is None or not len(leave):
+        return marks[:, :days] > 0
+
+    positions = np.searchsorted(user_ids, leave[:, 0])
+    known = positions < len(user_ids)
+    known[known] = user_ids[positions[known]] == leave[known, 0]
+    leave, positions = leave[known], positions[known]
+
+    # +1 on the first day and -1 after the last, so a running sum marks each span
+    np.add.at(marks, (positions, leave[:, 1]), 1)
+    np.add.at(marks, (positions, leave[:, 2] + 1), -1)
+    return np.cumsum(marks, axis=1)[:, :days] > 0
+
+def compute_period(user_ids, punches, working, leave=None):
+    """Reduce a period's punches to per-employee totals for the given employees, excusing leave (load_leave)"""
+    user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+    employees = len(user_ids)
+
+    # Map punches to employee positions, dropping employees not being paid
+    positions = np.searchsorted(user_ids, punches[:, USER])
+    known = positions < employees
+    known[known] = user_ids[positions[known]] == punches[known, USER]
+    punches = punches[known]
+    positions = positions[known]
+
+    day = punches[:, DAY]
+    attended = punches[:, ATTENDED] == 1
+    working_day = working[day]
+
+    # Overtime beyond the shift on working days, all time worked on rest days
+    threshold = np.where(working_day, SHIFT_MINUTES, 0)
+    overtime = np.where(attended, np.clip(punches[:, WORKED] - threshold, 0, None), 0)
+
+    shift_start = SHIFT_START.hour * 3600 + SHIFT_START.minute * 60
+    late = np.where(
+        attended & working_day & (punches[:, CHECK_IN] >= 0),
+        np.clip(punches[:, CHECK_IN] - shift_start, 0, None) // 60,
+        0
+    )
+
+    present = np.zeros((employees, len(working)), dtype=bool)
+    present[positions[attended], day[attended]] = True
+
+    return PeriodAttendance(
+        user_ids=user_ids,
+        worked_minutes=np.bincount(positions, weights=punches[:, WORKED] * attended, minlength=employees).astype(np.int64),
+        overtime_minutes=np.bincount(positions, weights=overtime, minlength=employees).astype(np.int64),
+        late_minutes=np.bincount(positions, weights=late, minlength=employees).astype(np.int64),
+        days_present=present.sum(axis=1),
+        absences=(working & ~present & ~leave_days(user_ids, leave, len(working))).sum(axis=1)
+    )
+
+def period_attendance(month, year, user_ids, department_id=None):
+    """Attendance totals for a payroll period, for the given employees of a department or the company"""
+    return compute_period(user_ids, load_period(month, year, department_id),
+                          working_days(month, year, through=date.today()), load_leave(month, year, department_id))
+
+def overtime_statement(month, year):
+    """Overtime minutes per employee for a period, as a grouped SELECT applying compute_period's rule"""
+    working = working_days(month, year, through=date.today())
+    rest_days = (np.flatnonzero(~working) + 1).tolist()
+    day = cast(extract('day', Attendance.date), Integer)
+
+    overtime = case(
+        (Attendance.status == 'absent', 0),
+        (day.in_(rest_days), Attendance.worked_minutes),
+        (Attendance.worked_minutes > SHIFT_MINUTES, Attendance.worked_minutes - SHIFT_MINUTES),
+        else_=0
+    )
+    return (
+        select(Attendance.user_id.label('user_id'), func.sum(overtime).label('overtime_minutes'))
+        .where(Attendance.date >= date(year, month, 1), Attendance.date <= period_end(month, year))
+        .group_by(Attendance.user_id)
+    )
+
+def overtime_hours(minutes):
+    """Overtime minutes as hours for Payroll.overtime_hours"""
+    return (Decimal(int(minutes)) / 60).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+def overtime_rate(basic_salary):
+    """Hourly overtime rate for a monthly basic salary"""
+    return (Decimal(basic_salary) / STANDARD_MONTHLY_HOURS * OVERTIME_MULTIPLIER).quantize(
+        Decimal('0.01'), rounding=ROUND_HALF_UP
+    )
+
+def period_salaries(on, department_id=None):
+    """User ids and basic salaries in cents of the salaried employees employed through a period's end"""
+    rows = db.session.connection().execute(
+        select(User.id, cast(func.round(User.salary * 100), BigInteger))
+        .where(*employed_through(on), User.salary > 0, in_department(User.id, department_id))
+        .order_by(User.id)
+    ).all()
+
+    salaries = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 2).reshape(-1, 2)
+    return salaries[:, 0], salaries[:, 1]
+
+def compute_payroll(salary_cents, overtime_minutes, on, allowances_cents=0, other_deductions_cents=0):
+    """Payroll amounts in cents, with the statutory deductions in effect on a date"""
+    multiplier, multiplier_scale = OVERTIME_MULTIPLIER.as_integer_ratio()
+    hours, hours_scale = STANDARD_MONTHLY_HOURS.as_integer_ratio()
+
+    rate = round_div(salary_cents * multiplier * hours_scale, multiplier_scale * hours)
+    centihours = round_div(overtime_minutes * 100, 60)
+    overtime_pay = round_div(centihours * rate, 100)
+
+    allowances = np.broadcast_to(np.asarray(allowances_cents, dtype=np.int64), salary_cents.shape)
+    other_deductions = np.broadcast_to(np.asarray(other_deductions_cents, dtype=np.int64), salary_cents.shape)
+
+    gross = salary_cents + allowances + overtime_pay
+    statutory = compute_deductions(gross, on)
+    deductions = statutory['paye'] + statutory['health'] + statutory['nssf'] + other_deductions
+    return {
+        'basic_salary': salary_cents,
+        'allowances': allowances,
+        'overtime_hours': centihours,
+        'overtime_rate': rate,
+        'overtime_pay': overtime_pay,
+        'gross_pay': gross,
+        'tax_deduction': statutory['paye'],
+        'nhif_deduction': statutory['health'],
+        'nssf_deduction': statutory['nssf'],
+        'other_deductions': other_deductions,
+        'total_deductions': deductions,
+        'net_pay': gross - deductions
+    }
+
+def payroll_rows(user_ids, amounts, on, **values):
+    """Payroll column dicts from compute_payroll's cents, stamped with the statutory tables used"""
+    columns = list(amounts)
+    version = tables_version(on)
+    return [
+        {
+            'user_id': user_id,
+            **values,
+            **{column: Decimal(cents).scaleb(-2) for column, cents in zip(columns, row)},
+            'statutory_version': version
+        }
+        for user_id, row in zip(np.asarray(user_ids).tolist(), np.column_stack(list(amounts.values())).tolist())
+    ]
+
+def generate_period_payroll(month, year, department_id=None):
+    """Insert payroll for every salaried employee of the period not yet paid for it; returns rows added
+
+    The unique (month, year, user_id) index is the duplicate guard, so
+    concurrent runs for the same period cannot pay anyone twice. With a
+    department_id only that department's employees are paid. The caller
+    commits.
+    """
+    on = period_end(month, year)
+    user_ids, salary_cents = period_salaries(on, department_id)
+    if not len(user_ids):
+        return 0
+
+    overtime = period_attendance(month, year, user_ids, department_id).overtime_minutes
+    rows = payroll_rows(user_ids, compute_payroll(salary_cents, overtime, on), on,
+                        month=month, year=year)
+
+    def period_count():
+        return db.session.scalar(select(func.count(Payroll.id)).where(
+            Payroll.month == month, Payroll.year == year, in_department(Payroll.user_id, department_id)
+        ))
+
+    before = period_count()
+    db.session.execute(
+        upsert(Payroll.__table__).on_conflict_do_nothing(index_elements=['month', 'year', 'user_id']),
+        rows
+    )
+    return period_count() - before
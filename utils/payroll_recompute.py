@@ -0,0 +1,219 @@
+"""
+Incremental payroll recompute
+
+Finds, in the database, the employees of a computed period whose inputs no
+longer match their payroll row and recomputes only those:
+
+- salary: User.salary differs from the stored basic salary
+- overtime: the period's attendance gives different overtime hours
+- deductions: the row was priced with other statutory tables, or its totals
+  no longer add up after a hand edit of allowances or other deductions
+- hires: salaried employees hired by the end of the period, still active or
+  terminated after it, without a row
+- terminations: rows of employees no longer salaried, whose employment
+  ended before or inside the period, or who were hired after it
+
+Generation (payroll_engine.period_salaries) pays the same employees, as
+both filter on employed_through.
+
+Employees deactivated without a termination date, or terminated after the
+period, keep their row and are reported as inactive.
+
+Rows already linked to a payment are never rewritten; they are reported so
+the difference can be settled as an adjustment. The result is a diff report
+of every field that changed.
+"""
+
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import BigInteger, bindparam, cast, exists, func, or_, select
+from models import Payroll, Payslip, User, db
+from utils.attendance import upsert
+from utils.payroll_engine import compute_payroll, employed_through, overtime_statement, payroll_rows, period_end
+from utils.statutory import tables_version
+
+# Payroll columns recomputed from the inputs, compared in cents
+COMPUTED_FIELDS = ['basic_salary', 'overtime_hours', 'overtime_rate', 'overtime_pay', 'gross_pay', 'tax_deduction',
+                   'nhif_deduction', 'nssf_deduction', 'total_deductions', 'net_pay']
+
+class PayrollChange:
+    """One employee's entry in a recompute diff"""
+
+    def __init__(self, user_id, action, changes=None):
+        self.user_id = user_id
+        self.action = action  # added, updated, removed, paid, inactive
+        self.changes = changes or {}
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'action': self.action,
+            'changes': {field: [None if old is None else str(old), str(new)]
+                        for field, (old, new) in self.changes.items()}
+        }
+
+class PayrollDiff:
+    """What a recompute changed in a period, or would change on a dry run"""
+
+    def __init__(self, month, year, dry_run=False):
+        self.month = month
+        self.year = year
+        self.dry_run = dry_run
+        self.checked = 0  # Candidate employees recomputed
+        self.changes = []
+
+    def count(self, action):
+        return sum(1 for change in self.changes if change.action == action)
+
+    def summary(self):
+        counts = ', '.join(f'{self.count(action)} {action}' for action in ('added', 'updated', 'removed', 'paid', 'inactive'))
+        return f'{self.month}/{self.year}: {self.checked} employees recomputed; {counts}'
+
+    def to_dict(self):
+        return {
+            'month': self.month,
+            'year': self.year,
+            'dry_run': self.dry_run,
+            'checked': self.checked,
+            'summary': self.summary(),
+            'changes': [change.to_dict() for change in self.changes]
+        }
+
+def in_cents(column):
+    return cast(func.round(column * 100), BigInteger)
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+def is_paid(row):
+    return row.payment_id is not None or row.payment_status not in (None, 'pending')
+
+def changed_rows(month, year, version):
+    """Stored rows whose inputs changed, with those inputs and the stored amounts in cents"""
+    overtime = overtime_statement(month, year).subquery()
+    overtime_minutes = func.coalesce(overtime.c.overtime_minutes, 0)
+    # Stored overtime hours in hundredths, as compute_payroll rounds minutes
+    overtime_centihours = (overtime_minutes * 200 + 60) // 120
+    allowances = func.coalesce(Payroll.allowances, 0)
+    other_deductions = func.coalesce(Payroll.other_deductions, 0)
+
+    statement = (
+        select(
+            Payroll.id, Payroll.user_id, Payroll.payment_id, Payroll.payment_status,
+            User.is_active, User.hire_date, User.termination_date, in_cents(User.salary).label('salary'), overtime_minutes.label('overtime_minutes'),
+            in_cents(allowances).label('allowances'), in_cents(other_deductions).label('other_deductions'),
+            *(in_cents(getattr(Payroll, field)).label(field) for field in COMPUTED_FIELDS)
+        )
+        .join(User, Payroll.user_id == User.id)
+        .outerjoin(overtime, overtime.c.user_id == Payroll.user_id)
+        .where(Payroll.month == month, Payroll.year == year, or_(
+            User.is_active.isnot(True), User.hire_date > period_end(month, year), User.salary.is_(None), User.salary <= 0,
+            in_cents(User.salary) != in_cents(Payroll.basic_salary),
+            overtime_centihours != in_cents(Payroll.overtime_hours),
+            Payroll.statutory_version.is_(None), Payroll.statutory_version != version,
+            in_cents(Payroll.basic_salary + allowances + Payroll.overtime_pay) != in_cents(Payroll.gross_pay),
+            in_cents(Payroll.tax_deduction + Payroll.nhif_deduction + Payroll.nssf_deduction +
+                     other_deductions) != in_cents(Payroll.total_deductions)
+        ))
+        .order_by(Payroll.user_id)
+    )
+    return db.session.execute(statement).all()
+
+def ended_by(row, on):
+    """Whether a changed_rows row's employee was terminated by `on` or only hired after it"""
+    hired_after = row.hire_date is not None and row.hire_date > on
+    return hired_after or (not row.is_active and row.termination_date is not None and row.termination_date <= on)
+
+def hired_rows(month, year):
+    """Salaried employees employed in the period without a row for it, with their inputs"""
+    overtime = overtime_statement(month, year).subquery()
+    statement = (
+        select(User.id, in_cents(User.salary).label('salary'),
+               func.coalesce(overtime.c.overtime_minutes, 0).label('overtime_minutes'))
+        .outerjoin(overtime, overtime.c.user_id == User.id)
+        .where(*employed_through(period_end(month, year)), User.salary > 0, ~exists().where(
+            Payroll.user_id == User.id, Payroll.month == month, Payroll.year == year
+        ))
+        .order_by(User.id)
+    )
+    return db.session.execute(statement).all()
+
+def recompute_period_payroll(month, year, dry_run=False):
+    """Recompute only the employees whose payroll inputs changed; returns a PayrollDiff
+
+    The caller commits. On a dry run nothing is written.
+    """
+    on = period_end(month, year)
+    version = tables_version(on)
+    diff = PayrollDiff(month, year, dry_run)
+
+    stored = changed_rows(month, year, version)
+    hired = hired_rows(month, year)
+    diff.checked = len(stored) + len(hired)
+
+    removed, kept = [], []
+    for row in stored:
+        eligible = row.salary is not None and row.salary > 0 and not ended_by(row, on)
+        paid = is_paid(row)
+        if not eligible:
+            diff.changes.append(PayrollChange(row.user_id, 'paid' if paid else 'removed'))
+            if not paid:
+                removed.append(row.id)
+        else:
+            kept.append(row)
+
+    updates = []
+    if kept:
+        amounts = compute_payroll(
+            np.array([row.salary for row in kept], dtype=np.int64),
+            np.array([row.overtime_minutes for row in kept], dtype=np.int64),
+            on,
+            np.array([row.allowances for row in kept], dtype=np.int64),
+            np.array([row.other_deductions for row in kept], dtype=np.int64)
+        )
+        for position, row in enumerate(kept):
+            changes = {
+                field: (from_cents(getattr(row, field)), from_cents(amounts[field][position]))
+                for field in COMPUTED_FIELDS
+                if getattr(row, field) != amounts[field][position]
+            }
+            paid = is_paid(row)
+            if paid and changes:
+                diff.changes.append(PayrollChange(row.user_id, 'paid', changes))
+            elif not row.is_active:
+                # Deactivated after the period or without a termination date: kept, but reported
+                diff.changes.append(PayrollChange(row.user_id, 'inactive', changes))
+            elif changes:
+                diff.changes.append(PayrollChange(row.user_id, 'updated', changes))
+            if not paid:
+                # Unchanged rows are still restamped so they are not candidates again
+                updates.append({
+                    'payroll_id': row.id,
+                    'statutory_version': version,
+                    **{field: from_cents(amounts[field][position]) for field in COMPUTED_FIELDS}
+                })
+
+    added = []
+    if hired:
+        user_ids = np.array([row.id for row in hired], dtype=np.int64)
+        amounts = compute_payroll(np.array([row.salary for row in hired], dtype=np.int64),
+                                  np.array([row.overtime_minutes for row in hired], dtype=np.int64), on)
+        added = payroll_rows(user_ids, amounts, on, month=month, year=year)
+        diff.changes.extend(
+            PayrollChange(row['user_id'], 'added', {field: (None, row[field]) for field in COMPUTED_FIELDS})
+            for row in added
+        )
+
+    if dry_run:
+        return diff
+
+    table = Payroll.__table__
+    if updates:
+        db.session.execute(table.update().where(table.c.id == bindparam('payroll_id')), updates)
+    if removed:
+        db.session.execute(db.delete(Payslip).where(Payslip.payroll_id.in_(removed)))
+        db.session.execute(table.delete().where(table.c.id.in_(removed)))
+    if added:
+        db.session.execute(upsert(table).on_conflict_do_nothing(index_elements=['month', 'year', 'user_id']), added)
+
+    return diff
@@ -0,0 +1,301 @@
+"""
+Resumable, parallel payroll runs
+
+A PayrollRun splits a period into one unit per department. Units execute on
+a process pool, and each commits its payroll rows together with its own
+'completed' checkpoint, so after a crash a resumed run only executes the
+units that never committed.
+
+The run row doubles as the period's lock: it is claimed by a conditional
+UPDATE that only succeeds while no live coordinator holds it, so two admins
+cannot run the same period at once. A coordinator refreshes heartbeat_at
+from a timer thread while units execute, however long one takes; a
+'running' run whose heartbeat is older than
+PAYROLL_RUN_STALE_SECONDS is taken to have crashed and can be claimed again.
+Recomputes hold the same lock through period_lock for as long as they write.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_, select, update
+from models import PayrollRun, PayrollRunUnit, User, db
+from utils.attendance import upsert
+from utils.metrics import PAYROLL_RUN_SECONDS
+from utils.payroll_engine import employed_through, generate_period_payroll, period_end
+
+class PayrollRunLocked(Exception):
+    """The period's payroll run is already being executed"""
+
+def get_or_create_run(month, year):
+    """The period's run, created as pending if there is none"""
+    db.session.execute(
+        upsert(PayrollRun.__table__).on_conflict_do_nothing(index_elements=['month', 'year']),
+        {'month': month, 'year': year, 'status': 'pending', 'employees': 0}
+    )
+    db.session.commit()
+    return PayrollRun.query.filter_by(month=month, year=year).one()
+
+def stale_before():
+    """Heartbeats older than this belong to crashed coordinators"""
+    return datetime.utcnow() - timedelta(seconds=current_app.config['PAYROLL_RUN_STALE_SECONDS'])
+
+@contextmanager
+def period_lock(month, year):
+    """Hold the period's run lock, raising PayrollRunLocked while a live coordinator has it
+
+    The run's status and heartbeat are swapped for 'running' by a conditional
+    UPDATE and restored on exit, so a concurrent generate or recompute of the
+    period fails to claim it. The caller commits its writes inside the block.
+    """
+    run = get_or_create_run(month, year)
+    status, heartbeat_at = run.status, run.heartbeat_at
+    now = datetime.utcnow()
+
+    result = db.session.execute(
+        update(PayrollRun)
+        .where(PayrollRun.id == run.id, PayrollRun.status == status, or_(
+            PayrollRun.status != 'running', PayrollRun.heartbeat_at < stale_before()
+        ))
+        .values(status='running', heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        raise PayrollRunLocked(f'Payroll for {month}/{year} is being generated')
+
+    try:
+        yield run
+    finally:
+        db.session.rollback()
+        db.session.execute(
+            update(PayrollRun)
+            .where(PayrollRun.id == run.id, PayrollRun.status == 'running', PayrollRun.heartbeat_at == now)
+            .values(status=status, heartbeat_at=heartbeat_at)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+def claim_run(run, started_by=None):
+    """Take the period's lock: pending, failed and stale running runs can be claimed"""
+    now = datetime.utcnow()
+    stale = stale_before()
+
+    result = db.session.execute(
+        update(PayrollRun)
+        .where(PayrollRun.id == run.id, or_(
+            PayrollRun.status.in_(['pending', 'failed']),
+            and_(PayrollRun.status == 'running', PayrollRun.heartbeat_at < stale)
+        ))
+        .values(status='running', started_by=started_by, started_at=now, heartbeat_at=now,
+                finished_at=None, error=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    if result.rowcount != 1:
+        raise PayrollRunLocked(f'Payroll for {run.month}/{run.year} is already being generated')
+    db.session.refresh(run)
+
+def touch_run(run_id, model=PayrollRun):
+    """Refresh a running run's heartbeat"""
+    db.session.execute(
+        update(model).where(model.id == run_id, model.status == 'running')
+        .values(heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+@contextmanager
+def heartbeat(run_id, interval=None, model=PayrollRun):
+    """Refresh the run's (or another model's job's) heartbeat from a timer thread while the block executes"""
+    app = current_app._get_current_object()
+    interval = interval or max(1, app.config['PAYROLL_RUN_STALE_SECONDS'] / 3)
+    stopped = threading.Event()
+
+    def beat():
+        with app.app_context():
+            try:
+                while not stopped.wait(interval):
+                    try:
+                        touch_run(run_id, model)
+                    except Exception:
+                        db.session.rollback()
+                        app.logger.warning('%s %s: heartbeat failed', model.__name__, run_id, exc_info=True)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=beat, daemon=True, name=f'{model.__tablename__}-heartbeat-{run_id}')
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+def plan_units(run):
+    """Add a unit for every department with salaried employees in the period that the run does not cover yet"""
+    departments = set(db.session.scalars(
+        select(User.department_id)
+        .where(*employed_through(period_end(run.month, run.year)), User.salary > 0).distinct()
+    ))
+    planned = set(db.session.scalars(select(PayrollRunUnit.department_id).where(PayrollRunUnit.run_id == run.id)))
+
+    missing = sorted(departments - planned)
+    if missing:
+        db.session.execute(db.insert(PayrollRunUnit), [
+            {'run_id': run.id, 'department_id': department_id, 'status': 'pending'}
+            for department_id in missing
+        ])
+    db.session.commit()
+
+def run_unit(unit_id):
+    """Generate one department's payroll and checkpoint the unit in the same transaction"""
+    unit = db.session.get(PayrollRunUnit, unit_id)
+    if unit.status == 'completed':
+        return unit_id, 0, None
+
+    try:
+        employees = generate_period_payroll(unit.run.month, unit.run.year, department_id=unit.department_id)
+        unit.status = 'completed'
+        unit.employees = employees
+        unit.error = None
+        unit.completed_at = datetime.utcnow()
+        db.session.commit()
+        return unit_id, employees, None
+    except Exception as e:
+        db.session.rollback()
+        error = f'{type(e).__name__}: {e}'
+        db.session.execute(update(PayrollRunUnit).where(PayrollRunUnit.id == unit_id)
+                           .values(status='failed', error=error))
+        db.session.commit()
+        return unit_id, 0, error
+
+# Application of a pool worker process, created once by its initializer
+_worker_app = None
+
+def _init_worker():
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+def _run_unit_in_worker(unit_id):
+    with _worker_app.app_context():
+        try:
+            return run_unit(unit_id)
+        finally:
+            db.session.remove()
+
+def unit_results(unit_ids, workers):
+    """(unit id, employees, error) for each unit as it finishes, inline or on a process pool"""
+    if workers <= 1:
+        for unit_id in unit_ids:
+            yield run_unit(unit_id)
+        return
+
+    # Spawned rather than forked: workers must not share the parent's connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(_run_unit_in_worker, unit_id) for unit_id in unit_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+def execute_run(run_id, workers=None):
+    """Execute a claimed run's outstanding units, checkpointing progress on the run row"""
+    run = db.session.get(PayrollRun, run_id)
+    pending = [unit.id for unit in run.units if unit.status != 'completed']
+    workers = workers or current_app.config['PAYROLL_WORKERS'] or os.cpu_count() or 1
+    workers = max(1, min(workers, len(pending)))
+    run.workers = workers
+    db.session.commit()
+
+    started = time.perf_counter()
+    failures = []
+    try:
+        with heartbeat(run_id):
+            for unit_id, employees, error in unit_results(pending, workers):
+                if error:
+                    failures.append(unit_id)
+                    current_app.logger.error('Payroll run %s/%s: unit %s failed: %s',
+                                             run.month, run.year, unit_id, error)
+                db.session.execute(
+                    update(PayrollRun).where(PayrollRun.id == run_id)
+                    .values(employees=PayrollRun.employees + employees, heartbeat_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        finish_run(run_id, 'failed', f'{type(e).__name__}: {e}')
+        PAYROLL_RUN_SECONDS.labels(outcome='error').observe(time.perf_counter() - started)
+        raise
+
+    if failures:
+        finish_run(run_id, 'failed', f'{len(failures)} of {len(pending)} departments failed')
+    else:
+        finish_run(run_id, 'completed')
+    PAYROLL_RUN_SECONDS.labels(outcome='error' if failures else 'success').observe(time.perf_counter() - started)
+
+    return db.session.get(PayrollRun, run_id)
+
+def finish_run(run_id, status, error=None):
+    db.session.execute(
+        update(PayrollRun).where(PayrollRun.id == run_id)
+        .values(status=status, error=error, finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def _execute_in_background(app, run_id):
+    with app.app_context():
+        try:
+            execute_run(run_id)
+        except Exception:
+            app.logger.exception('Payroll run %s failed', run_id)
+        finally:
+            db.session.remove()
+
+def start_payroll_run(month, year, started_by=None, background=False, workers=None):
+    """Claim and execute (or resume) the period's payroll run; None when it already completed
+
+    Raises PayrollRunLocked while another coordinator holds the period. In
+    the background the run executes on a daemon thread and the claimed run
+    is returned straight away.
+    """
+    run = get_or_create_run(month, year)
+    if run.status == 'completed':
+        return None
+
+    claim_run(run, started_by)
+    plan_units(run)
+
+    if background:
+        app = current_app._get_current_object()
+        threading.Thread(target=_execute_in_background, args=(app, run.id), daemon=True,
+                         name=f'payroll-run-{month}-{year}').start()
+        return run
+
+    return execute_run(run.id, workers)
+
+def run_progress(run):
+    """JSON-ready status of a run and its units"""
+    completed = sum(1 for unit in run.units if unit.status == 'completed')
+    return {
+        'id': run.id,
+        'month': run.month,
+        'year': run.year,
+        'status': run.status,
+        'workers': run.workers,
+        'employees': run.employees,
+        'units': len(run.units),
+        'units_completed': completed,
+        'units_failed': [unit.department_id for unit in run.units if unit.status == 'failed'],
+        'error': run.error,
+        'started_at': run.started_at.isoformat() if run.started_at else None,
+        'finished_at': run.finished_at.isoformat() if run.finished_at else None
+    }
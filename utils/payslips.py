@@ -0,0 +1,436 @@
+"""
+Payslip rendering and distribution
+
+Payslips are rendered from a period's Payroll rows as HTML or PDF into
+PAYSLIP_DIR. Each Payslip row records the content hash of what it shows:
+the payroll amounts, the employee details, the format and the template.
+A re-run only renders payroll rows whose hash changed (or whose file is
+missing), and only emails payslips whose hash differs from the one last
+sent.
+
+Rendering runs on a pool of PAYSLIP_WORKERS processes in chunks; workers
+write files atomically and return their hashes, and the coordinator records
+them one chunk per transaction. Emails go out in batches of
+PAYSLIP_EMAIL_BATCH, each over one SMTP connection from app.mail, with the
+batch marked as sent in the same commit. Progress and throughput are
+logged while a job runs and saved on the period's PayslipJob row.
+
+The PayslipJob row is also the period's lock, claimed like a PayrollRun:
+a conditional UPDATE succeeds only while no live job holds the period, so
+two workers or admins never render and email the same period at once. A
+running job refreshes its heartbeat from a timer thread and is taken to
+have crashed once it is older than PAYROLL_RUN_STALE_SECONDS.
+
+PDF output needs the optional WeasyPrint package, imported on first use.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from flask import current_app, render_template
+from flask_mail import Message
+from sqlalchemy import bindparam, or_, select, update
+from app import mail
+from models import Department, Payroll, Payslip, PayslipJob, User, db
+from utils.attendance import upsert
+from utils.payroll_runs import heartbeat, stale_before
+from utils.metrics import EMAIL_SEND_SECONDS, track_duration
+
+TEMPLATE = 'payslips/payslip.html'
+
+FORMATS = {
+    'html': 'text/html',
+    'pdf': 'application/pdf'
+}
+
+# Payslips per worker task, and per transaction recording them
+RENDER_CHUNK = 50
+
+# Seconds between progress lines
+PROGRESS_INTERVAL = 2.0
+
+class PayslipJobLocked(Exception):
+    """The period's payslips are already being generated"""
+
+class PayslipProgress:
+    """Counts and throughput of a payslip job, logged and saved to its PayslipJob row as it advances"""
+
+    def __init__(self, month, year, fmt, email=False, job_id=None):
+        self.month = month
+        self.year = year
+        self.format = fmt
+        self.email = email
+        self.job_id = job_id
+        self.status = 'running'
+        self.stage = 'rendering'  # rendering, emailing
+        self.total = 0
+        self.rendered = 0
+        self.skipped = 0  # Unchanged since the last run
+        self.emailed = 0
+        self.email_failed = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self.seconds = None  # Set when the job finishes
+        self._reported = 0.0
+
+    @property
+    def elapsed(self):
+        return self.seconds if self.seconds is not None else time.perf_counter() - self.started
+
+    def rate(self, count):
+        return count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def save(self, **values):
+        """Write the counters to the job row, which the status endpoint reads from any process"""
+        if self.job_id is None:
+            return
+        db.session.execute(
+            update(PayslipJob).where(PayslipJob.id == self.job_id)
+            .values(stage=self.stage, total=self.total, rendered=self.rendered, skipped=self.skipped,
+                    emailed=self.emailed, email_failed=self.email_failed, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        self.save()
+        self.log()
+
+    def log(self):
+        line = (f"Payslips {self.month}/{self.year} {self.stage}: {self.rendered + self.skipped}/{self.total} "
+                f"({self.rendered} rendered at {self.rate(self.rendered):.1f}/s, {self.skipped} unchanged)")
+        if self.email:
+            line += f", {self.emailed} emailed at {self.rate(self.emailed):.1f}/s, {self.email_failed} failed"
+        current_app.logger.info(line)
+
+    def finish(self, status='completed', error=None):
+        self.status = status
+        self.error = error
+        self.seconds = time.perf_counter() - self.started
+        self.save(status=status, error=error, finished_at=datetime.utcnow())
+        self.log()
+
+def payslip_dir():
+    return current_app.config['PAYSLIP_DIR']
+
+def payslip_path(month, year, payroll_id, fmt):
+    """File of a payslip, relative to PAYSLIP_DIR"""
+    return os.path.join(f'{year}-{month:02d}', f'payslip-{payroll_id}.{fmt}')
+
+def payslip_statement(month=None, year=None, payroll_ids=None):
+    """What the payslips show, with the payslip already rendered for each row"""
+    statement = (
+        select(
+            Payroll.id.label('payroll_id'), Payroll.month, Payroll.year, User.employee_id, User.first_name,
+            User.last_name, User.email, User.position, Department.name.label('department'),
+            Payroll.basic_salary, Payroll.allowances, Payroll.overtime_hours, Payroll.overtime_rate,
+            Payroll.overtime_pay, Payroll.gross_pay, Payroll.tax_deduction, Payroll.nhif_deduction,
+            Payroll.nssf_deduction, Payroll.other_deductions, Payroll.total_deductions, Payroll.net_pay,
+            Payslip.format.label('stored_format'), Payslip.content_hash.label('stored_hash'),
+            Payslip.path.label('stored_path')
+        )
+        .join(User, Payroll.user_id == User.id)
+        .outerjoin(Department, User.department_id == Department.id)
+        .outerjoin(Payslip, Payslip.payroll_id == Payroll.id)
+        .order_by(Payroll.id)
+    )
+    if payroll_ids is not None:
+        statement = statement.where(Payroll.id.in_(payroll_ids))
+    else:
+        statement = statement.where(Payroll.month == month, Payroll.year == year)
+    return statement
+
+def payslip_data(row):
+    """The fields a payslip shows, from a payslip_statement row"""
+    data = {key: value for key, value in row._mapping.items() if not key.startswith('stored_')}
+    for field in ('allowances', 'overtime_hours', 'overtime_pay', 'other_deductions'):
+        if data[field] is None:
+            data[field] = 0
+    return data
+
+def template_digest():
+    """Hash of the payslip template source, so editing it re-renders every payslip"""
+    source, _, _ = current_app.jinja_env.loader.get_source(current_app.jinja_env, TEMPLATE)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+def content_hash(data, fmt, template):
+    """Hash of everything that makes up a rendered payslip"""
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{fmt}\n{template}\n{payload}'.encode()).hexdigest()
+
+def render_payslip(data, fmt):
+    """A payslip's file content as bytes"""
+    html = render_template(TEMPLATE, slip=data, period=f"{data['month']:02d}/{data['year']}")
+    if fmt == 'html':
+        return html.encode('utf-8')
+
+    try:
+        from weasyprint import HTML
+    except ImportError:
+        raise RuntimeError('PDF payslips need WeasyPrint: pip install weasyprint')
+    return HTML(string=html).write_pdf()
+
+def write_file(path, content):
+    """Write a file so readers never see it half written"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f'{path}.{os.getpid()}.tmp'
+    with open(partial, 'wb') as output:
+        output.write(content)
+    os.replace(partial, path)
+
+def render_chunk(tasks, fmt, directory):
+    """Render and write (payroll id, hash, data) tasks; returns the Payslip rows to record"""
+    rendered_at = datetime.utcnow()
+    rows = []
+    for payroll_id, digest, data in tasks:
+        path = payslip_path(data['month'], data['year'], payroll_id, fmt)
+        content = render_payslip(data, fmt)
+        write_file(os.path.join(directory, path), content)
+        rows.append({'payroll_id': payroll_id, 'format': fmt, 'content_hash': digest, 'path': path,
+                     'size': len(content), 'rendered_at': rendered_at})
+    return rows
+
+# Application of a pool worker process, created once by its initializer
+_worker_app = None
+
+def _init_worker():
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+def _render_in_worker(tasks, fmt, directory):
+    with _worker_app.app_context():
+        return render_chunk(tasks, fmt, directory)
+
+def chunk_results(tasks, fmt, workers):
+    """Payslip rows of each rendered chunk as it finishes, inline or on a process pool"""
+    chunks = [tasks[start:start + RENDER_CHUNK] for start in range(0, len(tasks), RENDER_CHUNK)]
+    directory = payslip_dir()
+    if workers <= 1:
+        for chunk in chunks:
+            yield render_chunk(chunk, fmt, directory)
+        return
+
+    # Spawned rather than forked: workers must not share the parent's connections
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(_render_in_worker, chunk, fmt, directory) for chunk in chunks]
+        for future in as_completed(futures):
+            yield future.result()
+
+def record_payslips(rows):
+    """Insert or refresh the Payslip rows of rendered payslips"""
+    statement = upsert(Payslip.__table__)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['payroll_id'],
+        set_={column: statement.excluded[column] for column in ('format', 'content_hash', 'path', 'size',
+                                                                'rendered_at')}
+    ), rows)
+
+def outdated_payslips(rows, fmt, force=False):
+    """(payroll id, hash, data) of rows whose payslip is missing or shows something else"""
+    directory = payslip_dir()
+    template = template_digest()
+    tasks = []
+    for row in rows:
+        data = payslip_data(row)
+        digest = content_hash(data, fmt, template)
+        fresh = (row.stored_hash == digest and row.stored_format == fmt and
+                 os.path.exists(os.path.join(directory, row.stored_path)))
+        if force or not fresh:
+            tasks.append((row.payroll_id, digest, data))
+    return tasks
+
+def render_payslips(month, year, fmt, workers=1, progress=None, force=False):
+    """Render the period's new and changed payslips; returns how many were rendered"""
+    rows = db.session.execute(payslip_statement(month, year)).all()
+    tasks = outdated_payslips(rows, fmt, force)
+    if progress:
+        progress.total = len(rows)
+        progress.skipped = len(rows) - len(tasks)
+        progress.report(force=True)
+
+    workers = max(1, min(workers, -(-len(tasks) // RENDER_CHUNK)))
+    rendered = 0
+    for payslips in chunk_results(tasks, fmt, workers):
+        record_payslips(payslips)
+        db.session.commit()
+        rendered += len(payslips)
+        if progress:
+            progress.rendered = rendered
+            progress.report()
+    return rendered
+
+def payslip_message(payslip, user, month, year):
+    message = Message(
+        subject=f'Payslip for {month:02d}/{year} - Mutech Civil',
+        recipients=[user.email],
+        body=(f"Dear {user.first_name},\n\nYour payslip for {month:02d}/{year} is attached.\n\n"
+              f"Best regards,\nMutech Civil HRM System")
+    )
+    with open(os.path.join(payslip_dir(), payslip.path), 'rb') as attachment:
+        message.attach(os.path.basename(payslip.path), FORMATS[payslip.format], attachment.read())
+    return message
+
+def email_payslips(month, year, progress=None):
+    """Email the period's payslips not yet sent in their current version; returns how many were sent"""
+    pending = db.session.execute(
+        select(Payslip, User)
+        .join(Payroll, Payslip.payroll_id == Payroll.id)
+        .join(User, Payroll.user_id == User.id)
+        .where(Payroll.month == month, Payroll.year == year, User.email.isnot(None),
+               or_(Payslip.emailed_hash.is_(None), Payslip.emailed_hash != Payslip.content_hash))
+        .order_by(Payslip.id)
+    ).all()
+
+    batch_size = current_app.config['PAYSLIP_EMAIL_BATCH']
+    table = Payslip.__table__
+    mark_sent = table.update().where(table.c.id == bindparam('payslip_id'))
+    emailed = 0
+    for start in range(0, len(pending), batch_size):
+        sent = []
+        with mail.connect() as connection:
+            for payslip, user in pending[start:start + batch_size]:
+                try:
+                    with track_duration(EMAIL_SEND_SECONDS):
+                        connection.send(payslip_message(payslip, user, month, year))
+                    sent.append({'payslip_id': payslip.id, 'emailed_hash': payslip.content_hash,
+                                 'emailed_at': datetime.utcnow()})
+                except Exception as e:
+                    current_app.logger.error('Error emailing payslip %s to %s: %s', payslip.id, user.email, e)
+                    if progress:
+                        progress.email_failed += 1
+
+        if sent:
+            db.session.execute(mark_sent, sent)
+        db.session.commit()
+        emailed += len(sent)
+        if progress:
+            progress.emailed = emailed
+            progress.report()
+    return emailed
+
+def claim_payslip_job(month, year, fmt, email=False, started_by=None):
+    """Take the period's payslip lock; returns the job id, raises PayslipJobLocked while a live job holds it"""
+    db.session.execute(
+        upsert(PayslipJob.__table__).on_conflict_do_nothing(index_elements=['month', 'year']),
+        {'month': month, 'year': year, 'status': 'pending', 'email': False, 'total': 0, 'rendered': 0,
+         'skipped': 0, 'emailed': 0, 'email_failed': 0}
+    )
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(PayslipJob)
+        .where(PayslipJob.month == month, PayslipJob.year == year, or_(
+            PayslipJob.status != 'running', PayslipJob.heartbeat_at < stale_before()
+        ))
+        .values(status='running', format=fmt, email=email, stage='rendering', total=0, rendered=0, skipped=0,
+                emailed=0, email_failed=0, error=None, started_by=started_by, started_at=now,
+                heartbeat_at=now, finished_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    if result.rowcount != 1:
+        raise PayslipJobLocked(f'Payslips for {month}/{year} are already being generated')
+    return db.session.scalar(select(PayslipJob.id).where(PayslipJob.month == month, PayslipJob.year == year))
+
+def generate_payslips(month, year, fmt=None, email=False, workers=None, force=False, progress=None):
+    """Render the period's changed payslips, then optionally email them; returns the PayslipProgress
+
+    Claims the period's job unless given the progress of one already claimed.
+    """
+    fmt = fmt or current_app.config['PAYSLIP_FORMAT']
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown payslip format: {fmt}')
+    workers = workers or current_app.config['PAYSLIP_WORKERS'] or os.cpu_count() or 1
+    if progress is None:
+        progress = PayslipProgress(month, year, fmt, email, claim_payslip_job(month, year, fmt, email))
+
+    try:
+        with heartbeat(progress.job_id, model=PayslipJob):
+            render_payslips(month, year, fmt, workers, progress, force)
+            if email:
+                progress.stage = 'emailing'
+                email_payslips(month, year, progress)
+    except Exception as e:
+        db.session.rollback()
+        progress.finish('failed', f'{type(e).__name__}: {e}')
+        raise
+
+    progress.finish()
+    return progress
+
+def payslip_file(payroll, fmt):
+    """Absolute path of a payroll row's payslip, rendered first if missing or outdated"""
+    rows = db.session.execute(payslip_statement(payroll_ids=[payroll.id])).all()
+    tasks = outdated_payslips(rows, fmt)
+    if tasks:
+        record_payslips(render_chunk(tasks, fmt, payslip_dir()))
+        db.session.commit()
+    return os.path.join(payslip_dir(), payslip_path(payroll.month, payroll.year, payroll.id, fmt))
+
+def _generate_in_background(app, progress, workers):
+    with app.app_context():
+        try:
+            generate_payslips(progress.month, progress.year, progress.format, progress.email, workers,
+                              progress=progress)
+        except Exception:
+            app.logger.exception('Payslips %s/%s failed', progress.month, progress.year)
+        finally:
+            db.session.remove()
+
+def start_payslip_job(month, year, fmt=None, email=False, workers=None, started_by=None):
+    """Claim the period and generate its payslips on a daemon thread; None while a job holds the period"""
+    fmt = fmt or current_app.config['PAYSLIP_FORMAT']
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown payslip format: {fmt}')
+
+    try:
+        job_id = claim_payslip_job(month, year, fmt, email, started_by)
+    except PayslipJobLocked:
+        return None
+    progress = PayslipProgress(month, year, fmt, email, job_id)
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_generate_in_background, args=(app, progress, workers), daemon=True,
+                     name=f'payslips-{month}-{year}').start()
+    return progress
+
+def payslip_job(month, year):
+    """The period's latest payslip job, from whichever process ran it"""
+    return PayslipJob.query.filter_by(month=month, year=year).first()
+
+def job_progress(job):
+    """JSON-ready progress and throughput of a payslip job"""
+    seconds = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds() if job.started_at else 0
+
+    def rate(count):
+        return round(count / seconds, 1) if seconds > 0 else 0.0
+
+    return {
+        'month': job.month,
+        'year': job.year,
+        'format': job.format,
+        'status': job.status,
+        'stage': job.stage,
+        'total': job.total,
+        'rendered': job.rendered,
+        'skipped': job.skipped,
+        'emailed': job.emailed,
+        'email_failed': job.email_failed,
+        'seconds': round(seconds, 3),
+        'rendered_per_second': rate(job.rendered),
+        'emailed_per_second': rate(job.emailed),
+        'error': job.error,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
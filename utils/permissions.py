@@ -2,7 +2,10 @@
 Permission and role management utilities
 """
 
-from models import Permission, Role, Department, db
+import zlib
+from flask import has_request_context, session
+from sqlalchemy import inspect
+from models import Permission, Role, Department, db, user_roles, role_permissions
 
 # Define all permissions
 PERMISSIONS = {
@@ -172,6 +175,108 @@ ROLES = {
     }
 }
 
+# Each known permission maps to one bit of a user's compiled permission mask.
+# The fingerprint changes whenever the catalogue changes, so masks compiled
+# against an older ordering are never reused.
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+PERMISSIONS_FINGERPRINT = zlib.crc32('|'.join(PERMISSIONS).encode())
+
+SESSION_KEY = '_permissions'
+
+class CompiledPermissions:
+    """Role names and permission bitmask of one user at one version"""
+    
+    __slots__ = ('stamp', 'roles', 'mask', 'extra')
+    
+    def __init__(self, stamp, roles, mask, extra=()):
+        self.stamp = tuple(stamp)
+        self.roles = frozenset(roles)
+        self.mask = mask
+        self.extra = frozenset(extra)  # Permissions outside PERMISSIONS
+    
+    def allows(self, permission_name):
+        """Check a permission in constant time"""
+        bit = PERMISSION_BITS.get(permission_name)
+        if bit is None:
+            return permission_name in self.extra
+        return bool(self.mask & bit)
+    
+    def is_current(self, user):
+        """Check whether this compiled set still matches the user"""
+        return self.stamp == permission_stamp(user)
+    
+    def to_session(self):
+        return {
+            'stamp': list(self.stamp),
+            'roles': sorted(self.roles),
+            'mask': self.mask,
+            'extra': sorted(self.extra)
+        }
+    
+    @classmethod
+    def from_session(cls, data):
+        return cls(data['stamp'], data['roles'], data['mask'], data['extra'])
+
+def permission_stamp(user):
+    """Version stamp identifying a user's current role/permission membership"""
+    return (user.id, user.permissions_version or 0, PERMISSIONS_FINGERPRINT)
+
+def compile_permissions(user):
+    """Compile a user's roles and permissions into a CompiledPermissions"""
+    state = inspect(user)
+    roles_loaded = 'roles' not in state.unloaded and all(
+        'permissions' not in inspect(role).unloaded for role in user.roles
+    )
+    
+    if user.id is None or roles_loaded:
+        # Everything is already in memory, no SQL needed
+        pairs = [(role.name, None) for role in user.roles]
+        pairs += [(role.name, permission.name) for role in user.roles for permission in role.permissions]
+    else:
+        # One round trip instead of a lazy load per role
+        pairs = db.session.query(Role.name, Permission.name).select_from(user_roles).join(
+            Role, Role.id == user_roles.c.role_id
+        ).outerjoin(
+            role_permissions, role_permissions.c.role_id == Role.id
+        ).outerjoin(
+            Permission, Permission.id == role_permissions.c.permission_id
+        ).filter(user_roles.c.user_id == user.id).all()
+    
+    roles = set()
+    extra = set()
+    mask = 0
+    for role_name, permission_name in pairs:
+        roles.add(role_name)
+        if permission_name is None:
+            continue
+        bit = PERMISSION_BITS.get(permission_name)
+        if bit is None:
+            extra.add(permission_name)
+        else:
+            mask |= bit
+    
+    return CompiledPermissions(permission_stamp(user), roles, mask, extra)
+
+def load_compiled_permissions(user):
+    """Get a user's compiled permissions, reusing the copy cached in their login session"""
+    stamp = permission_stamp(user)
+    
+    # Only the logged-in user's set is kept in the session cookie
+    in_session = (has_request_context() and user.id is not None and
+                  session.get('_user_id') == str(user.id))
+    
+    if in_session:
+        cached = session.get(SESSION_KEY)
+        if cached and tuple(cached.get('stamp', ())) == stamp:
+            return CompiledPermissions.from_session(cached)
+    
+    compiled = compile_permissions(user)
+    
+    if in_session:
+        session[SESSION_KEY] = compiled.to_session()
+    
+    return compiled
+
 def create_permissions():
     """Create all permissions in the database"""
     for name, description in PERMISSIONS.items():
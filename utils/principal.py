@@ -0,0 +1,28 @@
+"""
+Principal loading for Flask-Login
+
+Every authenticated request touches the user's department, employee profile
+and permissions (dashboards, department_access_required, the base.html nav).
+The department and profile are loaded with the user. Roles and permissions
+are not: has_permission reads the compiled set cached in the login session
+while the user's permissions_version matches, and only a stale set is
+recompiled, with one query.
+"""
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from models import User, db
+
+def principal_options():
+    """Loader options fetching the user with their department and employee profile in one statement"""
+    return [
+        joinedload(User.department),
+        joinedload(User.employee_profile)
+    ]
+
+def load_principal(user_id):
+    """Load the logged-in user according to the PRINCIPAL_LOADER setting"""
+    if current_app.config.get('PRINCIPAL_LOADER', 'eager') == 'lazy':
+        return db.session.get(User, user_id)
+
+    return db.session.get(User, user_id, options=principal_options())
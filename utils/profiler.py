@@ -0,0 +1,137 @@
+"""
+Sampling request profiler
+
+Opt-in with PROFILER_ENABLED. A sampled fraction of requests
+(PROFILER_SAMPLE_RATE), or any request an administrator sends with the
+PROFILER_HEADER header, is profiled by a background thread that snapshots
+the request thread's stack every PROFILER_INTERVAL seconds.
+
+Samples are aggregated per endpoint into collapsed-stack files
+(<endpoint>.<pid>.folded in PROFILER_OUTPUT) that flamegraph.pl, speedscope
+or inferno read directly. Each stack is rooted at the endpoint followed by
+[sql], [render] or [app], so database and Jinja time stand apart in the graph.
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import current_app, g, request
+from flask.signals import before_render_template, template_rendered
+from flask_login import current_user
+
+# {endpoint: Counter({collapsed stack: samples})} for this process
+_profiles = defaultdict(Counter)
+_profiles_lock = threading.Lock()
+
+class StackSampler(threading.Thread):
+    """Samples another thread's call stack at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.samples
+
+def _frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+def collapse_stack(frame):
+    """Outermost-first 'module:function' labels joined by ';'"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+def stack_category(stack):
+    """[sql] while in the database driver, [render] inside Jinja, else [app]"""
+    if 'sqlalchemy.engine.default:do_execute' in stack or 'sqlalchemy.engine.default:do_executemany' in stack:
+        return '[sql]'
+    if ';jinja2.' in stack or 'flask.templating:_render' in stack:
+        return '[render]'
+    return '[app]'
+
+def profile_path(output, endpoint):
+    return os.path.join(output, f'{endpoint}.{os.getpid()}.folded')
+
+def record_profile(output, endpoint, samples):
+    """Merge a request's samples into the endpoint's collapsed-stack file"""
+    with _profiles_lock:
+        profile = _profiles[endpoint]
+        for stack, count in samples.items():
+            profile[f'{endpoint};{stack_category(stack)};{stack}'] += count
+
+        os.makedirs(output, exist_ok=True)
+        with open(profile_path(output, endpoint), 'w') as folded:
+            for stack, count in profile.most_common():
+                folded.write(f'{stack} {count}\n')
+
+def _should_profile():
+    config = current_app.config
+    if request.headers.get(config['PROFILER_HEADER']):
+        return current_user.is_authenticated and current_user.has_role('admin')
+    return random.random() < config['PROFILER_SAMPLE_RATE']
+
+def init_profiler(app):
+    """Profile sampled or admin-requested requests when PROFILER_ENABLED"""
+    if not app.config.get('PROFILER_ENABLED'):
+        return
+
+    if not app.config.get('PROFILER_OUTPUT'):
+        app.config['PROFILER_OUTPUT'] = os.path.join(app.instance_path, 'profiles')
+
+    # The per-request line is logged at INFO, below the logger's inherited level
+    if app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def start_profiler():
+        if request.endpoint and _should_profile():
+            g.profile_started = time.perf_counter()
+            g.render_time = 0.0
+            g.profiler = StackSampler(threading.get_ident(), current_app.config['PROFILER_INTERVAL'])
+            g.profiler.start()
+
+    def start_render(sender, template, context, **extra):
+        if 'profiler' in g:
+            g.render_started = time.perf_counter()
+
+    def finish_render(sender, template, context, **extra):
+        if 'profiler' in g and 'render_started' in g:
+            g.render_time += time.perf_counter() - g.pop('render_started')
+
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(finish_render, app, weak=False)
+
+    @app.teardown_request
+    def stop_profiler(exception=None):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return
+
+        samples = sampler.stop()
+        record_profile(current_app.config['PROFILER_OUTPUT'], request.endpoint, samples)
+
+        total = (time.perf_counter() - g.profile_started) * 1000
+        stats = g.get('query_stats')
+        sql = f'{stats.duration_ms:.1f} ms SQL ({stats.count} queries)' if stats else 'SQL not measured'
+        current_app.logger.info('Profiled %s: %.1f ms, %s, %.1f ms render, %d samples', request.endpoint, total,
+                                sql, g.render_time * 1000, sum(samples.values()))
@@ -0,0 +1,128 @@
+"""
+Per-request SQL query statistics
+
+Cursor events on the application's engine count and time every statement
+run while a request (or a capture_queries() block) is active. Each response
+carries the totals in a Server-Timing header; statements repeated
+QUERY_REPEAT_THRESHOLD or more times in one request are reported as likely
+N+1 patterns together with the endpoint that ran them.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import current_app, g, request
+from sqlalchemy import event
+
+# Active QueryStats for the current thread, innermost last
+_active = threading.local()
+
+class QueryStats:
+    """Statements run and time spent in the database"""
+
+    def __init__(self):
+        self.statements = []
+        self.duration = 0.0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration_ms(self):
+        return self.duration * 1000
+
+    def record(self, statement, duration):
+        self.statements.append(statement)
+        self.duration += duration
+
+    def repeated(self, threshold):
+        """Statements run at least threshold times, most frequent first"""
+        return [(statement, count) for statement, count in Counter(self.statements).most_common()
+                if count >= threshold]
+
+    def server_timing(self):
+        return f'db;desc="{self.count} queries";dur={self.duration_ms:.2f}'
+
+def _captures():
+    if not hasattr(_active, 'stack'):
+        _active.stack = []
+    return _active.stack
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _captures() and context is not None:
+        context.query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'query_started', None)
+    if started is not None:
+        duration = time.perf_counter() - started
+        for stats in _captures():
+            stats.record(statement, duration)
+
+@contextmanager
+def capture_queries():
+    """Collect the statements run inside the block into a QueryStats"""
+    stats = QueryStats()
+    captures = _captures()
+    captures.append(stats)
+    try:
+        yield stats
+    finally:
+        captures.remove(stats)
+
+@contextmanager
+def assert_max_queries(budget, label='block'):
+    """Fail if the block runs more than budget statements"""
+    with capture_queries() as stats:
+        yield stats
+
+    if stats.count > budget:
+        listing = '\n'.join(stats.statements)
+        raise AssertionError(f'{label} ran {stats.count} queries, budget is {budget}:\n{listing}')
+
+def init_query_stats(app):
+    """Instrument the app's engine and report query totals per request"""
+    with app.app_context():
+        from models import db
+        engine = db.engine
+
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    # The per-request line is logged at INFO, below the logger's inherited level
+    if app.config.get('QUERY_STATS_LOG', False) and app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def start_query_stats():
+        if current_app.config.get('QUERY_STATS', False):
+            g.query_stats = QueryStats()
+            _captures().append(g.query_stats)
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+
+        response.headers.add('Server-Timing', stats.server_timing())
+
+        endpoint = request.endpoint or request.path
+        for statement, count in stats.repeated(current_app.config.get('QUERY_REPEAT_THRESHOLD', 5)):
+            current_app.logger.warning('Possible N+1 in %s (%s %s): %d x %s', endpoint, request.method,
+                                       request.path, count, ' '.join(statement.split())[:200])
+
+        if current_app.config.get('QUERY_STATS_LOG', False):
+            current_app.logger.info('%s %s [%s]: %d queries in %.1f ms', request.method, request.path, endpoint,
+                                    stats.count, stats.duration_ms)
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(exception=None):
+        stats = g.pop('query_stats', None)
+        if stats is not None and stats in _captures():
+            _captures().remove(stats)
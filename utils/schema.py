@@ -0,0 +1,87 @@
+"""
+Schema upgrade utilities
+
+Tables are created with db.create_all() (see init_db.py), which never alters a
+table that already exists. Columns and indexes added to the models after a
+database was first created are applied here so existing deployments pick them
+up on the next release.
+"""
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from models import db
+
+def _column_ddl(table, column):
+    """Build an ALTER TABLE ... ADD COLUMN statement for a model column"""
+    preparer = db.engine.dialect.identifier_preparer
+    column_type = column.type.compile(dialect=db.engine.dialect)
+    ddl = f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}'
+
+    # Existing rows need a server default before the column can be NOT NULL
+    if column.server_default is not None:
+        default = column.server_default.arg
+        default = getattr(default, 'text', default)
+        ddl += f" DEFAULT '{default}'" if isinstance(default, str) and not default.isdigit() else f' DEFAULT {default}'
+        if not column.nullable:
+            ddl += ' NOT NULL'
+
+    return ddl
+
+def add_missing_columns():
+    """Add model columns that are missing from existing tables"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+
+    for table in db.metadata.tables.values():
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                with db.engine.begin() as connection:
+                    connection.execute(text(_column_ddl(table, column)))
+                added.append(f'{table.name}.{column.name}')
+
+    return added
+
+def create_missing_indexes():
+    """Create model indexes that are missing from existing tables"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+
+    for table in db.metadata.tables.values():
+        if table.name not in existing_tables:
+            continue
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+
+            try:
+                index.create(bind=db.engine)
+                created.append(index.name)
+            except DBAPIError as e:
+                # A unique index fails while duplicate rows exist; those must be
+                # cleaned up by hand before the index can be created
+                print(f"Error creating index {index.name}: {e.orig}")
+
+    return created
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models; returns the columns added"""
+    db.create_all()
+
+    added = add_missing_columns()
+    for name in added:
+        print(f"Added column {name}")
+
+    created = create_missing_indexes()
+    for name in created:
+        print(f"Created index {name}")
+
+    print("Schema upgrade completed!")
+    return added